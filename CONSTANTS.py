@@ -1,3 +1,4 @@
+import re
 from enum import Enum
 
 # Regex for the commands
@@ -5,7 +6,19 @@ REP_PLUS = r"(\++REP|REP\++)"
 REP_MINUS = r"(-+REP|REP-+)"
 CLOSE = r"(!CLOSE|CLOSE!)"
 MOD = r"(!MOD|MOD!)"
-REP_LOGS = r"!REPLOGS ([A-Za-z0-9_-]+) (\d+)"
+REP_LOGS = r"!REPLOGS (?P<replogs_user>[A-Za-z0-9_-]+) (?P<replogs_days>\d+)"
+
+# All the commands in one pattern, tried in this order. The name of the matched group is the command name.
+COMMAND_PATTERN = re.compile(f"(?P<rep_plus>{REP_PLUS})|(?P<close>{CLOSE})|(?P<rep_minus>{REP_MINUS})"
+                             f"|(?P<mod>{MOD})|(?P<rep_logs>{REP_LOGS})", re.I)
+# First characters of the commands, backslash is added by the fancy pants editor when escaping
+COMMAND_FIRST_CHARACTERS = frozenset('+-!RrCcMm\\')
+
+# Submission flairs of trading posts
+TRADING_FLAIR_PATTERN = re.compile(r"Trade\sOffer|Giveaway\sEntry")
+
+# Wiki page holding the bot config
+CONFIG_WIKI_PAGE = 'marketmm2botsconfig/rep_bot_config'
 
 # User Flairs
 REP_FLAIR_ID = '13e6e140-2b0c-11ec-8a70-0a847492ab37'
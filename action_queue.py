@@ -0,0 +1,202 @@
+import itertools
+import os
+import time
+import traceback
+from collections import OrderedDict
+from threading import Condition, Thread, current_thread
+
+import prawcore
+
+import api_counter
+
+# Actions waiting to be sent before enqueue blocks
+ACTION_QUEUE_SIZE = int(os.getenv('ACTION_QUEUE_SIZE', 500))
+# Attempts for an action failing with a temporary error
+MAX_ATTEMPTS = 5
+# Requests kept in reserve before the sender waits for the rate limit window to reset
+RATE_LIMIT_RESERVE = 5
+TEMPORARY_ERRORS = (prawcore.exceptions.ServerError, prawcore.exceptions.RequestException,
+                    prawcore.exceptions.TooManyRequests)
+
+_condition = Condition()
+# Pending actions in the order they were queued, keyed so that a newer action can replace an older one. Each holds its
+# attempt number and the monotonic time before which it is not sent, set when a temporary error is retried.
+_pending = OrderedDict()
+_unique_keys = itertools.count()
+_sender = None
+_running = False
+stats = {'sent': 0, 'coalesced': 0, 'retried': 0, 'failed': 0}
+
+
+def enqueue(function, *args, key=None, on_done=None):
+    """
+    Queues a Reddit action to be run by the sender thread. If an action with the same key is still waiting, it is
+    replaced by this one, e.g. only the latest flair of a user is set.
+
+    :param function: Function making the Reddit API calls.
+    :param args: Arguments of the function.
+    :param key: Optional key identifying what the action changes.
+    :param on_done: Optional function called once the action has been sent. Kept when the action is replaced.
+    """
+    callbacks = [on_done] if on_done is not None else []
+    # The API calls of the action count for the command that queued it
+    command = api_counter.current_command()
+    commands = [command] if command is not None else []
+    with _condition:
+        if key is not None and key in _pending:
+            _, _, queued_callbacks, queued_commands, attempt, not_before = _pending[key]
+            _pending[key] = (function, args, queued_callbacks + callbacks, queued_commands + commands, attempt,
+                             not_before)
+            stats['coalesced'] += 1
+            return
+        # The sender queues follow up actions itself and must not wait on its own queue
+        while len(_pending) >= ACTION_QUEUE_SIZE and current_thread() is not _sender:
+            _condition.wait()
+        _pending[key if key is not None else next(_unique_keys)] = (function, args, callbacks, commands, 1, 0)
+        _condition.notify_all()
+
+
+def _wait_for_rate_limit(reddit):
+    """
+    Sleeps until the rate limit window resets if the remaining requests are almost used up.
+
+    :param reddit: The reddit instance whose rate limit headers are checked.
+    """
+    limits = reddit.auth.limits
+    if limits.get('remaining') is not None and limits['remaining'] < RATE_LIMIT_RESERVE:
+        time.sleep(max(limits['reset_timestamp'] - time.time(), 0))
+
+
+def _run(function, args, callbacks, attempt, on_error) -> bool:
+    """
+    Runs the action, then runs its callbacks.
+
+    :param function: Function making the Reddit API calls.
+    :param args: Arguments of the function.
+    :param callbacks: Functions called after the action has been sent.
+    :param attempt: Number of the attempt, starting at 1.
+    :param on_error: Function called with the traceback if the action or a callback fails.
+    :return: True if the action failed with a temporary error and is to be tried again later otherwise False.
+    """
+    try:
+        function(*args)
+        stats['sent'] += 1
+    except TEMPORARY_ERRORS:
+        if attempt < MAX_ATTEMPTS:
+            stats['retried'] += 1
+            return True
+        stats['failed'] += 1
+        on_error(traceback.format_exc())
+        return False
+    except Exception:
+        stats['failed'] += 1
+        on_error(traceback.format_exc())
+        return False
+
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception:
+            on_error(traceback.format_exc())
+    return False
+
+
+def _retry_later(key, function, args, callbacks, commands, attempt):
+    """
+    Queues the action again to be sent after an exponential backoff, so that the sender goes on with the other actions
+    meanwhile. If a newer action with the same key was queued while this one was sent, the newer one is retried
+    instead, as it would have replaced this one.
+
+    :param key: Key of the action in the queue.
+    :param function: Function making the Reddit API calls.
+    :param args: Arguments of the function.
+    :param callbacks: Functions called after the action has been sent.
+    :param commands: CommandCalls the API calls of the action are counted for.
+    :param attempt: Number of the attempt that failed.
+    """
+    not_before = time.monotonic() + 2 ** attempt
+    with _condition:
+        if key in _pending:
+            function, args, newer_callbacks, newer_commands, _, _ = _pending[key]
+            callbacks, commands = callbacks + newer_callbacks, commands + newer_commands
+        _pending[key] = (function, args, callbacks, commands, attempt + 1, not_before)
+        _condition.notify_all()
+
+
+def _next_due():
+    """
+    Waits for the first queued action that is due to be sent and takes it from the queue. Must be called holding the
+    condition.
+
+    :return: tuple of the key and the action, or None once the queue is stopped and empty.
+    """
+    while True:
+        now = time.monotonic()
+        for key, action in _pending.items():
+            if action[5] <= now:
+                del _pending[key]
+                _condition.notify_all()
+                return key, action
+        if not _pending and not _running:
+            return None
+        # Actions waiting for their retry are still sent when stopping
+        _condition.wait(min(action[5] for action in _pending.values()) - now if _pending else None)
+
+
+def _send(reddit, on_error):
+    """
+    Sends the queued actions one at a time until the queue is stopped and empty.
+
+    :param reddit: The reddit instance whose rate limit headers are checked.
+    :param on_error: Function called with the traceback of actions that failed.
+    """
+    while True:
+        with _condition:
+            due = _next_due()
+        if due is None:
+            return
+        key, (function, args, callbacks, commands, attempt, _) = due
+        _wait_for_rate_limit(reddit)
+        # A replaced action sent the arguments of the newest command, the calls count for that one. The commands are
+        # only released once the action is done with, retries included.
+        with api_counter.counting_for(commands[-1] if commands else None, []):
+            retry = _run(function, args, callbacks, attempt, on_error)
+        if retry:
+            _retry_later(key, function, args, callbacks, commands, attempt)
+        else:
+            for command in commands:
+                api_counter.release(command)
+
+
+def start(reddit, on_error):
+    """
+    Starts the sender thread.
+
+    :param reddit: The reddit instance whose rate limit headers are checked.
+    :param on_error: Function called with the traceback of actions that failed.
+    """
+    global _sender, _running
+    _running = True
+    _sender = Thread(target=_send, args=(reddit, on_error), name="action-sender")
+    _sender.start()
+
+
+def stop():
+    """
+    Sends the remaining actions and waits for the sender thread to exit.
+    """
+    global _running
+    with _condition:
+        _running = False
+        _condition.notify_all()
+    if _sender is not None:
+        _sender.join()
+
+
+def queue_depth() -> int:
+    """
+    Gets the number of actions waiting to be sent.
+
+    :return: number of pending actions.
+    """
+    return len(_pending)
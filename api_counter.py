@@ -0,0 +1,132 @@
+from contextlib import contextmanager
+from threading import Lock, local
+
+import prawcore
+
+import metrics
+
+# Upper bounds of the histogram of API calls per command
+API_CALL_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12)
+
+_local = local()
+_lock = Lock()
+# Number of commands and the Reddit API calls they made, keyed by command name
+_command_totals = {}
+
+
+class CountingRequestor(prawcore.Requestor):
+    """
+    Requestor that counts the Reddit API calls made for the command of the current thread and records their latency.
+    Passed to praw.Reddit as requestor_class.
+    """
+
+    def request(self, *args, **kwargs):
+        count_call()
+        method = args[0] if args else kwargs.get('method')
+        with metrics.timed('reddit_request_seconds', method=method):
+            response = super().request(*args, **kwargs)
+        metrics.inc('reddit_requests_total', method=method, status=response.status_code)
+        return response
+
+
+class CommandCalls:
+    """
+    API calls of one command. Replies, flairs and reports of the command are sent later by other threads, so the
+    command is only added to the totals once it has finished and the last of that work has been done.
+    """
+
+    def __init__(self, command_name):
+        self.command_name = command_name
+        self.api_calls = 0
+        # The command itself and its actions that have not been sent yet
+        self.open = 1
+
+
+def count_call():
+    """
+    Counts one Reddit API call for the command the current thread works on.
+    """
+    command = getattr(_local, 'command', None)
+    if command is not None:
+        with _lock:
+            command.api_calls += 1
+
+
+def start_command(command_name):
+    """
+    Starts counting the API calls of a command processed by the current thread.
+
+    :param command_name: Name of the command.
+    """
+    _local.command = CommandCalls(command_name)
+
+
+def finish_command():
+    """
+    Stops counting on the current thread. The command is added to the totals now or, if it queued actions, once the
+    last of them has been sent.
+    """
+    command = getattr(_local, 'command', None)
+    _local.command = None
+    if command is not None:
+        release(command)
+
+
+def current_command():
+    """
+    Gets the command of the current thread so that work it hands to another thread can be counted for it. The command
+    stays open until release is called for that work.
+
+    :return: CommandCalls of the command or None outside a command.
+    """
+    command = getattr(_local, 'command', None)
+    if command is not None:
+        with _lock:
+            command.open += 1
+    return command
+
+
+@contextmanager
+def counting_for(command, released):
+    """
+    Counts the API calls made by the current thread in the block for the command, then releases the commands whose
+    work the block did. Used by the threads doing work queued by the commands.
+
+    :param command: CommandCalls the calls are counted for, can be None.
+    :param released: CommandCalls returned by current_command for the work done in the block.
+    """
+    _local.command = command
+    try:
+        yield
+    finally:
+        _local.command = None
+        for released_command in released:
+            release(released_command)
+
+
+def release(command):
+    """
+    Closes the command or one of the actions it queued, and adds the command to the totals once nothing of it is left
+    open.
+
+    :param command: CommandCalls of the command.
+    """
+    with _lock:
+        command.open -= 1
+        if command.open:
+            return
+        totals = _command_totals.setdefault(command.command_name, [0, 0])
+        totals[0] += 1
+        totals[1] += command.api_calls
+    metrics.observe('command_api_calls', command.api_calls, buckets=API_CALL_BUCKETS, command=command.command_name)
+
+
+def stats() -> dict:
+    """
+    Gets the average number of API calls per command, counting the actions the commands queued.
+
+    :return: dictionary keyed by command name with the number of commands and the API calls per command.
+    """
+    with _lock:
+        return {command_name: {'commands': commands, 'api_calls_per_command': api_calls / commands}
+                for command_name, (commands, api_calls) in _command_totals.items()}
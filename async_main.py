@@ -0,0 +1,314 @@
+import asyncio
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+import asyncpg
+import asyncpraw
+import asyncprawcore
+import praw
+import schedule
+
+import comment_dispatcher
+import discord_notifier
+import stream_state
+import subreddits
+
+# Comments read per request of the comment listing, the most Reddit returns
+LISTING_LIMIT = 100
+# Reddit listings go back at most this many comments
+BACKFILL_LIMIT = 1000
+# Seconds between two reads of the newest comments, doubled while no new comment arrives up to the maximum
+POLL_MIN_SECONDS = 1
+POLL_MAX_SECONDS = 16
+# Seconds between two saves of the stream resume point
+SAVE_STREAM_STATE_SECONDS = 10
+
+_loop = None
+_executor = None
+_handler = None
+_on_error = None
+_stopping = False
+# Bounds the comments handed to the executor and not processed yet, like the queues of the threaded workers
+_in_flight = None
+# Lock of every submission with comments in flight and the number of those comments, by submission fullname
+_submission_locks = {}
+_tasks = set()
+
+
+class RedditSource:
+    """
+    Reads the comment listings with asyncpraw and turns them into PRAW comments for the command handlers, which are
+    written against the synchronous API and run on the executor.
+    """
+
+    def __init__(self, async_reddit, reddit):
+        self._async_reddit = async_reddit
+        self._reddit = reddit
+
+    async def comments(self, subreddit_name, after=None) -> list:
+        """
+        Gets a page of the newest comments of the subreddit.
+
+        :param subreddit_name: Display name of the subreddit, several can be joined with +.
+        :param after: Fullname of the comment the page starts after, None for the newest comments.
+        :return: list of PRAW comments, newest first.
+        """
+        params = {'limit': LISTING_LIMIT}
+        if after is not None:
+            params['after'] = after
+        listing = await self._async_reddit.request(method='GET', path=f"r/{subreddit_name}/comments", params=params)
+        # The listing holds the whole comment, so it is not fetched again when the handlers read it
+        return [praw.models.Comment(self._reddit, _data=child['data']) for child in listing['data']['children']]
+
+
+async def create_db_pool(**server_settings):
+    """
+    Creates the asyncpg pool used by the event loop for its own database work. The command handlers keep using db_pool
+    from the executor threads.
+
+    :param server_settings: Optional settings of the connections, e.g. search_path.
+    :return: asyncpg Pool.
+    """
+    return await asyncpg.create_pool(os.getenv('DATABASE_URL'),
+                                     ssl=os.getenv('DB_SSLMODE', 'require'),
+                                     min_size=1,
+                                     max_size=2,
+                                     server_settings=server_settings or None)
+
+
+async def save_stream_state(db):
+    """
+    Saves the point a restart resumes the stream from if it moved since the last save.
+
+    :param db: asyncpg Pool.
+    """
+    mark = stream_state.unsaved_mark()
+    if mark is None:
+        return
+    await db.executemany("INSERT INTO bot_state (key, value) VALUES ($1, $2) "
+                         "ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value",
+                         [(stream_state.LAST_COMMENT_ID_KEY, mark[0]),
+                          (stream_state.LAST_COMMENT_UTC_KEY, repr(mark[1]))])
+    stream_state.mark_saved(mark)
+
+
+def start(handler, on_error):
+    """
+    Prepares the executor the comments are processed on. Must be called from the event loop.
+
+    :param handler: Function called with each comment on an executor thread. It should handle its own exceptions.
+    :param on_error: Function called with the traceback of errors of the event loop tasks.
+    """
+    global _loop, _executor, _handler, _on_error, _stopping, _in_flight
+    _loop = asyncio.get_running_loop()
+    _executor = ThreadPoolExecutor(max_workers=comment_dispatcher.WORKER_COUNT, thread_name_prefix="comment-worker")
+    _handler = handler
+    _on_error = on_error
+    _stopping = False
+    _in_flight = asyncio.Semaphore(comment_dispatcher.WORKER_COUNT * comment_dispatcher.WORKER_QUEUE_SIZE)
+
+
+def _process_locked(comment):
+    """
+    Runs the handler on an executor thread holding the lock of the author, the same lock the threaded workers, the
+    giveaway flushes and the resumed commands take.
+
+    :param comment: The comment that will be processed.
+    """
+    with comment_dispatcher.user_lock(comment.author.name if comment.author else None):
+        _handler(comment)
+
+
+async def _process(comment, submission_lock):
+    """
+    Processes the comment once the comments of the same submission submitted before it are done.
+
+    :param comment: The comment that will be processed.
+    :param submission_lock: Entry of the submission in _submission_locks.
+    """
+    try:
+        async with submission_lock[0]:
+            await _loop.run_in_executor(_executor, _process_locked, comment)
+    except Exception:
+        _on_error(traceback.format_exc())
+    finally:
+        submission_lock[1] -= 1
+        if submission_lock[1] == 0:
+            del _submission_locks[comment.link_id]
+        _in_flight.release()
+
+
+async def submit(comment):
+    """
+    Hands the comment to the executor, waiting while the most comments are in flight. Comments of the same submission
+    are processed in the order they were submitted, many others can be in flight at once.
+
+    :param comment: The comment that will be processed.
+    """
+    await _in_flight.acquire()
+    # Counted before the task starts so that the lock is kept for every comment already submitted
+    submission_lock = _submission_locks.setdefault(comment.link_id, [asyncio.Lock(), 0])
+    submission_lock[1] += 1
+    task = asyncio.create_task(_process(comment, submission_lock))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+def submit_threadsafe(comment):
+    """
+    Submits the comment from another thread, e.g. a retry timer. Blocks while the most comments are in flight.
+
+    :param comment: The comment that will be processed.
+    :raises RuntimeError: if the event loop is stopping or closed.
+    """
+    if _stopping:
+        raise RuntimeError("The event loop is stopping")
+    asyncio.run_coroutine_threadsafe(submit(comment), _loop).result()
+
+
+async def drain():
+    """
+    Waits for the comments in flight and shuts the executor down. Comments submitted from other threads meanwhile are
+    refused.
+    """
+    global _stopping
+    _stopping = True
+    while _tasks:
+        await asyncio.gather(*_tasks, return_exceptions=True)
+    _executor.shutdown()
+
+
+async def backfill(source, subreddit_name) -> int:
+    """
+    Pages through the newest comments back to the resume point and submits the missed ones, oldest first.
+
+    :param source: RedditSource the comments are read from.
+    :param subreddit_name: Display name of the subreddit, several can be joined with +.
+    :return: the number of comments submitted.
+    """
+    missed = []
+    after = None
+    read = 0
+    while read < BACKFILL_LIMIT:
+        page = await source.comments(subreddit_name, after)
+        read += len(page)
+        reached = False
+        for comment in page:
+            if stream_state.reached_resume_point(comment):
+                reached = True
+                break
+            if subreddits.owns(comment):
+                missed.append(comment)
+        if reached or len(page) < LISTING_LIMIT:
+            break
+        after = page[-1].fullname
+    submitted = 0
+    for comment in reversed(missed):
+        if stream_state.is_new(comment):
+            await submit(comment)
+            submitted += 1
+    return submitted
+
+
+async def listen(source, subreddit_name, backoff_seconds):
+    """
+    Catches up on the comments missed since the last processed comment, then polls the newest comments and submits
+    the new ones until cancelled. Reddit server errors are retried with the backoff of the threaded listener.
+
+    :param source: RedditSource the comments are read from.
+    :param subreddit_name: Display name of the subreddit, several can be joined with +.
+    :param backoff_seconds: Function giving the seconds to wait after the given number of failed attempts.
+    """
+    failed_attempt = 1
+    backfilled = False
+    delay = POLL_MIN_SECONDS
+    while True:
+        try:
+            if not backfilled:
+                missed = await backfill(source, subreddit_name)
+                backfilled = True
+                if missed:
+                    print(f"Backfilled {missed} comments")
+            comments = await source.comments(subreddit_name)
+        except Exception as exp:
+            _on_error(traceback.format_exc())
+            if isinstance(exp, (asyncprawcore.exceptions.ServerError, asyncprawcore.exceptions.RequestException)):
+                wait = backoff_seconds(failed_attempt)
+                print(f"Waiting {wait:.0f} seconds...")
+                await asyncio.sleep(wait)
+                failed_attempt += 1
+            continue
+        failed_attempt = 1
+        new_comments = [comment for comment in reversed(comments)
+                        if subreddits.owns(comment) and stream_state.is_new(comment)]
+        for comment in new_comments:
+            await submit(comment)
+        delay = POLL_MIN_SECONDS if new_comments else min(delay * 2, POLL_MAX_SECONDS)
+        await asyncio.sleep(delay)
+
+
+async def run_jobs(db):
+    """
+    Runs the scheduled jobs, which are blocking, on the default executor, and saves the stream resume point through
+    the asyncpg pool.
+
+    :param db: asyncpg Pool.
+    """
+    saved_at = time.monotonic()
+    while True:
+        await _loop.run_in_executor(None, schedule.run_pending)
+        if time.monotonic() - saved_at >= SAVE_STREAM_STATE_SECONDS:
+            try:
+                await save_stream_state(db)
+            except Exception:
+                _on_error(traceback.format_exc())
+            saved_at = time.monotonic()
+        await asyncio.sleep(1)
+
+
+async def run(reddit, handler, on_error, backoff_seconds, stop_workers):
+    """
+    Event loop version of the bot, selected by setting BOT_MODE to asyncio. The comment stream, the Discord messages
+    and the stream state saves are asynchronous, the commands run on the executor. Runs until cancelled, then lets the
+    comments in flight and the queued work finish.
+
+    :param reddit: The logged in PRAW instance used by the command handlers.
+    :param handler: Function called with each comment on an executor thread.
+    :param on_error: Function called with the traceback of errors of the event loop tasks.
+    :param backoff_seconds: Function giving the seconds to wait after the given number of failed attempts.
+    :param stop_workers: Function stopping the threads doing the work queued by the commands.
+    """
+    start(handler, on_error)
+    config = reddit.config
+    async_reddit = asyncpraw.Reddit(client_id=config.client_id,
+                                    client_secret=config.client_secret,
+                                    username=config.username,
+                                    password=config.password,
+                                    user_agent=config.user_agent)
+    db = await create_db_pool()
+    session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+    notifier = asyncio.create_task(discord_notifier.send_async(session))
+    source = RedditSource(async_reddit, reddit)
+    tasks = [asyncio.create_task(listen(source, '+'.join(subreddits.SUBREDDITS), backoff_seconds)),
+             asyncio.create_task(run_jobs(db))]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await drain()
+        await _loop.run_in_executor(None, stop_workers)
+        try:
+            await save_stream_state(db)
+        except Exception:
+            # Only means that the next run reads again the comments processed since the last save
+            _on_error(traceback.format_exc())
+        discord_notifier.stop_async()
+        await notifier
+        await session.close()
+        await db.close()
+        await async_reddit.close()
@@ -0,0 +1,194 @@
+"""
+Replays a comment stream through the asyncio mode of the bot: the event loop listener of async_main reads the comment
+listing of the fake Reddit in fake_reddit.py, submits the new comments to the executor under the user locks of the
+comment dispatcher, and saves the stream resume point through asyncpg. Reports the same measurements as replay.py,
+plus the event loop lag, and appends them to the same results file with the asyncio mode in the settings.
+
+The fake listing posts the next --batch comments of the stream every time the newest comments are read, so the
+listener sees the stream arrive batch by batch. Uses the bot_replay schema like replay.py:
+    DATABASE_URL=postgresql://localhost/postgres DB_SSLMODE=disable python benchmarks/async_replay.py --comments 5000
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import traceback
+from datetime import datetime, timezone
+from threading import Lock
+
+# Imported first, it puts the bot on the path and points the connections at the replay schema
+import replay
+import action_queue  # noqa: E402
+import api_counter  # noqa: E402
+import async_main  # noqa: E402
+import comment_dispatcher  # noqa: E402
+import db_pool  # noqa: E402
+import giveaway_burst  # noqa: E402
+import main  # noqa: E402
+import rep_manager  # noqa: E402
+import rep_reports  # noqa: E402
+import stream_state  # noqa: E402
+from fake_reddit import FakeReddit, load_stream  # noqa: E402
+
+SUBREDDIT_NAME = 'MarketMM2'
+# Seconds between two reads of the listing while comments arrive, instead of the one second of the bot
+POLL_MIN_SECONDS = 0.005
+
+
+class AsyncFakeSource:
+    """
+    Serves the comments of the fake Reddit as the comment listing, the way async_main.RedditSource serves the real
+    one. Every read counts as an API call and waits for the simulated latency without blocking the event loop.
+    """
+
+    def __init__(self, reddit, comments, batch):
+        self._reddit = reddit
+        self._comments = comments
+        self._batch = batch
+        self.posted = 0
+
+    async def comments(self, subreddit_name, after=None) -> list:
+        """
+        Gets a page of the newest comments, posting the next batch of the stream first when the newest are read.
+
+        :param subreddit_name: Display name of the subreddit.
+        :param after: Fullname of the comment the page starts after, None for the newest comments.
+        :return: list of fake comments, newest first.
+        """
+        self._reddit.count_call('comments')
+        if self._reddit.api_latency:
+            await asyncio.sleep(self._reddit.api_latency)
+        if after is None:
+            self.posted = min(self.posted + self._batch, len(self._comments))
+        listing = self._comments[self.posted - 1::-1] if self.posted else []
+        if after is not None:
+            listing = listing[[comment.fullname for comment in listing].index(after) + 1:]
+        return listing[:async_main.LISTING_LIMIT]
+
+
+async def measure_loop_lag(lags, interval=0.01):
+    """
+    Records how late the event loop wakes up from short sleeps, which shows whether anything blocks it.
+
+    :param lags: list the lags are appended to, in seconds.
+    :param interval: Seconds slept between two measurements.
+    """
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+
+
+async def replay_async(comments, reddit, workers, batch) -> dict:
+    """
+    Sends the comments through the asyncio listener and executor, and waits for them and for the queued replies and
+    flairs to finish.
+
+    :param comments: list of fake comments in stream order.
+    :param reddit: The FakeReddit instance.
+    :param workers: Number of executor threads.
+    :param batch: Comments posted between two reads of the listing, at most async_main.LISTING_LIMIT.
+    :return: dictionary of the measurements.
+    """
+    latencies = []
+    errors = []
+    lags = []
+    lock = Lock()
+
+    def handler(comment):
+        started = time.perf_counter()
+        try:
+            rep_manager.load_comment(comment)
+        except Exception:
+            with lock:
+                errors.append(traceback.format_exc())
+        stream_state.mark_processed(comment)
+        elapsed = time.perf_counter() - started
+        with lock:
+            processed.append(comment.id)
+            if rep_manager.classify_comment(comment.body) is not None:
+                latencies.append(elapsed)
+
+    processed = []
+    comment_dispatcher.WORKER_COUNT = workers
+    async_main.POLL_MIN_SECONDS = POLL_MIN_SECONDS
+    action_queue.start(reddit, errors.append)
+    rep_reports.start(errors.append)
+    giveaway_burst.start(rep_manager.process_giveaway_burst, errors.append)
+    async_main.start(handler, errors.append)
+    db = await async_main.create_db_pool(search_path=replay.REPLAY_SCHEMA)
+    source = AsyncFakeSource(reddit, comments, batch)
+    lag_monitor = asyncio.create_task(measure_loop_lag(lags))
+    calls_before = sum(reddit.calls.values())
+    started = time.perf_counter()
+    listener = asyncio.create_task(async_main.listen(source, SUBREDDIT_NAME, main.backoff_seconds))
+    while len(processed) < len(comments) and not listener.done():
+        await asyncio.sleep(0.01)
+    listener.cancel()
+    await asyncio.gather(listener, return_exceptions=True)
+    await async_main.drain()
+    processing_seconds = time.perf_counter() - started
+    await asyncio.get_running_loop().run_in_executor(None, main.stop_workers)
+    drained_seconds = time.perf_counter() - started
+    lag_monitor.cancel()
+    await async_main.save_stream_state(db)
+    saved_utc = await db.fetchval("SELECT value FROM bot_state WHERE key = $1", stream_state.LAST_COMMENT_UTC_KEY)
+    await db.close()
+
+    if errors:
+        print(f"{len(errors)} errors, the first one:\n{errors[0]}")
+    percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else [0.0] * 99
+    stream_reads = reddit.calls['comments']
+    return {'comments': len(comments),
+            'processed': len(processed),
+            'commands': len(latencies),
+            'errors': len(errors),
+            'comments_per_second': len(processed) / processing_seconds,
+            'drained_seconds': drained_seconds,
+            'p50_ms': percentiles[49] * 1000,
+            'p99_ms': percentiles[98] * 1000,
+            'max_loop_lag_ms': max(lags, default=0.0) * 1000,
+            'api_calls_per_command': {command: command_stats['api_calls_per_command']
+                                      for command, command_stats in api_counter.stats().items()},
+            # Every call of the commands as in replay.py, the reads of the listing are counted apart
+            'api_calls_per_command_overall': (sum(reddit.calls.values()) - calls_before - stream_reads)
+            / max(len(latencies), 1),
+            'stream_reads': stream_reads,
+            'resume_point_saved': saved_utc is not None and float(saved_utc) == comments[-1].created_utc,
+            'api_calls': dict(reddit.calls),
+            'actions': dict(action_queue.stats)}
+
+
+def main_async_replay():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--comments', type=int, default=2000, help="comments in the synthetic stream")
+    parser.add_argument('--users', type=int, default=300, help="distinct commenters in the synthetic stream")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the synthetic stream")
+    parser.add_argument('--workers', type=int, default=comment_dispatcher.WORKER_COUNT, help="executor threads")
+    parser.add_argument('--batch', type=int, default=50, help="comments posted between two reads of the listing")
+    parser.add_argument('--api-latency', type=float, default=0.0, help="simulated seconds per Reddit API call")
+    parser.add_argument('--results', default=replay.RESULTS_FILE, help="JSON lines file the result is appended to")
+    args = parser.parse_args()
+    if not 0 < args.batch <= async_main.LISTING_LIMIT:
+        parser.error(f"--batch must be between 1 and {async_main.LISTING_LIMIT}, larger batches would be missed")
+
+    records = replay.synthetic_stream(args.comments, args.users, args.seed)
+    replay.reset_schema()
+    reddit = FakeReddit(replay.MODERATORS, api_latency=args.api_latency)
+    comments = load_stream(reddit, records, SUBREDDIT_NAME)
+    measurements = asyncio.run(replay_async(comments, reddit, args.workers, args.batch))
+    db_pool.close_pool()
+
+    result = {'commit': replay.current_commit(),
+              'run_at': datetime.now(tz=timezone.utc).isoformat(timespec='seconds'),
+              'stream': f"synthetic:{args.comments}:{args.users}:{args.seed}",
+              'settings': {'mode': 'asyncio', 'workers': args.workers, 'batch': args.batch,
+                           'api_latency': args.api_latency},
+              **measurements}
+    print(json.dumps(result, indent=2))
+    replay.store_result(result, args.results)
+
+
+if __name__ == '__main__':
+    main_async_replay()
@@ -0,0 +1,67 @@
+"""
+Compares classifying comments with the old chain of re.match calls and with the combined command pattern, over a
+synthetic corpus where about 1% of the comments are commands.
+
+Usage: python benchmarks/command_dispatch.py
+"""
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import CONSTANTS  # noqa: E402
+from rep_manager import classify_comment  # noqa: E402
+
+CORPUS_SIZE = int(os.getenv('BENCH_COMMENTS', 200_000))
+COMMANDS = ["+REP", "+rep thanks for the trade!", "REP+", "\\+REP", "-REP", "!CLOSE", "close!", "!MOD",
+            "!REPLOGS some_user 30"]
+WORDS = ["trading", "my", "godly", "knife", "for", "your", "chroma", "offers?", "lf", "seer", "sold", "thanks",
+         "Really", "nice", "Can", "check", "dm", "me", "Ready", "add", "corrupt", "harvester", "Mod", "cool"]
+
+
+def old_classify(comment_body):
+    comment_body = comment_body.replace('\\', '')
+    if re.match(CONSTANTS.REP_PLUS, comment_body, re.I):
+        return 'rep_plus'
+    elif re.match(CONSTANTS.CLOSE, comment_body, re.I):
+        return 'close'
+    elif re.match(CONSTANTS.REP_MINUS, comment_body, re.I):
+        return 'rep_minus'
+    elif re.match(CONSTANTS.MOD, comment_body, re.I):
+        return 'mod'
+    elif re.match(CONSTANTS.REP_LOGS, comment_body, re.I):
+        return 'rep_logs'
+    return None
+
+
+def build_corpus():
+    random.seed(0)
+    corpus = []
+    for _ in range(CORPUS_SIZE):
+        if random.random() < 0.01:
+            corpus.append(random.choice(COMMANDS))
+        else:
+            corpus.append(' '.join(random.choices(WORDS, k=random.randint(3, 40))))
+    return corpus
+
+
+def timed(classify, corpus):
+    start = time.perf_counter()
+    results = [classify(comment_body) for comment_body in corpus]
+    return time.perf_counter() - start, results
+
+
+def main():
+    corpus = build_corpus()
+    old_seconds, old_results = timed(old_classify, corpus)
+    new_seconds, new_results = timed(classify_comment, corpus)
+    assert old_results == [result and result[0] for result in new_results], "classifiers disagree"
+    print(f"{CORPUS_SIZE} comments")
+    print(f"re.match chain:   {old_seconds / CORPUS_SIZE * 1e6:.3f} us/comment")
+    print(f"combined pattern: {new_seconds / CORPUS_SIZE * 1e6:.3f} us/comment")
+
+
+if __name__ == '__main__':
+    main()
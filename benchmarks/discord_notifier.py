@@ -0,0 +1,95 @@
+"""
+Measures the discord notifier against a local fake webhook that answers every tenth request with a 429.
+Sends a burst of distinct messages and a burst of identical tracebacks and reports how they were posted. With
+--asyncio the messages are posted by the event loop sender of the asyncio mode instead of the thread.
+
+Usage: python benchmarks/discord_notifier.py [--asyncio]
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import discord_notifier  # noqa: E402
+
+MESSAGES = int(os.getenv('BENCH_MESSAGES', 500))
+received = []
+
+
+class FakeWebhook(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if len(received) % 10 == 9:
+            received.append(None)
+            self.send_response(429)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps({'retry_after': 0.05}).encode())
+            return
+        received.append(json.loads(body)['content'])
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def send_bursts():
+    """
+    Queues the burst of distinct messages and the burst of identical tracebacks.
+
+    :return: seconds taken to queue the distinct messages.
+    """
+    start = time.perf_counter()
+    for index in range(MESSAGES):
+        discord_notifier.notify(f"message {index}", 'bench_channel')
+    enqueue_seconds = time.perf_counter() - start
+    for _ in range(MESSAGES):
+        discord_notifier.notify("Traceback (most recent call last): the same error", 'bench_channel')
+    return enqueue_seconds
+
+
+async def send_bursts_async():
+    """
+    Queues the bursts from a worker thread, as the command handlers do in the asyncio mode, while the event loop posts
+    them with aiohttp.
+
+    :return: seconds taken to queue the distinct messages.
+    """
+    import aiohttp
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+        sender = asyncio.create_task(discord_notifier.send_async(session))
+        enqueue_seconds = await asyncio.get_running_loop().run_in_executor(None, send_bursts)
+        discord_notifier.stop_async()
+        await sender
+    return enqueue_seconds
+
+
+def main():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeWebhook)
+    Thread(target=server.serve_forever, daemon=True).start()
+    os.environ['bench_channel'] = f"http://127.0.0.1:{server.server_port}/"
+    discord_notifier.COALESCE_SECONDS = 0
+    discord_notifier.NOTIFIER_QUEUE_SIZE = int(os.getenv('NOTIFIER_QUEUE_SIZE', MESSAGES + 1))
+
+    start = time.perf_counter()
+    if '--asyncio' in sys.argv[1:]:
+        enqueue_seconds = asyncio.run(send_bursts_async())
+    else:
+        discord_notifier.start()
+        enqueue_seconds = send_bursts()
+        discord_notifier.stop()
+    total_seconds = time.perf_counter() - start
+    server.shutdown()
+
+    print(f"{2 * MESSAGES} messages queued in {enqueue_seconds * 1000:.1f} ms")
+    print(f"{len([msg for msg in received if msg])} posts in {total_seconds:.2f} s, stats {discord_notifier.stats}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Compares the three separate rep limit queries with the single eligibility query, with and without the composite
+indexes. Runs against a seeded temporary rep_transactions table, so it is safe to point at any Postgres.
+
+Usage: DATABASE_URL=postgresql://localhost/postgres DB_SSLMODE=disable python benchmarks/eligibility_query.py
+"""
+import os
+import random
+import sys
+import time
+from contextlib import closing
+
+import psycopg2
+import psycopg2.extras
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from rep_manager import REP_ELIGIBILITY_QUERY  # noqa: E402
+
+ELIGIBILITY_QUERY = REP_ELIGIBILITY_QUERY.format(rep_transactions="rep_transactions")
+
+ROWS = int(os.getenv('BENCH_ROWS', 500_000))
+USERS = int(os.getenv('BENCH_USERS', 20_000))
+SUBMISSIONS = int(os.getenv('BENCH_SUBMISSIONS', 50_000))
+LOOKUPS = int(os.getenv('BENCH_LOOKUPS', 2_000))
+SECONDS_IN_SIX_MONTHS = 180 * 24 * 60 * 60
+
+SEPARATE_QUERIES = ["SELECT COUNT(*) FROM rep_transactions WHERE awarder=%(awarder)s AND comment_created_utc>=%(day_start)s",
+                    "SELECT COUNT(*) FROM rep_transactions WHERE awarder=%(awarder)s AND awardee=%(awardee)s "
+                    "AND comment_created_utc>=%(cooldown_start)s",
+                    "SELECT COUNT(*) FROM rep_transactions WHERE awardee=%(awardee)s AND submission_id=%(submission_id)s"]
+
+
+def seed(cursor):
+    cursor.execute("""CREATE TEMP TABLE rep_transactions (comment_id TEXT,
+                                                          comment_created_utc BIGINT,
+                                                          awarder TEXT,
+                                                          awarder_rep INT,
+                                                          awardee TEXT,
+                                                          awardee_rep INT,
+                                                          delta_awardee_rep INT,
+                                                          submission_id TEXT,
+                                                          submission_created_utc BIGINT,
+                                                          permalink TEXT)""")
+    now = int(time.time())
+    rows = ((f"c{index}", now - random.randrange(SECONDS_IN_SIX_MONTHS), f"user{random.randrange(USERS)}", 0,
+             f"user{random.randrange(USERS)}", 0, 1, f"s{random.randrange(SUBMISSIONS)}", now, "")
+            for index in range(ROWS))
+    psycopg2.extras.execute_values(cursor, "INSERT INTO rep_transactions VALUES %s", rows, page_size=10_000)
+    cursor.execute("CREATE UNIQUE INDEX ON rep_transactions (comment_id)")
+    cursor.execute("ANALYZE rep_transactions")
+
+
+def lookup_params():
+    now = time.time()
+    return [{'awarder': f"user{random.randrange(USERS)}",
+             'awardee': f"user{random.randrange(USERS)}",
+             'submission_id': f"s{random.randrange(SUBMISSIONS)}",
+             'day_start': now - 86400,
+             'cooldown_start': now - 1800} for _ in range(LOOKUPS)]
+
+
+def run(cursor, queries, params):
+    start = time.perf_counter()
+    for param in params:
+        for query in queries:
+            cursor.execute(query, param)
+            cursor.fetchall()
+    return (time.perf_counter() - start) / len(params) * 1000
+
+
+def main():
+    with closing(psycopg2.connect(os.getenv('DATABASE_URL'), sslmode=os.getenv('DB_SSLMODE', 'require'))) as db_conn:
+        with closing(db_conn.cursor()) as cursor:
+            seed(cursor)
+            params = lookup_params()
+            print(f"{ROWS} rows, {LOOKUPS} lookups")
+            print(f"no indexes, 3 queries:        {run(cursor, SEPARATE_QUERIES, params):.3f} ms/check")
+            print(f"no indexes, single query:     {run(cursor, [ELIGIBILITY_QUERY], params):.3f} ms/check")
+            cursor.execute("CREATE INDEX ON rep_transactions (awarder, comment_created_utc)")
+            cursor.execute("CREATE INDEX ON rep_transactions (awarder, awardee, comment_created_utc)")
+            cursor.execute("CREATE INDEX ON rep_transactions (awardee, submission_id)")
+            cursor.execute("ANALYZE rep_transactions")
+            print(f"composite indexes, 3 queries: {run(cursor, SEPARATE_QUERIES, params):.3f} ms/check")
+            print(f"composite indexes, single:    {run(cursor, [ELIGIBILITY_QUERY], params):.3f} ms/check")
+        db_conn.rollback()
+
+
+if __name__ == '__main__':
+    main()
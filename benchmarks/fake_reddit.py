@@ -0,0 +1,275 @@
+"""
+In-process stand-in for the parts of the PRAW API the bot uses, so the hot path can be replayed without Reddit. Every
+method that would be a request counts as an API call for api_counter and can be slowed down to a simulated latency.
+"""
+import itertools
+import os
+import sys
+import time
+from collections import Counter
+from threading import Lock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import api_counter  # noqa: E402
+import CONSTANTS  # noqa: E402
+
+# Comment templates of every config type the bot replies with
+COMMENT_TYPES = ['submission_closed_successfully', 'submission_closed_failed_not_op_or_mod',
+                 'submission_closed_not_trading_post', 'subtract_rep_successful', 'reward_rep_successful',
+                 'incorrect_submission_type', 'cannot_reward_yourself', 'removed_or_deleted', 'reward_limit_reached',
+                 'cooldown_timer_reached', 'mods_requested', 'giveway_limit_reached']
+LIMITS = {'rep_limit_per_day': 10, 'rep_cooldown': 30, 'giveaway_rep_limit_per_post': 5}
+
+
+def config_md() -> str:
+    """
+    Builds the wiki config with the limits and a comment for every reply type.
+
+    :return: multi document yaml config.
+    """
+    documents = ["type: limits\n" + ''.join(f"{key}: {value}\n" for key, value in LIMITS.items())]
+    documents += [f"type: {comment_type}\ncomment: \"{comment_type} for u/{{{{author}}}}\"\n"
+                  for comment_type in COMMENT_TYPES]
+    return "---\n".join(documents)
+
+
+class FakeReddit:
+    """
+    Holds every submission and comment of the replay and counts the API calls made against them.
+    """
+
+    def __init__(self, moderators, api_latency=0.0):
+        self.api_latency = api_latency
+        self.moderators = moderators
+        self.things = {}
+        self.calls = Counter()
+        self.auth = FakeAuth()
+        self._subreddits = {}
+        self._ids = itertools.count()
+        self._lock = Lock()
+
+    def api_call(self, name):
+        """
+        Counts an API call and waits for the simulated latency.
+
+        :param name: Name of the endpoint, for the per endpoint counts.
+        """
+        self.count_call(name)
+        if self.api_latency:
+            time.sleep(self.api_latency)
+
+    def count_call(self, name):
+        """
+        Counts an API call without waiting, for callers that wait for the latency themselves, e.g. on an event loop.
+
+        :param name: Name of the endpoint, for the per endpoint counts.
+        """
+        api_counter.count_call()
+        with self._lock:
+            self.calls[name] += 1
+
+    def new_id(self) -> str:
+        with self._lock:
+            return f"x{next(self._ids):x}"
+
+    def add(self, thing):
+        self.things[thing.fullname] = thing
+        return thing
+
+    def info(self, fullnames):
+        self.api_call('info')
+        return [self.things[fullname] for fullname in fullnames if fullname in self.things]
+
+    def subreddit(self, display_name):
+        if display_name not in self._subreddits:
+            self._subreddits[display_name] = FakeSubreddit(self, display_name)
+        return self._subreddits[display_name]
+
+    def redditor(self, name):
+        return FakeRedditor(self, name)
+
+    def comment(self, comment_id):
+        return self.things[f"t1_{comment_id}"]
+
+
+class FakeAuth:
+    # No rate limit headers, the action queue never waits
+    limits = {'remaining': None, 'reset_timestamp': None, 'used': None}
+
+
+class FakeRedditor:
+    def __init__(self, reddit, name):
+        self._reddit = reddit
+        self.name = name
+
+    def __eq__(self, other):
+        return isinstance(other, FakeRedditor) and self.name.lower() == other.name.lower()
+
+    def __hash__(self):
+        return hash(self.name.lower())
+
+    def __str__(self):
+        return self.name
+
+    def message(self, subject, message):
+        self._reddit.api_call('message')
+
+
+class FakeWikiPage:
+    def __init__(self, content_md):
+        self.content_md = content_md
+
+    def revisions(self, limit=None):
+        yield {'id': 'replay'}
+
+
+class FakeFlair:
+    """
+    Both subreddit.flair(redditor=...), subreddit.flair.set(...) and subreddit.flair.update(...).
+    """
+
+    def __init__(self, subreddit):
+        self._subreddit = subreddit
+        self.flairs = {}
+        self.templates = {}
+        self.updates = []
+
+    def __call__(self, redditor=None, limit=None):
+        self._subreddit._reddit.api_call('flair_list')
+        names = [redditor] if redditor is not None else list(self.flairs)
+        for name in names:
+            yield {'user': name, 'flair_text': self.flairs.get(name), 'flair_css_class': None}
+
+    def set(self, redditor, text=None, flair_template_id=None):
+        self._subreddit._reddit.api_call('flair_set')
+        self.flairs[redditor] = text
+        self.templates[redditor] = flair_template_id
+
+    def update(self, flair_list):
+        results = []
+        for start in range(0, len(flair_list), 100):
+            self._subreddit._reddit.api_call('flair_update')
+            self.updates.append(flair_list[start:start + 100])
+            for row in flair_list[start:start + 100]:
+                self.flairs[str(row['user'])] = row['flair_text']
+                results.append({'ok': True, 'errors': {}, 'status': 'added flair'})
+        return results
+
+
+class FakeModeration:
+    def __init__(self, thing):
+        self._thing = thing
+
+    def distinguish(self, how="yes", sticky=False):
+        self._thing._reddit.api_call('distinguish')
+
+    def lock(self):
+        self._thing._reddit.api_call('lock')
+
+
+class FakeSubredditModeration:
+    def log(self, limit=None):
+        return iter(())
+
+
+class FakeSubmissionFlair:
+    def __init__(self, submission):
+        self._submission = submission
+
+    def select(self, flair_template_id):
+        self._submission._reddit.api_call('flair_select')
+
+
+class FakeSubreddit:
+    def __init__(self, reddit, display_name):
+        self._reddit = reddit
+        self.display_name = display_name
+        self.wiki = {CONSTANTS.CONFIG_WIKI_PAGE: FakeWikiPage(config_md())}
+        self.flair = FakeFlair(self)
+        self.mod = FakeSubredditModeration()
+
+    def __str__(self):
+        return self.display_name
+
+    def moderator(self):
+        self._reddit.api_call('moderators')
+        return [self._reddit.redditor(name) for name in self._reddit.moderators]
+
+    def submit(self, title, selftext):
+        self._reddit.api_call('submit')
+        return FakeSubmission(self._reddit, self._reddit.new_id(), self._reddit.redditor('mm2repbot'), None, time.time(),
+                              self)
+
+
+class FakeSubmission:
+    def __init__(self, reddit, submission_id, author, link_flair_text, created_utc, subreddit):
+        self._reddit = reddit
+        self.id = submission_id
+        self.fullname = f"t3_{submission_id}"
+        self.author = author
+        self.link_flair_text = link_flair_text
+        self.created_utc = created_utc
+        self.subreddit = subreddit
+        self.permalink = f"/r/{subreddit.display_name}/comments/{submission_id}/"
+        self.mod_note = None
+        self.removed = False
+        self.author_flair_text = None
+        self.author_flair_template_id = None
+        self.mod = FakeModeration(self)
+        self.flair = FakeSubmissionFlair(self)
+
+    def reply(self, body):
+        self._reddit.api_call('reply')
+        return FakeComment(self._reddit, self._reddit.new_id(), body, self._reddit.redditor('mm2repbot'), time.time(),
+                           self.fullname, self.fullname, self.subreddit)
+
+
+class FakeComment:
+    def __init__(self, reddit, comment_id, body, author, created_utc, link_id, parent_id, subreddit):
+        self._reddit = reddit
+        self.id = comment_id
+        self.fullname = f"t1_{comment_id}"
+        self.body = body
+        self.author = author
+        self.created_utc = created_utc
+        self.link_id = link_id
+        self.parent_id = parent_id
+        self.subreddit = subreddit
+        self.permalink = f"/r/{subreddit.display_name}/comments/{link_id[3:]}/_/{comment_id}/"
+        self.mod_note = None
+        self.removed = False
+        self.author_flair_text = None
+        self.author_flair_template_id = None
+        self.mod = FakeModeration(self)
+
+    def reply(self, body):
+        self._reddit.api_call('reply')
+        return FakeComment(self._reddit, self._reddit.new_id(), body, self._reddit.redditor('mm2repbot'), time.time(),
+                           self.link_id, self.fullname, self.subreddit)
+
+    def edit(self, body):
+        self._reddit.api_call('edit')
+        self.body = body
+        return self
+
+
+def load_stream(reddit, records, subreddit_name='MarketMM2') -> list:
+    """
+    Adds the recorded submissions and comments to the fake Reddit.
+
+    :param reddit: The FakeReddit instance.
+    :param records: Iterable of dictionaries, see replay.py for the format.
+    :param subreddit_name: Display name of the subreddit the stream belongs to.
+    :return: list of the comments in stream order.
+    """
+    subreddit = reddit.subreddit(subreddit_name)
+    comments = []
+    for record in records:
+        if record['kind'] == 'submission':
+            reddit.add(FakeSubmission(reddit, record['id'], reddit.redditor(record['author']), record['flair'],
+                                      record['created_utc'], subreddit))
+        else:
+            comments.append(reddit.add(FakeComment(reddit, record['id'], record['body'],
+                                                   reddit.redditor(record['author']), record['created_utc'],
+                                                   record['link_id'], record['parent_id'], subreddit)))
+    return comments
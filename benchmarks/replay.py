@@ -0,0 +1,248 @@
+"""
+Replays a comment stream through rep_manager.load_comment against the fake Reddit in fake_reddit.py and a local
+Postgres, and reports the throughput, the command latency and the API calls per command. Each run is appended to
+benchmarks/results/replay.jsonl with the commit it ran on and compared with the previous run of the same stream, so
+regressions in the hot path show up across commits.
+
+The stream is synthetic unless --input points at a recorded one. Streams are JSON lines of either
+    {"kind": "submission", "id", "author", "flair", "created_utc"}
+or
+    {"kind": "comment", "id", "author", "body", "link_id", "parent_id", "created_utc"}
+in the order they were posted. --record saves the synthetic stream in this format.
+
+Everything is created in the bot_replay schema, which is dropped first, so any Postgres can be used:
+    DATABASE_URL=postgresql://localhost/postgres DB_SSLMODE=disable python benchmarks/replay.py --comments 5000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import traceback
+from contextlib import closing
+from datetime import datetime, timezone
+from threading import Lock
+
+# Every connection of the pool works in the replay schema, set before the pool is created
+REPLAY_SCHEMA = 'bot_replay'
+os.environ['PGOPTIONS'] = f"{os.getenv('PGOPTIONS', '')} -c search_path={REPLAY_SCHEMA}".strip()
+# The fake Reddit posts as this account, which the bot must recognise as itself
+os.environ.setdefault('reddit_username', 'mm2repbot')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import action_queue  # noqa: E402
+import api_counter  # noqa: E402
+import comment_dispatcher  # noqa: E402
+import db_pool  # noqa: E402
+import giveaway_burst  # noqa: E402
+import main  # noqa: E402
+import rep_manager  # noqa: E402
+import rep_reports  # noqa: E402
+from fake_reddit import FakeReddit, load_stream  # noqa: E402
+
+RESULTS_FILE = os.path.join(os.path.dirname(__file__), 'results', 'replay.jsonl')
+MODERATORS = ['mod_alice', 'mod_bob', 'mm2repbot']
+# Share of each kind of comment in the synthetic stream
+COMMENT_MIX = [('noise', 60), ('rep_plus', 25), ('rep_minus', 3), ('close', 6), ('mod', 4), ('rep_logs', 2)]
+SUBMISSION_FLAIRS = ['Trade Offer', 'Trade Offer', 'Giveaway Entry', 'Discussion']
+NOISE = ["anyone trading a godly?", "lf seer, offering chroma", "thanks!", "added you", "what do you want for it",
+         "Mod price?", "close to done", "Ready when you are", "-1 value lol", "rep me after pls"]
+
+
+def synthetic_stream(comment_count, user_count, seed):
+    """
+    Generates a stream of submissions and comments with the command mix of COMMENT_MIX. Comments are dated in the
+    recent past so they fall in the current rate limit windows.
+
+    :param comment_count: Number of comments.
+    :param user_count: Number of distinct commenters.
+    :param seed: Seed of the random generator, the same seed gives the same stream.
+    :return: list of stream records.
+    """
+    rng = random.Random(seed)
+    users = [f"trader_{index}" for index in range(user_count)]
+    kinds, weights = zip(*COMMENT_MIX)
+    start = time.time() - comment_count * 0.5
+    records = []
+    # Comments of the submissions still receiving comments, by submission fullname
+    open_submissions = {}
+    for index in range(comment_count):
+        created_utc = start + index * 0.5
+        if not open_submissions or rng.random() < 0.05:
+            submission_id = f"s{index:x}"
+            records.append({'kind': 'submission', 'id': submission_id, 'author': rng.choice(users),
+                            'flair': rng.choice(SUBMISSION_FLAIRS), 'created_utc': created_utc})
+            open_submissions[f"t3_{submission_id}"] = []
+            if len(open_submissions) > 30:
+                del open_submissions[next(iter(open_submissions))]
+        link_id = rng.choice(list(open_submissions))
+        siblings = open_submissions[link_id]
+        parent_id = rng.choice(siblings)[0] if siblings and rng.random() < 0.8 else link_id
+        kind = rng.choices(kinds, weights)[0]
+        author = rng.choice(MODERATORS[:2]) if kind == 'rep_minus' or rng.random() < 0.01 else rng.choice(users)
+        body = {'noise': lambda: rng.choice(NOISE),
+                'rep_plus': lambda: rng.choice(["+REP", "+rep thanks for the trade!", "REP+", "\\+REP"]),
+                'rep_minus': lambda: "-REP",
+                'close': lambda: rng.choice(["!CLOSE", "close!"]),
+                'mod': lambda: "!MOD",
+                'rep_logs': lambda: f"!REPLOGS {rng.choice(users)} {rng.choice([7, 30, 180])}"}[kind]()
+        comment_id = f"c{index:x}"
+        records.append({'kind': 'comment', 'id': comment_id, 'author': author, 'body': body, 'link_id': link_id,
+                        'parent_id': parent_id, 'created_utc': created_utc})
+        siblings.append((f"t1_{comment_id}", author))
+    return records
+
+
+def reset_schema():
+    """
+    Drops and recreates the replay schema and the bot tables in it.
+    """
+    with db_pool.get_connection() as db_conn:
+        with closing(db_conn.cursor()) as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {REPLAY_SCHEMA} CASCADE")
+            cursor.execute(f"CREATE SCHEMA {REPLAY_SCHEMA}")
+    main.create_tables()
+
+
+def replay(comments, reddit, workers) -> dict:
+    """
+    Sends the comments through the comment dispatcher workers, the same way the stream listener does, and waits for
+    them and for the queued replies and flairs to finish.
+
+    :param comments: list of fake comments in stream order.
+    :param reddit: The FakeReddit instance.
+    :param workers: Number of comment workers.
+    :return: dictionary of the measurements.
+    """
+    latencies = []
+    errors = []
+    lock = Lock()
+
+    def handler(comment):
+        started = time.perf_counter()
+        try:
+            rep_manager.load_comment(comment)
+        except Exception:
+            with lock:
+                errors.append(traceback.format_exc())
+        elapsed = time.perf_counter() - started
+        if rep_manager.classify_comment(comment.body) is not None:
+            with lock:
+                latencies.append(elapsed)
+
+    comment_dispatcher.WORKER_COUNT = workers
+    action_queue.start(reddit, errors.append)
+    rep_reports.start(errors.append)
+    giveaway_burst.start(rep_manager.process_giveaway_burst, errors.append)
+    comment_dispatcher.start(handler)
+    calls_before = sum(reddit.calls.values())
+    started = time.perf_counter()
+    for comment in comments:
+        comment_dispatcher.submit(comment)
+    comment_dispatcher.stop()
+    processing_seconds = time.perf_counter() - started
+    giveaway_burst.stop()
+    action_queue.stop()
+    rep_reports.stop()
+    drained_seconds = time.perf_counter() - started
+
+    if errors:
+        print(f"{len(errors)} errors, the first one:\n{errors[0]}")
+    percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else [0.0] * 99
+    return {'comments': len(comments),
+            'commands': len(latencies),
+            'errors': len(errors),
+            'comments_per_second': len(comments) / processing_seconds,
+            'drained_seconds': drained_seconds,
+            'p50_ms': percentiles[49] * 1000,
+            'p99_ms': percentiles[98] * 1000,
+            'api_calls_per_command': {command: command_stats['api_calls_per_command']
+                                      for command, command_stats in api_counter.stats().items()},
+            # Every call of the run, also the ones of the action sender, giveaway flushes and report worker
+            'api_calls_per_command_overall': (sum(reddit.calls.values()) - calls_before) / max(len(latencies), 1),
+            'api_calls': dict(reddit.calls),
+            'actions': dict(action_queue.stats)}
+
+
+def current_commit() -> str:
+    """
+    Gets the commit the replay runs on, marked dirty if the tree has changes.
+
+    :return: short commit hash or unknown outside a git checkout.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                               text=True, check=True).stdout.strip()
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def store_result(result, results_file=RESULTS_FILE):
+    """
+    Appends the result to the results file and prints the change from the previous run of the same stream.
+
+    :param result: dictionary of the run settings and measurements.
+    :param results_file: Path of the JSON lines results file.
+    """
+    previous = None
+    if os.path.exists(results_file):
+        with open(results_file) as results:
+            for line in results:
+                run = json.loads(line)
+                if run['stream'] == result['stream'] and run['settings'] == result['settings']:
+                    previous = run
+    os.makedirs(os.path.dirname(results_file), exist_ok=True)
+    with open(results_file, 'a') as results:
+        results.write(json.dumps(result) + '\n')
+    if previous is not None:
+        for key in ('comments_per_second', 'p50_ms', 'p99_ms'):
+            change = (result[key] / previous[key] - 1) * 100 if previous[key] else 0.0
+            print(f"{key}: {previous[key]:.2f} at {previous['commit']} -> {result[key]:.2f} ({change:+.1f}%)")
+
+
+def main_replay():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--comments', type=int, default=2000, help="comments in the synthetic stream")
+    parser.add_argument('--users', type=int, default=300, help="distinct commenters in the synthetic stream")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the synthetic stream")
+    parser.add_argument('--input', help="recorded stream to replay instead of a synthetic one")
+    parser.add_argument('--record', help="file to save the synthetic stream to")
+    parser.add_argument('--workers', type=int, default=comment_dispatcher.WORKER_COUNT, help="comment workers")
+    parser.add_argument('--api-latency', type=float, default=0.0, help="simulated seconds per Reddit API call")
+    parser.add_argument('--results', default=RESULTS_FILE, help="JSON lines file the result is appended to")
+    args = parser.parse_args()
+
+    if args.input:
+        with open(args.input) as stream_file:
+            records = [json.loads(line) for line in stream_file if line.strip()]
+        stream = os.path.basename(args.input)
+    else:
+        records = synthetic_stream(args.comments, args.users, args.seed)
+        stream = f"synthetic:{args.comments}:{args.users}:{args.seed}"
+        if args.record:
+            with open(args.record, 'w') as stream_file:
+                stream_file.writelines(json.dumps(record) + '\n' for record in records)
+
+    reset_schema()
+    reddit = FakeReddit(MODERATORS, api_latency=args.api_latency)
+    comments = load_stream(reddit, records)
+    measurements = replay(comments, reddit, args.workers)
+    db_pool.close_pool()
+
+    result = {'commit': current_commit(),
+              'run_at': datetime.now(tz=timezone.utc).isoformat(timespec='seconds'),
+              'stream': stream,
+              'settings': {'workers': args.workers, 'api_latency': args.api_latency},
+              **measurements}
+    print(json.dumps(result, indent=2))
+    store_result(result, args.results)
+
+
+if __name__ == '__main__':
+    main_replay()
@@ -0,0 +1,79 @@
+"""
+Compares the single unbounded DELETE, the chunked delete and dropping partitions for purging six months old rows.
+Builds synthetic tables with generate_series and drops them afterwards.
+
+Usage: DATABASE_URL=postgresql://localhost/postgres DB_SSLMODE=disable python benchmarks/retention_purge.py
+"""
+import os
+import time
+from contextlib import closing
+
+import psycopg2
+
+ROWS = int(os.getenv('BENCH_ROWS', 3_000_000))
+CHUNK_SIZE = int(os.getenv('PURGE_CHUNK_SIZE', 5000))
+SECONDS_IN_A_YEAR = 365 * 24 * 60 * 60
+MONTH = 30 * 24 * 60 * 60
+NOW = int(time.time())
+CUTOFF = NOW - 180 * 24 * 60 * 60
+
+COLUMNS = """(comment_id TEXT, comment_created_utc BIGINT, awarder TEXT, awarder_rep INT, awardee TEXT,
+              awardee_rep INT, delta_awardee_rep INT, submission_id TEXT, submission_created_utc BIGINT, permalink TEXT)"""
+# A year of rows spread evenly, so about half of them are past the cutoff. n is cast so the product does not overflow.
+CREATED_UTC = f"{NOW} - n::bigint * {SECONDS_IN_A_YEAR} / {ROWS}"
+SEED = f"""INSERT INTO {{table}} SELECT 'c' || n, {CREATED_UTC}, 'user' || n % 20000, 0,
+                                        'user' || n % 19999, 0, 1, 's' || n % 50000, {CREATED_UTC}, ''
+           FROM generate_series(1, {ROWS}) AS n"""
+
+
+def timed(db_conn, cursor, statements):
+    start = time.perf_counter()
+    for statement in statements:
+        cursor.execute(statement)
+        db_conn.commit()
+    return time.perf_counter() - start
+
+
+def main():
+    with closing(psycopg2.connect(os.getenv('DATABASE_URL'), sslmode=os.getenv('DB_SSLMODE', 'require'))) as db_conn:
+        with closing(db_conn.cursor()) as cursor:
+            for table in ('bench_unbounded', 'bench_chunked'):
+                cursor.execute(f"CREATE TABLE {table} {COLUMNS}")
+                cursor.execute(SEED.format(table=table))
+                cursor.execute(f"CREATE UNIQUE INDEX ON {table} (comment_id)")
+                cursor.execute(f"CREATE INDEX ON {table} (submission_created_utc)")
+            cursor.execute(f"CREATE TABLE bench_partitioned {COLUMNS} PARTITION BY RANGE (submission_created_utc)")
+            partitions = []
+            for start in range(NOW - SECONDS_IN_A_YEAR - MONTH, NOW + MONTH, MONTH):
+                partition = f"bench_partitioned_{len(partitions)}"
+                cursor.execute(f"CREATE TABLE {partition} PARTITION OF bench_partitioned "
+                               f"FOR VALUES FROM ({start}) TO ({start + MONTH})")
+                partitions.append((partition, start + MONTH))
+            cursor.execute(SEED.format(table='bench_partitioned'))
+            db_conn.commit()
+
+            try:
+                print(f"{ROWS} rows")
+                unbounded = timed(db_conn, cursor, [f"DELETE FROM bench_unbounded WHERE submission_created_utc <= {CUTOFF}"])
+                print(f"unbounded DELETE: {unbounded:.2f} s in one transaction")
+
+                start = time.perf_counter()
+                chunks = 0
+                while True:
+                    cursor.execute("DELETE FROM bench_chunked WHERE comment_id IN (SELECT comment_id FROM bench_chunked "
+                                   "WHERE submission_created_utc <= %s LIMIT %s)", (CUTOFF, CHUNK_SIZE))
+                    db_conn.commit()
+                    chunks += 1
+                    if cursor.rowcount < CHUNK_SIZE:
+                        break
+                print(f"chunked DELETE: {time.perf_counter() - start:.2f} s in {chunks} transactions of {CHUNK_SIZE} rows")
+
+                dropped = timed(db_conn, cursor, [f"DROP TABLE {partition}" for partition, end in partitions if end <= CUTOFF])
+                print(f"partition DROP: {dropped:.2f} s")
+            finally:
+                cursor.execute("DROP TABLE IF EXISTS bench_unbounded, bench_chunked, bench_partitioned")
+                db_conn.commit()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,142 +1,239 @@
+from collections import OrderedDict
+from threading import Lock
+
 import praw
 import prawcore
-import yaml
+
+import action_queue
+import command_journal
+import config_manager
+from CONSTANTS import StatusCodes
+
+FOOTER = "\n\n^(This action was performed by a bot, please contact the mods for any questions.)"
+# Longest comment Reddit accepts
+COMMENT_LIMIT = 10000
+# Giveaway threads whose summary comment is kept for editing, the oldest is forgotten first
+SUMMARY_THREADS = 200
+# Line of the giveaway summary for the outcome of each +REP
+GIVEAWAY_SUMMARY_LINES = {StatusCodes.CHECKS_PASSED: "rep given to u/{awardee}",
+                          StatusCodes.CANNOT_REWARD_YOURSELF: "u/{awardee}: cannot reward yourself",
+                          StatusCodes.DELETED_OR_REMOVED: "u/{awardee}: comment removed or deleted",
+                          StatusCodes.REP_AWARDING_LIMIT_REACHED: "u/{awardee}: daily rep limit reached",
+                          StatusCodes.COOL_DOWN_TIMER: "u/{awardee}: rep cooldown not over yet",
+                          StatusCodes.GIVEAWAY_LIMIT: "u/{awardee}: giveaway rep limit reached on this post"}
+
+_summary_lock = Lock()
+# Lines and the posted summary comment of each giveaway thread, by submission fullname
+_summaries = OrderedDict()
 
 
-def reply(comment_or_submission, body):
-    response = body + "\n\n^(This action was performed by a bot, please contact the mods for any questions.)"
+def distinguish_and_lock(new_comment, sticky=False):
+    """
+    Distinguishes and locks the reply of the bot.
+
+    :param new_comment: The comment posted by the bot.
+    :param sticky: True to also pin the comment to the top of the submission.
+    """
     try:
-        new_comment = comment_or_submission.reply(response)
-        new_comment.mod.distinguish(how="yes")
+        new_comment.mod.distinguish(how="yes", sticky=sticky)
         new_comment.mod.lock()
     except prawcore.exceptions.Forbidden:
         raise prawcore.exceptions.Forbidden("Could not distinguish/lock comment")
+
+
+def send_reply(context, response):
+    """
+    Posts the reply, falling back to replying on the submission if the comment can no longer be replied to. The
+    moderation of the reply is queued as its own action so that retrying it never posts the reply twice.
+
+    :param context: CommentContext of the comment that will be replied to.
+    :param response: Body of the reply.
+    """
+    try:
+        new_comment = context.comment.reply(response)
     except praw.exceptions.APIException:
-        new_comment = comment_or_submission.submission.reply(response)
-        new_comment.mod.distinguish(how="yes")
-        new_comment.mod.lock()
+        new_comment = context.submission.reply(response)
+    action_queue.enqueue(distinguish_and_lock, new_comment)
+
+
+def reply(context, body):
+    """
+    Queues the reply to the comment. The reply is posted by the action queue sender thread, after which the command is
+    complete in the journal.
+
+    :param context: CommentContext of the comment that will be replied to.
+    :param body: Body of the reply without the bot footer.
+    """
+    response = body + FOOTER
+    comment_id = context.comment.id
+    context.replied = True
+    action_queue.enqueue(send_reply, context, response,
+                         on_done=lambda: command_journal.advance(comment_id, command_journal.REPLIED))
+
+
+def _post_giveaway_summary(submission):
+    """
+    Posts the summary of the giveaway as a sticky comment on the submission, or edits it if it has been posted. The
+    body is built when the action runs so that coalesced updates post the latest lines once. Like send_reply, the
+    moderation is queued as its own action so that retrying it never posts the summary twice.
+
+    :param submission: The giveaway submission.
+    """
+    with _summary_lock:
+        summary = _summaries.get(submission.fullname)
+        if summary is None:
+            return
+        lines = list(summary['lines'])
+        summary_comment = summary['comment']
+    heading = "**Rep given on this giveaway**\n\n"
+    body = heading + ''.join(f"* {line}\n" for line in lines) + FOOTER
+    # The oldest lines are dropped once the comment is too long
+    dropped = 0
+    while len(body) > COMMENT_LIMIT:
+        dropped += 1
+        body = (heading + f"* ...and {dropped} earlier\n" + ''.join(f"* {line}\n" for line in lines[dropped:])
+                + FOOTER)
+    if summary_comment is not None:
+        summary_comment.edit(body)
+        return
+    summary_comment = submission.reply(body)
+    with _summary_lock:
+        _summaries[submission.fullname]['comment'] = summary_comment
+    action_queue.enqueue(distinguish_and_lock, summary_comment, True)
+
+
+def giveaway_summary(submission, results, comment_ids):
+    """
+    Adds the outcomes of a group of +REP on a giveaway to its summary comment instead of replying to every command.
+    The commands are complete in the journal once the summary has been posted.
+
+    :param submission: The giveaway submission.
+    :param results: list of tuples of the awardee name and the StatusCodes of the +REP.
+    :param comment_ids: Ids of the comments with the commands.
+    """
+    with _summary_lock:
+        summary = _summaries.setdefault(submission.fullname, {'lines': [], 'comment': None})
+        _summaries.move_to_end(submission.fullname)
+        summary['lines'] += [GIVEAWAY_SUMMARY_LINES[status].format(awardee=awardee) for awardee, status in results]
+        while len(_summaries) > SUMMARY_THREADS:
+            _summaries.popitem(last=False)
+    action_queue.enqueue(_post_giveaway_summary, submission, key=('giveaway_summary', submission.fullname),
+                         on_done=lambda: command_journal.advance_many(comment_ids, command_journal.REPLIED))
 
 
-def get_comment_from_config(comment, config_name):
+def get_comment_from_config(context, config_name):
     """
     Gets the comment body from the wiki config.
 
-    :param comment: Comment that triggered that command.
+    :param context: CommentContext of the comment that triggered that command.
     :param config_name: The config document name that will be used.
     :return: comment body from config document.
     """
-    comment_body = "Something went wrong, please contact mods asap."
-    config = comment._reddit.subreddit("MarketMM2").wiki['marketmm2botsconfig/rep_bot_config'].content_md
-    for config in yaml.safe_load_all(config):
-        if config['type'] == config_name:
-            comment_body = config['comment']
-            if '{{author}}' in config['comment']:
-                comment_body = comment_body.replace('{{author}}', comment.author.name)
-            if '{{parent-author}}' in config['comment']:
-                comment_body = comment_body.replace('{{parent-author}}', comment.parent().author.name)
-            return comment_body
-    return comment_body
+    template = config_manager.get_template(context.reddit, context.subreddit_name, config_name)
+    if template is None:
+        return "Something went wrong, please contact mods asap."
+    return template(context)
 
 
-def close_submission_comment(comment):
+def close_submission_comment(context):
     """
     Replies with the comment for letting user know that the submission has been closed.
-    :param comment: The comment that triggered the command and will be replied to.
+    :param context: CommentContext of the comment that triggered the command and will be replied to.
     """
-    comment_body = get_comment_from_config(comment, 'submission_closed_successfully')
-    reply(comment, comment_body)
+    comment_body = get_comment_from_config(context, 'submission_closed_successfully')
+    reply(context, comment_body)
 
 
-def close_submission_failed(comment, is_trading_post):
+def close_submission_failed(context, is_trading_post):
     """
     Replies with the comment for letting user know that the submission closing was not successful.
     :param is_trading_post: flag to determine the failure reason so we can change the response accordingly.
-    :param comment: The comment that triggered the command and will be replied to.
+    :param context: CommentContext of the comment that triggered the command and will be replied to.
     """
     if not is_trading_post:
-        comment_body = get_comment_from_config(comment, 'submission_closed_failed_not_op_or_mod')
+        comment_body = get_comment_from_config(context, 'submission_closed_failed_not_op_or_mod')
     else:
-        comment_body = get_comment_from_config(comment, 'submission_closed_not_trading_post')
-    reply(comment, comment_body)
+        comment_body = get_comment_from_config(context, 'submission_closed_not_trading_post')
+    reply(context, comment_body)
 
 
-def rep_subtract_comment(comment):
+def rep_subtract_comment(context):
     """
     Replies with the comment for letting user know that the rep has been subtracted successfully.
-    :param comment: The comment that triggered the command and will be replied to.
+    :param context: CommentContext of the comment that triggered the command and will be replied to.
     """
-    comment_body = get_comment_from_config(comment, 'subtract_rep_successful')
-    reply(comment, comment_body)
+    comment_body = get_comment_from_config(context, 'subtract_rep_successful')
+    reply(context, comment_body)
 
 
-def rep_rewarded_comment(comment):
+def rep_rewarded_comment(context):
     """
     Replies with the comment for letting user know that the Reputation has been rewarded successfully.
-    :param comment: The comment that triggered the command and will be replied to.
+    :param context: CommentContext of the comment that triggered the command and will be replied to.
     """
-    comment_body = get_comment_from_config(comment, 'reward_rep_successful')
-    reply(comment, comment_body)
+    comment_body = get_comment_from_config(context, 'reward_rep_successful')
+    reply(context, comment_body)
 
 
-def incorrect_submission_type_comment(comment):
+def incorrect_submission_type_comment(context):
     """
     Responds the user with message that the rep reward failed
-    :param comment: The comment that triggered the command and will be replied to.
+    :param context: CommentContext of the comment that triggered the command and will be replied to.
     """
-    comment_body = get_comment_from_config(comment, 'incorrect_submission_type')
-    reply(comment, comment_body)
+    comment_body = get_comment_from_config(context, 'incorrect_submission_type')
+    reply(context, comment_body)
 
 
-def cannot_reward_yourself_comment(comment):
+def cannot_reward_yourself_comment(context):
     """
     Responds the user with comment that the rep reward failed
-    :param comment: The comment that triggered the command and will be replied to.
+    :param context: CommentContext of the comment that triggered the command and will be replied to.
     """
-    comment_body = get_comment_from_config(comment, 'cannot_reward_yourself')
-    reply(comment, comment_body)
+    comment_body = get_comment_from_config(context, 'cannot_reward_yourself')
+    reply(context, comment_body)
 
 
-def deleted_or_removed_comment(comment):
+def deleted_or_removed_comment(context):
     """
     Responds the user with comment that the rep reward failed
-    :param comment: The comment that triggered the command and will be replied to.
+    :param context: CommentContext of the comment that triggered the command and will be replied to.
     """
-    comment_body = get_comment_from_config(comment, 'removed_or_deleted')
-    reply(comment, comment_body)
+    comment_body = get_comment_from_config(context, 'removed_or_deleted')
+    reply(context, comment_body)
 
 
-def reward_limit_reached_comment(comment):
+def reward_limit_reached_comment(context):
     """
     Responds the user with comment that the rep reward failed
-    :param comment: The comment that triggered the command and will be replied to.
+    :param context: CommentContext of the comment that triggered the command and will be replied to.
     """
-    comment_body = get_comment_from_config(comment, 'reward_limit_reached')
-    reply(comment, comment_body)
+    comment_body = get_comment_from_config(context, 'reward_limit_reached')
+    reply(context, comment_body)
 
 
-def cooldown_timer_reached_comment(comment):
+def cooldown_timer_reached_comment(context):
     """
     Responds the user with comment that the rep reward failed
-    :param comment: The comment that triggered the command and will be replied to.
+    :param context: CommentContext of the comment that triggered the command and will be replied to.
     """
-    comment_body = get_comment_from_config(comment, 'cooldown_timer_reached')
-    reply(comment, comment_body)
+    comment_body = get_comment_from_config(context, 'cooldown_timer_reached')
+    reply(context, comment_body)
 
 
-def mods_request_comment(comment, mod_list):
+def mods_request_comment(context, mod_list):
     """
     Responds the user with comment that the moderators have been notified
-    :param comment: The comment that triggered the command and will be replied to.
+    :param context: CommentContext of the comment that triggered the command and will be replied to.
     """
-    comment_body = get_comment_from_config(comment, 'mods_requested')
+    comment_body = get_comment_from_config(context, 'mods_requested')
     comment_body = f"{comment_body} {', '.join(mod_list)}"
-    reply(comment, comment_body)
+    reply(context, comment_body)
 
 
-def giveway_limit_reached(comment):
+def giveway_limit_reached(context):
     """
     Responds the user with comment when they have reached the max limit of rep that can be earned on single giveaway post
-    :param comment: The comment that triggered the command and will be replied to.
+    :param context: CommentContext of the comment that triggered the command and will be replied to.
     """
-    comment_body = get_comment_from_config(comment, 'giveway_limit_reached')
-    reply(comment, comment_body)
+    comment_body = get_comment_from_config(context, 'giveway_limit_reached')
+    reply(context, comment_body)
@@ -0,0 +1,93 @@
+import time
+from contextlib import closing
+
+import db_pool
+
+# States of a command in the order they are reached. A command never moves back to an earlier state.
+RECEIVED = 'received'
+VALIDATED = 'validated'
+RECORDED = 'recorded'
+FLAIRED = 'flaired'
+REPLIED = 'replied'
+STATES = [RECEIVED, VALIDATED, RECORDED, FLAIRED, REPLIED]
+# Incomplete commands older than this are not resumed, in seconds
+RECOVERY_WINDOW = 24 * 60 * 60
+# Completed commands are kept for this long, in seconds
+JOURNAL_RETENTION = 7 * 24 * 60 * 60
+
+
+def receive(comment_id, command_name):
+    """
+    Adds the command to the journal.
+
+    :param comment_id: Id of the comment with the command.
+    :param command_name: Name of the command.
+    :return: None if the command is new, otherwise the state it reached before.
+    """
+    with db_pool.get_connection() as db_conn:
+        with closing(db_conn.cursor()) as cursor:
+            cursor.execute("INSERT INTO command_journal (comment_id, command, state, received_utc, updated_utc) "
+                           "VALUES (%s, %s, %s, %s, %s) ON CONFLICT (comment_id) DO NOTHING",
+                           (comment_id, command_name, RECEIVED, int(time.time()), int(time.time())))
+            if cursor.rowcount:
+                return None
+            cursor.execute("SELECT state FROM command_journal WHERE comment_id=%s", (comment_id,))
+            return cursor.fetchone()[0]
+
+
+def advance(comment_id, state, cursor=None):
+    """
+    Moves the command to the state if it has not reached it yet.
+
+    :param comment_id: Id of the comment with the command.
+    :param state: The new state.
+    :param cursor: Cursor of an open transaction the update should be part of. A new transaction is used if None.
+    """
+    if cursor is None:
+        with db_pool.get_connection() as db_conn:
+            with closing(db_conn.cursor()) as cursor:
+                advance(comment_id, state, cursor)
+        return
+    cursor.execute("UPDATE command_journal SET state=%s, updated_utc=%s WHERE comment_id=%s AND state = ANY(%s)",
+                   (state, int(time.time()), comment_id, STATES[:STATES.index(state)]))
+
+
+def advance_many(comment_ids, state, cursor=None):
+    """
+    Moves several commands to the state if they have not reached it yet.
+
+    :param comment_ids: Ids of the comments with the commands.
+    :param state: The new state.
+    :param cursor: Cursor of an open transaction the update should be part of. A new transaction is used if None.
+    """
+    if cursor is None:
+        with db_pool.get_connection() as db_conn:
+            with closing(db_conn.cursor()) as cursor:
+                advance_many(comment_ids, state, cursor)
+        return
+    cursor.execute("UPDATE command_journal SET state=%s, updated_utc=%s WHERE comment_id = ANY(%s) AND state = ANY(%s)",
+                   (state, int(time.time()), list(comment_ids), STATES[:STATES.index(state)]))
+
+
+def incomplete() -> list:
+    """
+    Gets the recent commands that did not finish, oldest first.
+
+    :return: list of tuples of comment id, command name and state.
+    """
+    with db_pool.get_connection() as db_conn:
+        with closing(db_conn.cursor()) as cursor:
+            cursor.execute("SELECT comment_id, command, state FROM command_journal "
+                           "WHERE state <> %s AND received_utc >= %s ORDER BY received_utc",
+                           (REPLIED, int(time.time() - RECOVERY_WINDOW)))
+            return cursor.fetchall()
+
+
+def purge():
+    """
+    Deletes the journal entries older than the journal retention.
+    """
+    with db_pool.get_connection() as db_conn:
+        with closing(db_conn.cursor()) as cursor:
+            cursor.execute("DELETE FROM command_journal WHERE received_utc < %s",
+                           (int(time.time() - JOURNAL_RETENTION),))
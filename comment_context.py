@@ -0,0 +1,113 @@
+import CONSTANTS
+import submission_cache
+
+
+class CommentContext:
+    """
+    Everything a command needs about the comment that triggered it. The parent and the submission are fetched together
+    with a single reddit.info call the first time either of them is needed, and are then reused by every handler
+    instead of calling comment.parent() or the lazy comment.submission again. Recently fetched submissions come from
+    the submission cache, so a burst of commands on the same thread fetches it once.
+    """
+
+    def __init__(self, comment):
+        self.comment = comment
+        self.reddit = comment._reddit
+        self.author = comment.author
+        self.author_name = comment.author.name if comment.author else None
+        self.subreddit_name = comment.subreddit.display_name
+        self._parent = None
+        self._submission = None
+        self._cache_checked = False
+        # Set once a reply to the comment has been queued
+        self.replied = False
+
+    def _cached_submission(self):
+        """
+        Looks the submission up in the submission cache, at most once per context so that a miss is only counted once.
+
+        :return: the submission or None if it has to be fetched.
+        """
+        if self._submission is None and not self._cache_checked:
+            self._cache_checked = True
+            self._submission = submission_cache.get(self.comment.link_id)
+        return self._submission
+
+    def _fetch_parent_and_submission(self):
+        """
+        Fetches the parent and the submission in one request. If the comment is top level the parent is the submission,
+        so nothing is fetched when the submission is cached.
+        """
+        submission = self._cached_submission()
+        fullnames = [] if submission is not None else [self.comment.link_id]
+        if self.comment.parent_id != self.comment.link_id:
+            fullnames.append(self.comment.parent_id)
+        things = {thing.fullname: thing for thing in self.reddit.info(fullnames=fullnames)} if fullnames else {}
+        if submission is None:
+            submission = things[self.comment.link_id]
+            submission_cache.put(submission)
+        self._submission = submission
+        self._parent = things.get(self.comment.parent_id, submission)
+
+    @property
+    def parent(self):
+        if self._parent is None:
+            self._fetch_parent_and_submission()
+        return self._parent
+
+    @property
+    def submission(self):
+        # A cached submission is used without fetching the parent until it is needed
+        if self._cached_submission() is None:
+            self._fetch_parent_and_submission()
+        return self._submission
+
+    @staticmethod
+    def prefetch(contexts):
+        """
+        Fetches the parents and submissions of several contexts together, a hundred per reddit.info call.
+
+        :param contexts: CommentContexts of the same reddit instance.
+        """
+        contexts = [context for context in contexts if context._parent is None]
+        if not contexts:
+            return
+        fullnames = set()
+        for context in contexts:
+            if context._cached_submission() is None:
+                fullnames.add(context.comment.link_id)
+            if context.comment.parent_id != context.comment.link_id:
+                fullnames.add(context.comment.parent_id)
+        fullnames = list(fullnames)
+        things = {}
+        for start in range(0, len(fullnames), 100):
+            things.update({thing.fullname: thing
+                           for thing in contexts[0].reddit.info(fullnames=fullnames[start:start + 100])})
+        for context in contexts:
+            if context._submission is None:
+                context._submission = things[context.comment.link_id]
+                submission_cache.put(context._submission)
+            context._parent = things.get(context.comment.parent_id, context._submission)
+
+    @property
+    def subreddit(self):
+        return self.comment.subreddit
+
+    @property
+    def parent_author(self):
+        return self.parent.author
+
+    @property
+    def parent_author_name(self):
+        return self.parent.author.name if self.parent.author else None
+
+    @property
+    def submission_flair(self):
+        return self.submission.link_flair_text
+
+    @property
+    def is_trading_post(self) -> bool:
+        """
+        Checks if the submission is flaired as a trade offer or a giveaway entry.
+        """
+        return bool(self.submission_flair and CONSTANTS.TRADING_FLAIR_PATTERN.match(self.submission_flair))
@@ -0,0 +1,145 @@
+import os
+import time
+import zlib
+from contextlib import contextmanager
+from queue import Queue
+from threading import Lock, Thread
+
+# Number of threads processing comments
+WORKER_COUNT = int(os.getenv('WORKER_COUNT', 4))
+# Comments waiting per worker before the stream reader is blocked
+WORKER_QUEUE_SIZE = int(os.getenv('WORKER_QUEUE_SIZE', 25))
+
+_queues = []
+_workers = []
+_busy_seconds = []
+_busy_since = []
+_started_at = 0
+
+_user_locks = {}
+_user_locks_guard = Lock()
+
+
+def _acquire_user_lock(username):
+    """
+    Takes the lock of the user so that only one command of the same user is processed at a time.
+
+    :param username: Name of the comment author.
+    :return: the lock that has been acquired.
+    """
+    with _user_locks_guard:
+        lock_entry = _user_locks.setdefault(username, [Lock(), 0])
+        lock_entry[1] += 1
+    lock_entry[0].acquire()
+    return lock_entry
+
+
+def _release_user_lock(username, lock_entry):
+    """
+    Releases the lock of the user and forgets it when nobody else is waiting on it.
+
+    :param username: Name of the comment author.
+    :param lock_entry: The lock returned by _acquire_user_lock.
+    """
+    lock_entry[0].release()
+    with _user_locks_guard:
+        lock_entry[1] -= 1
+        if lock_entry[1] == 0:
+            del _user_locks[username]
+
+
+@contextmanager
+def user_lock(username):
+    """
+    Holds the lock of the user, for work on the commands of the user that happens outside the workers.
+
+    :param username: Name of the comment author.
+    """
+    lock_entry = _acquire_user_lock(username)
+    try:
+        yield
+    finally:
+        _release_user_lock(username, lock_entry)
+
+
+def _worker(index, handler):
+    """
+    Processes the comments from the worker queue until the stop sentinel is received.
+
+    :param index: Index of the worker and its queue.
+    :param handler: Function called with each comment.
+    """
+    queue = _queues[index]
+    while True:
+        comment = queue.get()
+        if comment is None:
+            break
+        username = comment.author.name if comment.author else None
+        lock_entry = _acquire_user_lock(username)
+        _busy_since[index] = time.monotonic()
+        try:
+            handler(comment)
+        finally:
+            _busy_seconds[index] += time.monotonic() - _busy_since[index]
+            _busy_since[index] = None
+            _release_user_lock(username, lock_entry)
+            queue.task_done()
+
+
+def start(handler):
+    """
+    Starts the worker threads.
+
+    :param handler: Function called with each comment. It should handle its own exceptions.
+    """
+    global _started_at
+    _started_at = time.monotonic()
+    for index in range(WORKER_COUNT):
+        _queues.append(Queue(maxsize=WORKER_QUEUE_SIZE))
+        _busy_seconds.append(0.0)
+        _busy_since.append(None)
+        worker = Thread(target=_worker, args=(index, handler), name=f"comment-worker-{index}")
+        _workers.append(worker)
+        worker.start()
+
+
+def submit(comment):
+    """
+    Queues the comment for processing. Comments of the same submission always go to the same worker so they are
+    processed in order. Blocks while the worker queue is full.
+
+    :param comment: The comment that will be processed.
+    """
+    index = zlib.crc32(comment.link_id.encode()) % len(_queues)
+    _queues[index].put(comment)
+
+
+def stop():
+    """
+    Lets the workers finish the queued comments and waits for them to exit.
+    """
+    for queue in _queues:
+        queue.put(None)
+    for worker in _workers:
+        worker.join()
+    _queues.clear()
+    _workers.clear()
+    _busy_seconds.clear()
+    _busy_since.clear()
+
+
+def stats() -> dict:
+    """
+    Gets the queue depth and utilisation of the workers.
+
+    :return: dictionary with the number of queued comments, busy workers and the fraction of time spent processing.
+    """
+    now = time.monotonic()
+    elapsed = max(now - _started_at, 1e-9)
+    busy_seconds = [busy + (now - since if since is not None else 0)
+                    for busy, since in zip(_busy_seconds, _busy_since)]
+    return {'queue_depth': sum(queue.qsize() for queue in _queues),
+            'queue_capacity': WORKER_QUEUE_SIZE * len(_queues),
+            'busy_workers': sum(since is not None for since in _busy_since),
+            'worker_count': len(_workers),
+            'utilisation': sum(busy_seconds) / (elapsed * len(_workers)) if _workers else 0.0}
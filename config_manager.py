@@ -0,0 +1,240 @@
+import os
+import re
+import time
+import traceback
+from threading import Lock
+
+import yaml
+
+import subreddits
+
+# Seconds before the wiki revision is checked again
+CONFIG_TTL = int(os.getenv('CONFIG_TTL', 300))
+
+_lock = Lock()
+# Loaded config of every subreddit by lowercase subreddit name, with its compiled templates, revision and expiry. A
+# state is never changed once stored, a refresh stores a new one.
+_configs = {}
+# Held while the wiki page of a subreddit is fetched, by lowercase subreddit name
+_refresh_locks = {}
+_EMPTY_STATE = {'config': {}, 'templates': {}, 'revision_id': None, 'expires_at': 0}
+stats = {'hits': 0, 'misses': 0, 'reloads': 0, 'refresh_failures': 0}
+
+PLACEHOLDER_PATTERN = re.compile(r"{{([^{}]*)}}")
+# Values of the placeholders that can be used in the comment templates, resolved from the CommentContext
+TEMPLATE_VARIABLES = {'author': lambda context: context.author_name,
+                      'parent-author': lambda context: context.parent_author_name}
+# Called with the error of a comment template that could not be compiled
+_on_error = print
+
+
+def parse_config(config_md) -> dict:
+    """
+    Parses the multi document yaml config into documents indexed by their type.
+
+    :param config_md: The markdown content of the wiki config page.
+    :return: dictionary mapping config type to the config document.
+    """
+    config = {}
+    for document in yaml.safe_load_all(config_md):
+        if isinstance(document, dict) and 'type' in document:
+            config[document['type']] = document
+    return config
+
+
+def compile_template(template):
+    """
+    Compiles the comment template into a render function. Only the placeholders used by the template are resolved
+    when it is rendered.
+
+    :param template: Comment template with {{placeholder}} variables.
+    :return: function that renders the template for a CommentContext.
+    :raises ValueError: if the template is not text or uses an unknown placeholder.
+    """
+    if not isinstance(template, str):
+        raise ValueError("Comment template is not text")
+    # Split alternates between literal text and placeholder names
+    parts = PLACEHOLDER_PATTERN.split(template)
+    for name in parts[1::2]:
+        if name not in TEMPLATE_VARIABLES:
+            raise ValueError(f"Unknown placeholder {{{{{name}}}}} in comment template")
+    if len(parts) == 1:
+        return lambda context: template
+    resolvers = [(part, None) if index % 2 == 0 else (None, TEMPLATE_VARIABLES[part]) for index, part in enumerate(parts)]
+
+    def render(context):
+        return ''.join(literal if resolver is None else resolver(context) for literal, resolver in resolvers)
+
+    return render
+
+
+def compile_templates(config, subreddit_name) -> dict:
+    """
+    Compiles the comment of every config document that has one. A template that does not compile is reported and left
+    out, so that only its own reply falls back to the default body and the rest of the config keeps working.
+
+    :param config: dictionary mapping config type to the config document.
+    :param subreddit_name: Name of the subreddit the config belongs to, for the error report.
+    :return: dictionary mapping config type to the render function.
+    """
+    templates = {}
+    for config_type, document in config.items():
+        if 'comment' not in document:
+            continue
+        try:
+            templates[config_type] = compile_template(document['comment'])
+        except ValueError as exp:
+            _on_error(f"Comment template {config_type} of r/{subreddit_name} is not used: {exp}")
+    return templates
+
+
+def set_error_handler(on_error):
+    """
+    Sets where the errors of the comment templates are reported. They are reported once per loaded wiki revision.
+
+    :param on_error: Function called with the error message.
+    """
+    global _on_error
+    _on_error = on_error
+
+
+def _latest_revision_id(wiki_page):
+    """
+    Gets the id of the latest revision of the wiki page. This is a much smaller request than downloading the page.
+
+    :param wiki_page: praw WikiPage instance.
+    :return: revision id or None if the page has no revisions.
+    """
+    for revision in wiki_page.revisions(limit=1):
+        return revision['id']
+    return None
+
+
+def _refresh(reddit, subreddit_name, state) -> dict:
+    """
+    Reloads the config if the wiki page has changed since the last load. If anything fails, the last good config is
+    kept and will be served until the next TTL expiry. Runs without the cache lock so that Reddit never holds up the
+    lookups of other subreddits.
+
+    :param reddit: The reddit instance used to fetch the wiki page.
+    :param subreddit_name: Display name of the subreddit the config belongs to.
+    :param state: Loaded config state of the subreddit.
+    :return: the new state of the subreddit.
+    """
+    wiki_page = reddit.subreddit(subreddit_name).wiki[subreddits.settings(subreddit_name)['config_wiki_page']]
+    try:
+        revision_id = _latest_revision_id(wiki_page)
+        if not state['config'] or revision_id is None or revision_id != state['revision_id']:
+            config = parse_config(wiki_page.content_md)
+            state = {'config': config, 'templates': compile_templates(config, subreddit_name),
+                     'revision_id': revision_id}
+            with _lock:
+                stats['reloads'] += 1
+    except Exception:
+        with _lock:
+            stats['refresh_failures'] += 1
+        if not state['config']:
+            raise
+        print(f"Could not refresh config of r/{subreddit_name}, serving last good config\n{traceback.format_exc()}")
+    return {**state, 'expires_at': time.time() + CONFIG_TTL}
+
+
+def _get_state(reddit, subreddit_name) -> dict:
+    """
+    Gets the loaded config state of the subreddit, refreshing it when the TTL has expired. One thread refreshes a
+    subreddit at a time, the others are served the last good config meanwhile and only wait if there is none yet.
+
+    :param reddit: The reddit instance used to fetch the wiki page.
+    :param subreddit_name: Display name of the subreddit the config belongs to.
+    :return: dictionary with the config, templates, revision id and expiry time.
+    """
+    name = subreddit_name.lower()
+    with _lock:
+        state = _configs.get(name, _EMPTY_STATE)
+        if state['config'] and time.time() < state['expires_at']:
+            stats['hits'] += 1
+            return state
+        stats['misses'] += 1
+        refresh_lock = _refresh_locks.setdefault(name, Lock())
+    if not refresh_lock.acquire(blocking=not state['config']):
+        return state
+    try:
+        with _lock:
+            state = _configs.get(name, _EMPTY_STATE)
+        # Another thread may have refreshed it while this one waited
+        if state['config'] and time.time() < state['expires_at']:
+            return state
+        state = _refresh(reddit, subreddit_name, state)
+        with _lock:
+            _configs[name] = state
+        return state
+    finally:
+        refresh_lock.release()
+
+
+def get_config(reddit, subreddit_name) -> dict:
+    """
+    Gets the parsed bot config of the subreddit, refreshing it when the TTL has expired.
+
+    :param reddit: The reddit instance used to fetch the wiki page.
+    :param subreddit_name: Display name of the subreddit the config belongs to.
+    :return: dictionary mapping config type to the config document.
+    """
+    return _get_state(reddit, subreddit_name)['config']
+
+
+def get_config_document(reddit, subreddit_name, config_type):
+    """
+    Gets a single config document by its type.
+
+    :param reddit: The reddit instance used to fetch the wiki page.
+    :param subreddit_name: Display name of the subreddit the config belongs to.
+    :param config_type: The value of the type key of the document.
+    :return: config document or None if there is no document with that type.
+    """
+    return get_config(reddit, subreddit_name).get(config_type)
+
+
+def get_template(reddit, subreddit_name, config_type):
+    """
+    Gets the compiled comment template of a config document.
+
+    :param reddit: The reddit instance used to fetch the wiki page.
+    :param subreddit_name: Display name of the subreddit the config belongs to.
+    :param config_type: The value of the type key of the document.
+    :return: render function or None if there is no comment with that type.
+    """
+    return _get_state(reddit, subreddit_name)['templates'].get(config_type)
+
+
+def snapshot() -> dict:
+    """
+    Gets the loaded configs for the warm snapshot. The templates are left out and compiled again on restore.
+
+    :return: dictionary of the config, revision id and expiry time by lowercase subreddit name.
+    """
+    with _lock:
+        return {name: {'config': state['config'], 'revision_id': state['revision_id'], 'expires_at': state['expires_at']}
+                for name, state in _configs.items() if state['config']}
+
+
+def restore(states):
+    """
+    Loads the configs of the warm snapshot. They expire when they would have without the restart, after which the wiki
+    revision is checked as usual.
+
+    :param states: dictionary returned by snapshot.
+    """
+    with _lock:
+        for name, state in states.items():
+            if name not in _configs:
+                _configs[name] = {**state, 'templates': compile_templates(state['config'], name)}
+
+
+def invalidate():
+    """
+    Forces the next lookup of every subreddit to check the wiki for a new revision.
+    """
+    with _lock:
+        for name, state in _configs.items():
+            _configs[name] = {**state, 'expires_at': 0}
@@ -0,0 +1,197 @@
+import os
+import time
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Lock
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+import metrics
+
+_pool = None
+_lock_pool = None
+_pool_lock = Lock()
+# ThreadedConnectionPool raises instead of waiting when it is exhausted, so callers wait on this instead
+_pool_slots = BoundedSemaphore(int(os.getenv('DB_POOL_MAX', 5)))
+# Connections holding advisory locks come from a pool of their own. A lock holder needs query connections for the work
+# it does under the lock, and must never wait for a query slot that other lock holders keep.
+_lock_pool_slots = BoundedSemaphore(int(os.getenv('DB_LOCK_POOL_MAX', 5)))
+# Connections idle for longer than this are checked before they are lent, in seconds. Recently used ones are lent as
+# they are and discarded if they turn out to be broken.
+IDLE_CHECK_SECONDS = int(os.getenv('DB_IDLE_CHECK_SECONDS', 30))
+# When each pooled connection was last returned, by connection
+_returned_at = {}
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """
+    Cursor that records the latency of every query, labelled with its statement type.
+    """
+
+    def execute(self, query, vars=None):
+        with metrics.timed('db_query_seconds', statement=_statement_type(query)):
+            return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        with metrics.timed('db_query_seconds', statement=_statement_type(query)):
+            return super().executemany(query, vars_list)
+
+
+def _statement_type(query) -> str:
+    """
+    Gets the first keyword of the query, e.g. SELECT or INSERT, so that the metric labels stay few.
+
+    :param query: SQL query, as text or bytes.
+    :return: the uppercase keyword.
+    """
+    if isinstance(query, bytes):
+        query = query.decode(errors='replace')
+    words = query.split(None, 1)
+    return words[0].upper() if words else ''
+
+
+def _create_pool(min_size, max_size):
+    """
+    Creates a threaded connection pool using the environment settings.
+
+    DB_POOL_MIN and DB_POOL_MAX control the size of the query pool, DB_LOCK_POOL_MAX the one of the advisory lock pool,
+    and DB_SSLMODE can be set to disable for a local Postgres.
+
+    :param min_size: Connections opened straight away.
+    :param max_size: Connections the pool holds at most.
+    """
+    return psycopg2.pool.ThreadedConnectionPool(min_size,
+                                                max_size,
+                                                os.getenv('DATABASE_URL'),
+                                                sslmode=os.getenv('DB_SSLMODE', 'require'),
+                                                cursor_factory=TimedCursor)
+
+
+def get_pool():
+    """
+    Returns the shared connection pool, creating it on first use.
+
+    :return: psycopg2 ThreadedConnectionPool shared by all threads.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.closed:
+            _pool = _create_pool(int(os.getenv('DB_POOL_MIN', 1)), int(os.getenv('DB_POOL_MAX', 5)))
+        return _pool
+
+
+def _get_lock_pool():
+    """
+    Returns the pool of the connections holding advisory locks, creating it on first use.
+
+    :return: psycopg2 ThreadedConnectionPool shared by all threads.
+    """
+    global _lock_pool
+    with _pool_lock:
+        if _lock_pool is None or _lock_pool.closed:
+            _lock_pool = _create_pool(0, int(os.getenv('DB_LOCK_POOL_MAX', 5)))
+        return _lock_pool
+
+
+def _is_healthy(db_conn) -> bool:
+    """
+    Checks that the pooled connection is still usable before handing it out.
+
+    :param db_conn: psycopg2 connection taken from the pool.
+    :return: True if the connection answered a trivial query otherwise False.
+    """
+    if db_conn.closed:
+        return False
+    try:
+        with db_conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        db_conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _acquire(pool):
+    """
+    Takes a connection from the pool. Connections that sat idle long enough for the server or a proxy to drop them are
+    checked first, and dropped ones are discarded until a working or newly opened connection is found.
+
+    :param pool: The pool the connection is taken from.
+    :return: psycopg2 connection.
+    """
+    while True:
+        db_conn = pool.getconn()
+        # Connections the pool has just opened were never returned and need no check
+        returned_at = _returned_at.pop(db_conn, None)
+        idle = returned_at is not None and time.monotonic() - returned_at > IDLE_CHECK_SECONDS
+        if not db_conn.closed and (not idle or _is_healthy(db_conn)):
+            return db_conn
+        pool.putconn(db_conn, close=True)
+
+
+@contextmanager
+def _lend(pool, slots):
+    """
+    Lends a connection of the pool once one of its slots is free. The transaction is committed on success and rolled
+    back on error. If the connection was lost during the block it is closed instead of being returned to the pool.
+
+    :param pool: The pool the connection is taken from.
+    :param slots: Semaphore bounding the connections lent from the pool.
+    :return: psycopg2 connection.
+    """
+    with slots:
+        db_conn = _acquire(pool)
+        broken = False
+        try:
+            yield db_conn
+            db_conn.commit()
+        except Exception as exp:
+            # A connection that failed at the network level is not trusted again even if it still looks open.
+            # Deadlocks, serialization failures and statement timeouts leave it usable.
+            broken = isinstance(exp, psycopg2.OperationalError) and not isinstance(
+                exp, (psycopg2.extensions.TransactionRollbackError, psycopg2.extensions.QueryCanceledError))
+            try:
+                db_conn.rollback()
+            except psycopg2.Error:
+                broken = True
+            raise
+        finally:
+            if broken or db_conn.closed:
+                pool.putconn(db_conn, close=True)
+            else:
+                _returned_at[db_conn] = time.monotonic()
+                pool.putconn(db_conn)
+
+
+def get_connection():
+    """
+    Context manager that lends a pooled connection. The transaction is committed on success and rolled back on error.
+    If the connection was lost during the block it is closed instead of being returned to the pool.
+
+    :return: psycopg2 connection.
+    """
+    return _lend(get_pool(), _pool_slots)
+
+
+def get_lock_connection():
+    """
+    Context manager that lends a connection of the advisory lock pool, for a transaction that only holds an advisory
+    lock while the work under it uses get_connection.
+
+    :return: psycopg2 connection.
+    """
+    return _lend(_get_lock_pool(), _lock_pool_slots)
+
+
+def close_pool():
+    """
+    Closes all the connections in the pool. Used when the bot is shutting down.
+    """
+    global _pool, _lock_pool
+    with _pool_lock:
+        for pool in (_pool, _lock_pool):
+            if pool is not None and not pool.closed:
+                pool.closeall()
+        _pool = _lock_pool = None
+        _returned_at.clear()
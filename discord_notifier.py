@@ -0,0 +1,247 @@
+import asyncio
+import json
+import os
+import time
+import traceback
+from collections import OrderedDict
+from pprint import pprint
+from threading import Condition, Thread
+
+import requests
+
+# Messages waiting to be posted before new ones are dropped
+NOTIFIER_QUEUE_SIZE = int(os.getenv('NOTIFIER_QUEUE_SIZE', 100))
+# Seconds a message waits so that identical messages posted right after it can be merged into it
+COALESCE_SECONDS = 5
+# Discord rejects messages longer than this
+DISCORD_MESSAGE_LIMIT = 2000
+
+_condition = Condition()
+# Pending messages keyed by (webhook, message), with how many times they were sent and when they were first sent
+_pending = OrderedDict()
+_session = requests.Session()
+_sender = None
+_running = False
+# Dropped messages already mentioned in a post
+_reported_dropped = 0
+# Event loop and event of the asyncio sender, set so that notify can wake it from any thread
+_async_wakeup = None
+stats = {'posted': 0, 'coalesced': 0, 'dropped': 0, 'rate_limited': 0}
+
+
+def notify(msg, webhook):
+    """
+    Queues the message for the discord channel. Identical messages waiting in the queue are merged and counted, and
+    the message is dropped if the queue is full.
+
+    :param msg: message content.
+    :param webhook: Name of the environment variable holding the channel webhook url.
+    """
+    key = (webhook, msg)
+    with _condition:
+        if key in _pending:
+            _pending[key][0] += 1
+            stats['coalesced'] += 1
+        elif len(_pending) >= NOTIFIER_QUEUE_SIZE:
+            stats['dropped'] += 1
+        else:
+            _pending[key] = [1, time.monotonic()]
+            _condition.notify_all()
+    if _async_wakeup is not None:
+        loop, wakeup = _async_wakeup
+        loop.call_soon_threadsafe(wakeup.set)
+
+
+def _format(msg, count, dropped) -> str:
+    """
+    Adds the repeat and dropped counts to the message and keeps it under the Discord limit.
+
+    :param msg: message content.
+    :param count: Number of identical messages merged into this one.
+    :param dropped: Number of messages dropped since the last post.
+    :return: message content to post.
+    """
+    notes = ""
+    if count > 1:
+        notes += f"(repeated {count} times)\n"
+    if dropped:
+        notes += f"({dropped} messages dropped because the queue was full)\n"
+    return (notes + msg)[:DISCORD_MESSAGE_LIMIT]
+
+
+def _retry_after(body, headers) -> float:
+    """
+    Gets the seconds to wait after a rate limited post. Discord puts them in the JSON body, proxies in front of it may
+    answer with another body and only the Retry-After header.
+
+    :param body: Text of the 429 response.
+    :param headers: Headers of the 429 response.
+    :return: seconds to wait before posting again.
+    """
+    try:
+        return float(json.loads(body)['retry_after'])
+    except (ValueError, TypeError, KeyError):
+        pass
+    try:
+        return float(headers.get('Retry-After', 1))
+    except ValueError:
+        return 1.0
+
+
+def _post(msg, webhook):
+    """
+    Posts the message with the pooled session, waiting and retrying when Discord rate limits the webhook.
+
+    :param msg: message content.
+    :param webhook: Name of the environment variable holding the channel webhook url.
+    """
+    data = {"content": msg, "username": "Karma Bot"}
+    while True:
+        output = _session.post(os.getenv(webhook), json=data, timeout=10)
+        if output.status_code != 429:
+            break
+        stats['rate_limited'] += 1
+        time.sleep(_retry_after(output.text, output.headers))
+    try:
+        output.raise_for_status()
+        stats['posted'] += 1
+    except requests.HTTPError:
+        pprint(msg)
+
+
+async def _post_async(session, msg, webhook):
+    """
+    Posts the message from the event loop, waiting and retrying when Discord rate limits the webhook.
+
+    :param session: aiohttp ClientSession the message is posted with.
+    :param msg: message content.
+    :param webhook: Name of the environment variable holding the channel webhook url.
+    """
+    data = {"content": msg, "username": "Karma Bot"}
+    while True:
+        async with session.post(os.getenv(webhook), json=data) as output:
+            if output.status != 429:
+                if output.status < 400:
+                    stats['posted'] += 1
+                else:
+                    pprint(msg)
+                return
+            stats['rate_limited'] += 1
+            retry_after = _retry_after(await output.text(), output.headers)
+        await asyncio.sleep(retry_after)
+
+
+def _take_due():
+    """
+    Takes the oldest message once identical messages posted right after it have had the time to be merged into it.
+    When stopping, the message is taken straight away. Must be called holding the condition.
+
+    :return: tuple of the webhook and the message to post, or of None and the seconds to wait for the message.
+    """
+    global _reported_dropped
+    (webhook, msg), (count, queued_at) = next(iter(_pending.items()))
+    wait = queued_at + COALESCE_SECONDS - time.monotonic()
+    if wait > 0 and _running:
+        return None, wait
+    count = _pending.pop((webhook, msg))[0]
+    dropped = stats['dropped'] - _reported_dropped
+    _reported_dropped = stats['dropped']
+    return webhook, _format(msg, count, dropped)
+
+
+def _send():
+    """
+    Posts the queued messages until the notifier is stopped and the queue is empty.
+    """
+    while True:
+        with _condition:
+            while not _pending and _running:
+                _condition.wait()
+            if not _pending:
+                return
+            webhook, msg = _take_due()
+            if webhook is None:
+                _condition.wait(msg)
+                continue
+        # Nothing may stop the thread, the messages after this one would never be posted
+        try:
+            _post(msg, webhook)
+        except requests.RequestException:
+            pprint(msg)
+        except Exception:
+            pprint(msg)
+            print(traceback.format_exc())
+
+
+async def send_async(session):
+    """
+    Posts the queued messages from the event loop until stop_async is called and the queue is empty. Used by the
+    asyncio mode instead of the thread, the messages are queued with notify from any thread as usual.
+
+    :param session: aiohttp ClientSession the messages are posted with.
+    """
+    global _async_wakeup, _running
+    wakeup = asyncio.Event()
+    _async_wakeup = (asyncio.get_running_loop(), wakeup)
+    _running = True
+    while True:
+        # Cleared before looking at the queue so that a message queued meanwhile wakes the loop again
+        wakeup.clear()
+        with _condition:
+            if not _pending and not _running:
+                _async_wakeup = None
+                return
+            webhook, msg = _take_due() if _pending else (None, None)
+        if webhook is None:
+            try:
+                await asyncio.wait_for(wakeup.wait(), msg)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        try:
+            await _post_async(session, msg, webhook)
+        except Exception:
+            pprint(msg)
+            print(traceback.format_exc())
+
+
+def stop_async():
+    """
+    Lets the asyncio sender post the remaining messages and return. Must be called from the event loop.
+    """
+    global _running
+    with _condition:
+        _running = False
+    if _async_wakeup is not None:
+        _async_wakeup[1].set()
+
+
+def start():
+    """
+    Starts the thread posting the messages.
+    """
+    global _sender, _running
+    _running = True
+    _sender = Thread(target=_send, name="discord-notifier", daemon=True)
+    _sender.start()
+
+
+def stop():
+    """
+    Posts the remaining messages and waits for the thread to exit.
+    """
+    global _running
+    with _condition:
+        _running = False
+        _condition.notify_all()
+    if _sender is not None:
+        _sender.join()
+
+
+def queue_depth() -> int:
+    """
+    Gets the number of messages waiting to be posted.
+
+    :return: number of pending messages.
+    """
+    return len(_pending)
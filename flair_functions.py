@@ -1,63 +1,113 @@
-import CONSTANTS
+from contextlib import closing
+
+import action_queue
+import db_pool
+import rep_ledger
+import submission_cache
+import subreddits
+
+
+def _close_submission(submission):
+    submission.flair.select(subreddits.settings(submission.subreddit.display_name)['trade_ended_flair_id'])
+    submission.mod.lock()
+    submission_cache.invalidate(submission.fullname)
 
 
 def mark_submission_as_closed(submission):
     """
-    Changes the flair of submission to Traded Ended and locks the comments.
+    Queues changing the flair of submission to Traded Ended and locking the comments.
 
     :param submission: The submission whose flair will be changed.
     """
-    submission.flair.select(CONSTANTS.TRADE_ENDED_FLAIR_ID)
-    submission.mod.lock()
+    submission_cache.invalidate(submission.fullname)
+    action_queue.enqueue(_close_submission, submission, key=('close', submission.id))
 
 
-def decrement_rep(comment):
+def _set_flair(subreddit, username, text, flair_template_id):
+    subreddit.flair.set(username, text=text, flair_template_id=flair_template_id)
+
+
+def rep_flair_text(flair_text, rep) -> str:
     """
-    Decrements the user flair by one of the parent comment/submission author.
+    Puts the rep total in the flair text. A rep flair keeps its prefix, e.g. a custom "Trusted Trader: 5", and only
+    its last word is replaced.
 
-    :param comment: The comment that triggered the command. Parent of this will be considered.
+    :param flair_text: Current flair text of the user, can be None.
+    :param rep: The rep total of the user.
+    :return: the new flair text.
     """
-    parent_post = comment.parent()
-    author_name = parent_post.author.name
+    if not flair_text:
+        return f'Trade Rep: {rep}'
+    words = flair_text.split()
+    words[-1] = str(rep)
+    return ' '.join(words)
 
-    marketmm2 = comment._reddit.subreddit("MarketMM2")
-    # if the author has no flair
-    if not parent_post.author_flair_css_class:
-        marketmm2.flair.set(author_name, text='Trade Rep: -1', flair_template_id=CONSTANTS.REP_FLAIR_ID)
-    else:
-        # Getting the flair and adding the value
-        user_flair = parent_post.author_flair_text
 
-        # Splits rep into two
-        user_flair_split = user_flair.split()
-        user_flair_split[-1] = int(user_flair_split[-1])
-        user_flair_split[-1] -= 1
-        # Combines back string and int part
-        user_flair = ' '.join(map(str, user_flair_split))
-        marketmm2.flair.set(author_name, text=user_flair, flair_template_id=parent_post.author_flair_template_id)
+def set_rep_flair(subreddit, username, rep, flair_text=None, flair_template_id=None, on_done=None):
+    """
+    Queues setting the user flair to show the rep total from the ledger. The prefix and the template of the current
+    flair are kept, users without a flair get the rep flair template. Flairs that do not end with a number were chosen
+    by the user or the mods and are left alone. Awards made while the flair waits its turn in the action queue are
+    merged and only the newest total is sent.
+
+    :param subreddit: The subreddit where the flair will be set.
+    :param username: Name of the redditor whose flair will be set.
+    :param rep: The rep total of the user.
+    :param flair_text: Current flair text of the user, e.g. author_flair_text of their comment.
+    :param flair_template_id: Current flair template of the user, e.g. author_flair_template_id of their comment.
+    :param on_done: Optional function called once the flair has been set.
+    """
+    if flair_text and not rep_ledger.is_rep_flair(flair_text):
+        if on_done is not None:
+            on_done()
+        return
+    if not flair_text or not flair_template_id:
+        flair_template_id = subreddits.settings(subreddit.display_name)['rep_flair_id']
+    action_queue.enqueue(_set_flair, subreddit, username, rep_flair_text(flair_text, rep), flair_template_id,
+                         key=('flair', subreddit.display_name.lower(), username.lower()), on_done=on_done)
 
 
-def increment_rep(comment):
+def reconcile_rep_flairs(subreddit) -> str:
     """
-    Increments the user flair by one of the parent comment/submission author.
+    Repairs the rep flairs that drifted from the ledger, e.g. after a flair update failed. The whole flair list is read
+    in one paginated pass and compared with the user_rep table. The flair list has no template ids, so wrong flairs are
+    set again one by one with the rep flair template. Flairs that are not rep flairs are left alone, and a flair is only
+    added to users the ledger seeded without one, and only once.
 
-    :param comment: The comment that triggered the command. Parent of this will be considered.
+    :param subreddit: The subreddit whose flairs are checked.
+    :return: summary of what was repaired.
     """
-    parent_post = comment.parent()
-    author_name = parent_post.author.name
+    user_rep = subreddits.table(subreddit.display_name, 'user_rep')
+    with db_pool.get_connection() as db_conn:
+        with closing(db_conn.cursor()) as cursor:
+            cursor.execute(f"SELECT username, rep, needs_flair FROM {user_rep}")
+            expected = {username.lower(): (username, rep, needs_flair) for username, rep, needs_flair in cursor}
+    seeded = [username for username, _, needs_flair in expected.values() if needs_flair]
 
-    marketmm2 = comment._reddit.subreddit("MarketMM2")
-    # if the author has no flair
-    if not parent_post.author_flair_css_class:
-        marketmm2.flair.set(author_name, text='Trade Rep: 1', flair_template_id=CONSTANTS.REP_FLAIR_ID)
-    else:
-        # Getting the flair and adding the value
-        user_flair = parent_post.author_flair_text
+    wrong = {}
+    custom = 0
+    for flair in subreddit.flair(limit=None):
+        entry = expected.pop(str(flair['user']).lower(), None)
+        if entry is None or not flair['flair_text']:
+            continue
+        if not rep_ledger.is_rep_flair(flair['flair_text']):
+            custom += 1
+        elif rep_ledger.parse_flair_rep(flair['flair_text']) != entry[1]:
+            wrong[entry[0]] = flair['flair_text']
+    # Users left in the ledger have no flair, only the ones that never had one get it
+    missing = [username for username, _, needs_flair in expected.values() if needs_flair]
+    summary = f"{custom} custom flairs left alone in r/{subreddit.display_name}"
 
-        # Splits rep into two
-        user_flair_split = user_flair.split()
-        user_flair_split[-1] = int(user_flair_split[-1])
-        user_flair_split[-1] += 1
-        # Combines back string and int part
-        user_flair = ' '.join(map(str, user_flair_split))
-        marketmm2.flair.set(author_name, text=user_flair, flair_template_id=parent_post.author_flair_template_id)
+    with db_pool.get_connection() as db_conn:
+        with closing(db_conn.cursor()) as cursor:
+            # Totals are read again so that awards made during the pass are not undone
+            cursor.execute(f"SELECT username, rep FROM {user_rep} WHERE username = ANY(%s)", (list(wrong) + missing,))
+            current = cursor.fetchall()
+            # The seeded users now have a flair or get one below, either way they are never added again
+            cursor.execute(f"UPDATE {user_rep} SET needs_flair = FALSE WHERE needs_flair AND username = ANY(%s)",
+                           (seeded,))
+    for username, rep in current:
+        set_rep_flair(subreddit, username, rep, flair_text=wrong.get(username))
+    if not wrong and not missing:
+        return f"All rep flairs in r/{subreddit.display_name} match the ledger, {summary}"
+    return f"Repaired {len(wrong)} rep flairs and added {len(missing)} missing rep flairs, {summary}"
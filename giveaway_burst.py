@@ -0,0 +1,135 @@
+import os
+import traceback
+from collections import deque
+from threading import Lock, Timer
+
+import api_counter
+import comment_dispatcher
+import metrics
+
+# +REP of the same awarder on the same giveaway within the window that start a burst
+BURST_THRESHOLD = int(os.getenv('BURST_THRESHOLD', 5))
+# Seconds of comment time the +REP are counted over
+BURST_WINDOW_SECONDS = int(os.getenv('BURST_WINDOW_SECONDS', 30))
+# Seconds a burst collects +REP before they are checked and recorded together
+BURST_FLUSH_SECONDS = int(os.getenv('BURST_FLUSH_SECONDS', 10))
+# Upper bounds of the histogram of +REP handled per flush
+GROUP_SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+# Awarders tracked before the ones without a recent +REP are forgotten
+MAX_TRACKED = 1000
+
+_lock = Lock()
+# Comment times of the recent +REP of each awarder on each giveaway, by submission fullname and awarder
+_recent = {}
+# Contexts waiting for the flush and its timer, by submission fullname and awarder
+_groups = {}
+_handler = None
+_on_error = print
+stats = {'bursts': 0, 'deferred': 0, 'flushes': 0, 'failures': 0}
+
+
+def defer(context) -> bool:
+    """
+    Takes the +REP out of the normal path if its awarder is in a burst on a giveaway. The command is then handled
+    with the rest of the group when the flush runs.
+
+    :param context: CommentContext of the +REP.
+    :return: True if the command was deferred, False if it should be processed now.
+    """
+    if _handler is None or not context.is_trading_post or 'giveaway' not in context.submission_flair.lower():
+        return False
+    key = (context.comment.link_id, context.author_name)
+    created_utc = context.comment.created_utc
+    with _lock:
+        group = _groups.get(key)
+        if group is None:
+            recent = _recent.setdefault(key, deque())
+            recent.append(created_utc)
+            while recent and recent[0] < created_utc - BURST_WINDOW_SECONDS:
+                recent.popleft()
+            if len(recent) < BURST_THRESHOLD:
+                if len(_recent) > MAX_TRACKED:
+                    for stale in [stale for stale, times in _recent.items()
+                                  if times[-1] < created_utc - BURST_WINDOW_SECONDS]:
+                        del _recent[stale]
+                return False
+            del _recent[key]
+            timer = Timer(BURST_FLUSH_SECONDS, _flush_safely, (key,))
+            timer.daemon = True
+            group = _groups[key] = {'contexts': [], 'timer': timer}
+            timer.start()
+            stats['bursts'] += 1
+        group['contexts'].append(context)
+        stats['deferred'] += 1
+    # The reply comes from the summary, load_comment must not mark the command complete
+    context.replied = True
+    return True
+
+
+def flush(key):
+    """
+    Hands the +REP of a group to the handler, holding the lock of the awarder like the comment workers do.
+
+    :param key: Tuple of the submission fullname and the awarder name of the group.
+    """
+    with _lock:
+        group = _groups.pop(key, None)
+    if group is None:
+        return
+    group['timer'].cancel()
+    stats['flushes'] += 1
+    metrics.observe('giveaway_burst_group_size', len(group['contexts']), buckets=GROUP_SIZE_BUCKETS)
+    with comment_dispatcher.user_lock(key[1]):
+        # The +REP of the group finished when they were deferred, the flush is counted as a command of its own
+        api_counter.start_command('giveaway_burst')
+        try:
+            _handler(group['contexts'])
+        finally:
+            api_counter.finish_command()
+
+
+def _flush_safely(key):
+    """
+    Runs the flush on the timer thread. A failed group stays incomplete in the journal and is retried at the next
+    start up.
+
+    :param key: Tuple of the submission fullname and the awarder name of the group.
+    """
+    try:
+        flush(key)
+    except Exception:
+        stats['failures'] += 1
+        _on_error(traceback.format_exc())
+
+
+def start(handler, on_error):
+    """
+    Sets the function the groups are flushed to and the one their errors are reported to.
+
+    :param handler: Function called with the list of CommentContexts of a group, in comment order.
+    :param on_error: Function called with the traceback of a failed flush.
+    """
+    global _handler, _on_error
+    _handler = handler
+    _on_error = on_error
+
+
+def stop():
+    """
+    Flushes the waiting groups now instead of waiting for their timers. Must be called before the action queue is
+    stopped so that their flairs and summaries are still sent.
+    """
+    with _lock:
+        keys = list(_groups)
+    for key in keys:
+        _flush_safely(key)
+
+
+def pending() -> int:
+    """
+    Gets the number of +REP waiting for a flush.
+
+    :return: number of deferred commands not flushed yet.
+    """
+    with _lock:
+        return sum(len(group['contexts']) for group in _groups.values())
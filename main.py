@@ -1,51 +1,96 @@
-import csv
-import io
-import json
+import asyncio
 import os
 import platform
+import random
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import closing
-from datetime import datetime
-from pprint import pprint
-from threading import Thread, Lock
+from threading import Lock, Thread, Timer, local
 
 import praw
 import prawcore
-import psycopg2
-import requests
 import schedule
 
+import action_queue
+import api_counter
+import command_journal
+import comment_dispatcher
+import config_manager
+import db_pool
+import discord_notifier
+import flair_functions
+import giveaway_burst
+import metrics
+import mod_roster
+import rate_limiter
+import rep_log_export
 import rep_manager
+import rep_reports
+import retention
+import stream_state
+import submission_cache
+import subreddits
+import warm_snapshot
+
+# Backoff after Reddit server errors, doubling from the base up to the cap
+BACKOFF_BASE_SECONDS = 5
+BACKOFF_CAP_SECONDS = 300
+# Attempts for a comment failing with a Reddit server error before it is left to the command journal
+COMMENT_ATTEMPTS = 3
+# Version of the tables created by create_tables. Bump it whenever the DDL changes so that it runs again at startup.
+SCHEMA_VERSION = 2
+# Threads running the independent steps of the startup
+STARTUP_WORKERS = 4
+
+# Seconds taken by each startup step, and from the start to the first processed comment
+startup_timings = {}
+_startup_lock = Lock()
+_started_at = time.monotonic()
+# Consecutive failures of the jobs, kept per thread so that the listener and the scheduled jobs back off separately
+_backoff = local()
+# Failed attempts of the comments waiting to be retried, by comment id
+_comment_attempts = {}
+_comment_attempts_lock = Lock()
+# Hands a retried comment back to the workers, the asyncio mode hands it to the event loop instead
+_resubmit = comment_dispatcher.submit
 
 
 def send_message_to_discord(msg, webhook):
     """
-    Sends the message to discord channel via webhook url.
-    :param webhook: URL of channel webhook where the message will be posted.
+    Queues the message for the discord channel. The message is posted by the notifier thread so that a slow Discord
+    never holds up the caller.
+    :param webhook: Name of the environment variable holding the channel webhook url.
     :param msg: message content.
     """
-    data = {"content": msg, "username": "Karma Bot"}
-    output = requests.post(os.getenv(webhook), data=json.dumps(data), headers={"Content-Type": "application/json"})
-    try:
-        output.raise_for_status()
-    except requests.HTTPError:
-        pprint(msg)
+    discord_notifier.notify(msg, webhook)
+
+
+def backoff_seconds(attempt) -> float:
+    """
+    Gets the time to wait before retrying after a Reddit server error. The wait doubles with every failed attempt up to
+    a cap, with full jitter so that restarts do not retry in lockstep.
+
+    :param attempt: Number of consecutive failed attempts, starting at 1.
+    :return: seconds to wait.
+    """
+    return random.uniform(0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)))
 
 
 def catch_exceptions(job_func):
     def wrapper_function(*args, **kwargs):
-        global failed_attempt
         try:
             job_func(*args, **kwargs)
-            failed_attempt = 1
+            _backoff.failed_attempt = 1
         except Exception as exp:
             send_message_to_discord(traceback.format_exc(), 'error_msg_channel')
-            # In case of server error pause for multiple of 5 minutes
+            # In case of server error pause with exponential backoff
             if isinstance(exp, (prawcore.exceptions.ServerError, prawcore.exceptions.RequestException)):
-                print(f"Waiting {(300 * failed_attempt) / 60} minutes...")
-                time.sleep(300 * failed_attempt)
-                failed_attempt += 1
+                failed_attempt = getattr(_backoff, 'failed_attempt', 1)
+                wait = backoff_seconds(failed_attempt)
+                print(f"Waiting {wait:.0f} seconds...")
+                time.sleep(wait)
+                _backoff.failed_attempt = failed_attempt + 1
 
             if job_func.__name__ == 'comment_listener':
                 raise StopIteration("Reinitialize comment generator")
@@ -56,67 +101,237 @@ def catch_exceptions(job_func):
 @catch_exceptions
 def delete_old_rep_transactions():
     """
-    Deletes the rep logs older than 6 months.
+    Deletes the rep logs older than the retention window and uploads the rep logs of the day. When several processes
+    run, each job is done by whichever process claims it first.
     """
-    seconds_in_six_months = 180 * 60 * 60 * 24
-    unix_time_now = time.time()
-    unix_time_six_months_ago = unix_time_now - seconds_in_six_months
-    mutex = Lock()
-    with mutex:
-        with closing(psycopg2.connect(os.getenv('DATABASE_URL'), sslmode='require')) as db_conn:
-            with closing(db_conn.cursor()) as cursor:
-                cursor.execute(f"DELETE FROM rep_transactions WHERE submission_created_utc <= '{int(unix_time_six_months_ago)}'")
-            db_conn.commit()
+    if subreddits.claim('command_journal_purge'):
+        command_journal.purge()
+    subreddit_names = [name for name in subreddits.SUBREDDITS if subreddits.claim(f'rep_logs:{name.lower()}')]
+    if not subreddit_names:
+        return
+    for subreddit_name in subreddit_names:
+        print(retention.purge_old_rep_transactions(subreddits.table(subreddit_name, 'rep_transactions')))
+        rep_reports.purge(subreddit_name, retention.retention_cutoff())
 
-    with mutex:
-        with closing(psycopg2.connect(os.getenv('DATABASE_URL'), sslmode='require')) as db_conn:
-            with closing(db_conn.cursor()) as cursor:
-                cursor.execute(f"SELECT * FROM rep_transactions WHERE comment_created_utc >= '{int(time.time() - 86400)}'")
-                results = cursor.fetchall()
-                with closing(io.StringIO()) as str_buffer:
-                    csv_writer = csv.writer(str_buffer)
-                    csv_writer.writerow(['comment_id',
-                                         'comment_created_utc',
-                                         'awarder,awarder_rep',
-                                         'awardee,awardee_rep',
-                                         'delta_awardee_rep',
-                                         'submission_id',
-                                         'submission_created_utc',
-                                         'permalink'])
-                    csv_writer.writerows(results)
-
-                    # Logging into Reddit
-                    reddit = praw.Reddit(client_id=os.getenv("client_id"),
-                                         client_secret=os.getenv("client_secret"),
-                                         username=os.getenv("reddit_username"),
-                                         password=os.getenv("reddit_password"),
-                                         user_agent=f"{platform.platform()}:MarketMM2Rep:1.0 (by u/is_fake_Account)")
-                    reddit.validate_on_submit = True
-                    profile_subreddit = reddit.subreddit(f"u_{os.getenv('reddit_username')}")
-                    submission = profile_subreddit.submit(title=f"Rep Logs {datetime.now().isoformat()}", selftext=str_buffer.getvalue())
-                    send_message_to_discord(f"Rep logs for the day https://www.reddit.com{submission.permalink}", 'rep_updates_channel')
-
-
-def db_manager_thread():
-    """
-    The second thread that runs the logger function to upload everyday rep transactions.
+    # Logging into Reddit
+    reddit = praw.Reddit(client_id=os.getenv("client_id"),
+                         client_secret=os.getenv("client_secret"),
+                         username=os.getenv("reddit_username"),
+                         password=os.getenv("reddit_password"),
+                         user_agent=f"{platform.platform()}:MarketMM2Rep:1.0 (by u/is_fake_Account)")
+    reddit.validate_on_submit = True
+    for subreddit_name in subreddit_names:
+        for permalink in rep_log_export.export_daily_rep_logs(reddit, subreddit_name):
+            send_message_to_discord(f"Rep logs for the day {permalink}", 'rep_updates_channel')
+
+
+@catch_exceptions
+def refresh_mod_roster(reddit):
+    """
+    Reloads the cached moderator list.
+    """
+    mod_roster.refresh(reddit)
+
+
+@catch_exceptions
+def check_modlog_for_roster_changes(reddit):
+    """
+    Reloads the cached moderator list when the modlog shows moderators being added or removed.
+    """
+    mod_roster.check_modlog(reddit)
+
+
+@catch_exceptions
+def reconcile_rep_flairs(reddit):
+    """
+    Repairs the rep flairs that no longer match the ledger.
+    """
+    for subreddit_name in subreddits.SUBREDDITS:
+        if subreddits.claim(f'flair_reconcile:{subreddit_name.lower()}'):
+            summary = flair_functions.reconcile_rep_flairs(reddit.subreddit(subreddit_name))
+            print(summary)
+            send_message_to_discord(summary, 'rep_updates_channel')
+
+
+@catch_exceptions
+def purge_rate_limiter():
+    """
+    Drops the expired cooldown windows from memory.
+    """
+    rate_limiter.purge()
+
+
+def schedule_jobs(reddit):
+    """
+    Registers the periodic jobs: uploading everyday rep transactions and keeping the cached moderator list up to date.
+
+    :param reddit: The reddit instance used by the jobs.
     """
     # Run schedule every week at midnight
     schedule.every().day.at("00:00").do(delete_old_rep_transactions)
+    schedule.every(mod_roster.MOD_ROSTER_REFRESH_MINUTES).minutes.do(refresh_mod_roster, reddit)
+    schedule.every(5).minutes.do(check_modlog_for_roster_changes, reddit)
+    schedule.every().day.at("03:00").do(reconcile_rep_flairs, reddit)
+    schedule.every().hour.do(purge_rate_limiter)
+    schedule.every().minute.do(save_warm_snapshot)
+
+
+def db_manager_thread(*args):
+    """
+    The second thread that runs the scheduled jobs.
+
+    :param args: Argument passed via Thread Module.
+    """
+    schedule_jobs(args[0])
+    # The asyncio mode saves the stream state from the event loop
+    schedule.every(10).seconds.do(save_stream_state)
     while run_threads:
         schedule.run_pending()
         time.sleep(1)
 
 
+def process_comment(comment, retry=True):
+    """
+    Runs the command in the comment. Called from the comment dispatcher worker threads, which must never sleep while
+    they hold the lock of the author, so a failed comment is retried later by retry_comment.
+
+    :param comment: comment that is going to be processed.
+    :param retry: False if a failed comment must not be handed back to the workers, e.g. before they are started.
+    """
+    metrics.observe('stream_lag_seconds', time.time() - comment.created_utc, buckets=metrics.LAG_BUCKETS)
+    try:
+        rep_manager.load_comment(comment)
+    except Exception as exp:
+        send_message_to_discord(traceback.format_exc(), 'error_msg_channel')
+        if retry:
+            retry_comment(comment, exp)
+        return
+    with _comment_attempts_lock:
+        _comment_attempts.pop(comment.id, None)
+    stream_state.mark_processed(comment)
+    if 'first_comment' not in startup_timings:
+        with _startup_lock:
+            if 'first_comment' not in startup_timings:
+                startup_timings['first_comment'] = time.monotonic() - _started_at
+                print(f"First comment processed {startup_timings['first_comment']:.2f} seconds after start up")
+
+
+def retry_comment(comment, exp):
+    """
+    Hands a comment that failed with a Reddit server error back to the workers once its backoff has passed. The wait
+    runs on a timer thread so the worker moves on to the next comment. A comment that keeps failing, or fails with any
+    other error, is left in the command journal and resumed at the next start up.
+
+    :param comment: comment whose processing failed.
+    :param exp: the exception it failed with.
+    """
+    with _comment_attempts_lock:
+        attempt = _comment_attempts.get(comment.id, 0) + 1
+        _comment_attempts[comment.id] = attempt
+    if isinstance(exp, (prawcore.exceptions.ServerError, prawcore.exceptions.RequestException)) \
+            and attempt < COMMENT_ATTEMPTS:
+        timer = Timer(backoff_seconds(attempt), _requeue_comment, (comment,))
+        timer.daemon = True
+        timer.start()
+        return
+    with _comment_attempts_lock:
+        _comment_attempts.pop(comment.id, None)
+    _leave_to_journal(comment)
+
+
+def _requeue_comment(comment):
+    """
+    Submits the comment again from the retry timer, or leaves it to the journal if the bot is stopping.
+
+    :param comment: comment whose processing failed.
+    """
+    try:
+        if run_threads:
+            _resubmit(comment)
+            return
+    except Exception:
+        send_message_to_discord(traceback.format_exc(), 'error_msg_channel')
+    with _comment_attempts_lock:
+        _comment_attempts.pop(comment.id, None)
+    _leave_to_journal(comment)
+
+
+def _leave_to_journal(comment):
+    """
+    Makes sure the command of a comment that could not be processed is in the journal, so it is resumed at the next
+    start up, and lets the stream resume point move past it. If the journal cannot be written either, the comment keeps
+    holding the resume point back and is read again from the stream after a restart.
+
+    :param comment: comment whose processing failed.
+    """
+    command = rep_manager.classify_comment(comment.body)
+    try:
+        if command is not None:
+            command_journal.receive(comment.id, command[0])
+    except Exception:
+        send_message_to_discord(traceback.format_exc(), 'error_msg_channel')
+        return
+    stream_state.mark_processed(comment)
+
+
+def resume_incomplete_commands(reddit):
+    """
+    Processes again the commands the journal shows as not finished, e.g. after a crash. Each command continues from the
+    state it reached so no side effect happens twice.
+
+    :param reddit: The reddit instance used to fetch the comments.
+    """
+    served = {name.lower() for name in subreddits.SUBREDDITS}
+    resumed = 0
+    for comment_id, command_name, state in command_journal.incomplete():
+        comment = reddit.comment(comment_id)
+        # The journal is shared by every process, each one resumes the commands of its own subreddits and shard
+        if comment.subreddit.display_name.lower() not in served or not subreddits.owns(comment):
+            continue
+        # The backfill must not pick the comment up a second time
+        stream_state.remember(comment_id)
+        # Giveaway bursts may already be flushing, they hold the same lock as the workers
+        with comment_dispatcher.user_lock(comment.author.name if comment.author else None):
+            process_comment(comment, retry=False)
+        resumed += 1
+    if resumed:
+        print(f"Resumed {resumed} incomplete commands")
+
+
+@catch_exceptions
+def save_stream_state():
+    """
+    Saves the point a restart resumes the stream from.
+    """
+    stream_state.save()
+
+
 @catch_exceptions
-def comment_listener(comment_stream):
-    # Gets a continuous stream of comments
-    for comment in comment_stream:
-        if comment is None:
+def save_warm_snapshot():
+    """
+    Saves the caches to the snapshot file so that a restart, also after a crash, starts warm.
+    """
+    warm_snapshot.save()
+
+
+@catch_exceptions
+def comment_listener(subreddit):
+    # Catch up on the comments missed since the last processed comment
+    missed = stream_state.backfill(subreddit, comment_dispatcher.submit)
+    if missed:
+        print(f"Backfilled {missed} comments")
+    # Gets a continuous stream of comments and hands them to the workers. The stream starts with comments that have
+    # already been seen, these are skipped.
+    reddit_reached = False
+    for comment in subreddit.stream.comments(pause_after=-1):
+        if not run_threads:
             break
-        mutex = Lock()
-        with mutex:
-            rep_manager.load_comment(comment)
+        # The listener only returns on shut down, so the backoff is reset once Reddit answers the stream
+        if not reddit_reached:
+            _backoff.failed_attempt = 1
+            reddit_reached = True
+        if comment is not None and subreddits.owns(comment) and stream_state.is_new(comment):
+            comment_dispatcher.submit(comment)
 
 
 def main_thread(*args):
@@ -125,47 +340,272 @@ def main_thread(*args):
 
     :param args: Argument passed via Thread Module.
     """
-    # Gets 100 historical comments
-    subreddit = args[0].subreddit("MarketMM2")
-    comment_stream = subreddit.stream.comments(pause_after=-1, skip_existing=True)
+    subreddit = subreddits.multireddit(args[0])
     while run_threads:
         try:
-            comment_listener(comment_stream)
+            comment_listener(subreddit)
         except StopIteration:
-            comment_stream = subreddit.stream.comments(pause_after=-1, skip_existing=True)
+            pass
 
 
-def main():
-    global run_threads
+def create_subreddit_tables(cursor, subreddit_name):
+    """
+    Creates the rep_transactions and user_rep tables of the subreddit and their indexes.
+
+    :param cursor: Database cursor.
+    :param subreddit_name: Display name of the subreddit.
+    """
+    # Index names are unique per schema so they get the table prefix too
+    prefix = subreddits.settings(subreddit_name)['table_prefix']
+    rep_transactions = subreddits.table(subreddit_name, 'rep_transactions')
+    cursor.execute(f"""CREATE TABLE IF NOT EXISTS {rep_transactions} (comment_id TEXT,
+                                                                  comment_created_utc BIGINT,
+                                                                  awarder TEXT,
+                                                                  awarder_rep INT,
+                                                                  awardee TEXT,
+                                                                  awardee_rep INT,
+                                                                  delta_awardee_rep INT,
+                                                                  submission_id TEXT,
+                                                                  submission_created_utc BIGINT,
+                                                                  permalink TEXT)
+                       {'PARTITION BY RANGE (submission_created_utc)' if retention.REP_PARTITIONED else ''}""")
+    if retention.is_partitioned(cursor, rep_transactions):
+        # Unique indexes of partitioned tables must include the partition key
+        cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {prefix}comment_ID_index "
+                       f"ON {rep_transactions} (comment_id, submission_created_utc)")
+        retention.ensure_partitions(cursor, rep_transactions)
+    else:
+        cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {prefix}comment_ID_index ON {rep_transactions} (comment_id)")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {prefix}submission_time_index "
+                   f"ON {rep_transactions} (submission_created_utc)")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {prefix}awarder_time_index "
+                   f"ON {rep_transactions} (awarder, comment_created_utc)")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {prefix}awarder_awardee_time_index "
+                   f"ON {rep_transactions} (awarder, awardee, comment_created_utc)")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {prefix}awardee_submission_index "
+                   f"ON {rep_transactions} (awardee, submission_id)")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {prefix}awardee_time_index "
+                   f"ON {rep_transactions} (awardee, comment_created_utc)")
+    user_rep = subreddits.table(subreddit_name, 'user_rep')
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {user_rep} "
+                   "(username TEXT PRIMARY KEY, rep INT NOT NULL, needs_flair BOOLEAN NOT NULL DEFAULT FALSE)")
+    # Added in schema version 2
+    cursor.execute(f"ALTER TABLE {user_rep} ADD COLUMN IF NOT EXISTS needs_flair BOOLEAN NOT NULL DEFAULT FALSE")
+    rep_reports.create_table(cursor, subreddit_name)
+
+
+def register_gauges():
+    """
+    Exposes the queue depths and the counters the components already keep on the metrics endpoint.
+    """
+    metrics.register_gauge('comment_queue_depth', lambda: comment_dispatcher.stats()['queue_depth'])
+    metrics.register_gauge('comment_worker_utilisation', lambda: comment_dispatcher.stats()['utilisation'])
+    metrics.register_gauge('action_queue_depth', action_queue.queue_depth)
+    metrics.register_gauge('discord_queue_depth', discord_notifier.queue_depth)
+    metrics.register_gauge('report_queue_depth', rep_reports.queue_depth)
+    metrics.register_gauge('giveaway_burst_pending', giveaway_burst.pending)
+    metrics.register_gauge('action_queue_events', lambda: action_queue.stats, 'event')
+    metrics.register_gauge('discord_notifier_events', lambda: discord_notifier.stats, 'event')
+    metrics.register_gauge('rep_report_events', lambda: rep_reports.stats, 'event')
+    metrics.register_gauge('giveaway_burst_events', lambda: giveaway_burst.stats, 'event')
+    metrics.register_gauge('config_cache_events', lambda: config_manager.stats, 'event')
+    metrics.register_gauge('rate_limiter_size', rate_limiter.stats, 'kind')
+    metrics.register_gauge('submission_cache', submission_cache.stats, 'kind')
+    metrics.register_gauge('startup_seconds', lambda: startup_timings, 'stage')
 
-    with closing(psycopg2.connect(os.getenv('DATABASE_URL'), sslmode='require')) as db_conn:
+
+def create_tables():
+    """
+    Creates the tables of every served subreddit and the tables shared by all of them.
+    """
+    with db_pool.get_connection() as db_conn:
         with closing(db_conn.cursor()) as cursor:
-            cursor.execute("""CREATE TABLE IF NOT EXISTS rep_transactions (comment_id TEXT,
-                                                                            comment_created_utc BIGINT,
-                                                                            awarder TEXT,
-                                                                            awarder_rep INT,
-                                                                            awardee TEXT,
-                                                                            awardee_rep INT,
-                                                                            delta_awardee_rep INT,
-                                                                            submission_id TEXT,
-                                                                            submission_created_utc BIGINT,
-                                                                            permalink TEXT)""")
-            cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS comment_ID_index ON rep_transactions (comment_id)")
-        db_conn.commit()
+            for subreddit_name in subreddits.SUBREDDITS:
+                create_subreddit_tables(cursor, subreddit_name)
+            cursor.execute("""CREATE TABLE IF NOT EXISTS command_journal (comment_id TEXT PRIMARY KEY,
+                                                                           command TEXT NOT NULL,
+                                                                           state TEXT NOT NULL,
+                                                                           received_utc BIGINT NOT NULL,
+                                                                           updated_utc BIGINT NOT NULL)""")
+            cursor.execute("CREATE TABLE IF NOT EXISTS bot_state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            cursor.execute("CREATE TABLE IF NOT EXISTS schema_version (scope TEXT PRIMARY KEY, "
+                           "version INT NOT NULL, applied_utc BIGINT NOT NULL)")
 
-    # Logging into Reddit
+
+def migrate() -> bool:
+    """
+    Runs create_tables only if the schema_version table shows that the shared tables or the tables of a served
+    subreddit were created by an older SCHEMA_VERSION, so a normal restart runs no DDL. The advisory lock keeps shards
+    that start together from running it at the same time.
+
+    :return: True if the tables were created or migrated.
+    """
+    scopes = ['shared'] + [subreddit_name.lower() for subreddit_name in subreddits.SUBREDDITS]
+    with db_pool.get_connection() as db_conn:
+        with closing(db_conn.cursor()) as cursor:
+            cursor.execute("SELECT to_regclass('schema_version')")
+            versions = {}
+            if cursor.fetchone()[0] is not None:
+                cursor.execute("SELECT scope, version FROM schema_version WHERE scope = ANY(%s)", (scopes,))
+                versions = dict(cursor.fetchall())
+    if all(versions.get(scope, 0) >= SCHEMA_VERSION for scope in scopes):
+        return False
+    with subreddits.advisory_lock('schema_migration', force=True):
+        create_tables()
+        with db_pool.get_connection() as db_conn:
+            with closing(db_conn.cursor()) as cursor:
+                cursor.executemany("INSERT INTO schema_version (scope, version, applied_utc) VALUES (%s, %s, %s) "
+                                   "ON CONFLICT (scope) DO UPDATE SET version = EXCLUDED.version, "
+                                   "applied_utc = EXCLUDED.applied_utc",
+                                   [(scope, SCHEMA_VERSION, int(time.time())) for scope in scopes])
+    print(f"Migrated the tables of {', '.join(scopes)} to schema version {SCHEMA_VERSION}")
+    return True
+
+
+def login():
+    """
+    Logs into Reddit and checks the credentials.
+
+    :return: the reddit instance.
+    """
     reddit = praw.Reddit(client_id=os.getenv("client_id"),
                          client_secret=os.getenv("client_secret"),
                          username=os.getenv("reddit_username"),
                          password=os.getenv("reddit_password"),
-                         user_agent=f"{platform.platform()}:MarketMM2Rep:1.0 (by u/is_fake_Account)")
+                         user_agent=f"{platform.platform()}:MarketMM2Rep:1.0 (by u/is_fake_Account)",
+                         requestor_class=api_counter.CountingRequestor)
     print(f"Account u/{reddit.user.me()} Logged In...")
     reddit.validate_on_submit = True
+    return reddit
+
+
+def timed_step(name, function, *args):
+    """
+    Runs a startup step and records how long it took in startup_timings.
+
+    :param name: Name of the step.
+    :param function: Function of the step.
+    :param args: Arguments of the function.
+    :return: what the function returns.
+    """
+    started = time.monotonic()
+    try:
+        return function(*args)
+    finally:
+        startup_timings[name] = time.monotonic() - started
+
+
+def start_up():
+    """
+    Prepares the database, the Reddit login and the caches. Steps that do not depend on each other run in parallel:
+    the schema check and the login go first, the caches missing from the warm snapshot are loaded as soon as what they
+    need is ready.
+
+    :return: the reddit instance.
+    """
+    with ThreadPoolExecutor(max_workers=STARTUP_WORKERS, thread_name_prefix="startup") as executor:
+        migrated = executor.submit(timed_step, 'schema', migrate)
+        logged_in = executor.submit(timed_step, 'login', login)
+        snapshot = timed_step('snapshot', warm_snapshot.read)
+        if snapshot is not None:
+            warm_snapshot.restore_caches(snapshot)
+        print("Restored the warm snapshot" if snapshot is not None else "No usable warm snapshot, starting cold")
+
+        migrated.result()
+        steps = [executor.submit(timed_step, 'stream_state', stream_state.load)]
+        if snapshot is None:
+            steps.append(executor.submit(timed_step, 'rate_limiter', rate_limiter.warm_up))
+        reddit = logged_in.result()
+        # The caches also fill on first use, a failed warm up only makes the first commands slower
+        warm_ups = []
+        restored_configs = snapshot['config'] if snapshot is not None else {}
+        restored_rosters = snapshot['mod_roster']['moderators'] if snapshot is not None else {}
+        for subreddit_name in subreddits.SUBREDDITS:
+            if subreddit_name.lower() not in restored_configs:
+                warm_ups.append(executor.submit(timed_step, f'config:{subreddit_name.lower()}',
+                                                config_manager.get_config, reddit, subreddit_name))
+            if subreddit_name.lower() not in restored_rosters:
+                warm_ups.append(executor.submit(timed_step, f'mod_roster:{subreddit_name.lower()}',
+                                                mod_roster.refresh, reddit, subreddit_name))
+        for step in steps:
+            step.result()
+        for warm_up in warm_ups:
+            if warm_up.exception() is not None:
+                print(f"Could not warm up a cache at start up: {warm_up.exception()!r}")
+    if snapshot is not None:
+        stream_state.restore(snapshot['stream_state'])
+    return reddit
+
+
+def stop_workers():
+    """
+    Lets the threads doing the work queued by the commands finish it, and waits for them to exit.
+    """
+    giveaway_burst.stop()
+    action_queue.stop()
+    rep_reports.stop()
+
+
+def main_async(reddit):
+    """
+    Runs the bot on an event loop instead of the main and db manager threads. Selected by setting BOT_MODE to asyncio.
+
+    :param reddit: The logged in reddit instance.
+    """
+    global run_threads, _resubmit
+    # Imported here so that the threaded mode runs without the asyncio dependencies
+    import async_main
+
+    _resubmit = async_main.submit_threadsafe
+    schedule_jobs(reddit)
+    print("Bot has now started in asyncio mode!", time.strftime('%I:%M %p %Z'))
+    try:
+        asyncio.run(async_main.run(reddit, process_comment,
+                                   lambda error: send_message_to_discord(error, 'error_msg_channel'),
+                                   backoff_seconds, stop_workers))
+    except KeyboardInterrupt:
+        pass
+    run_threads = False
+    warm_snapshot.save()
+    metrics.stop()
+    db_pool.close_pool()
+    print("Bot has stopped!", time.strftime('%I:%M %p %Z'))
+
+
+def main():
+    global run_threads
+
+    asyncio_mode = os.getenv('BOT_MODE', 'threads') == 'asyncio'
+    # The event loop posts the Discord messages itself in the asyncio mode
+    if not asyncio_mode:
+        discord_notifier.start()
+    register_gauges()
+    metrics.start()
+    config_manager.set_error_handler(lambda error: send_message_to_discord(error, 'error_msg_channel'))
+
+    reddit = start_up()
+
+    # Replies, flairs and locks are sent from their own thread
+    action_queue.start(reddit, lambda error: send_message_to_discord(error, 'error_msg_channel'))
+    # !REPLOGS reports are built on their own thread
+    rep_reports.start(lambda error: send_message_to_discord(error, 'error_msg_channel'))
+    # Bursts of +REP on giveaways are flushed from timer threads
+    giveaway_burst.start(rep_manager.process_giveaway_burst,
+                         lambda error: send_message_to_discord(error, 'error_msg_channel'))
+    resume_incomplete_commands(reddit)
+    startup_timings['ready'] = time.monotonic() - _started_at
+    print(f"Started up in {startup_timings['ready']:.2f} seconds: "
+          + ', '.join(f"{name} {seconds:.2f}s" for name, seconds in startup_timings.items() if name != 'ready'))
+    if asyncio_mode:
+        main_async(reddit)
+        return
+
     # Create threads
     main_thread_handler = Thread(target=main_thread, args=(reddit,))
-    db_manager_thread_handler = Thread(target=db_manager_thread)
+    db_manager_thread_handler = Thread(target=db_manager_thread, args=(reddit,))
     try:
         # run the threads
+        comment_dispatcher.start(process_comment)
         main_thread_handler.start()
         db_manager_thread_handler.start()
         print("Bot has now started!", time.strftime('%I:%M %p %Z'))
@@ -174,12 +614,18 @@ def main():
     except KeyboardInterrupt:
         run_threads = False
         main_thread_handler.join()
+        comment_dispatcher.stop()
+        stop_workers()
         db_manager_thread_handler.join()
+        stream_state.save()
+        warm_snapshot.save()
+        discord_notifier.stop()
+        metrics.stop()
+        db_pool.close_pool()
         print("Bot has stopped!", time.strftime('%I:%M %p %Z'))
         quit()
 
 
 if __name__ == '__main__':
     run_threads = True
-    failed_attempt = 1
     main()
@@ -0,0 +1,237 @@
+import os
+import sys
+import threading
+import time
+import traceback
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# The endpoint is only started when a port is set, and only listens locally unless told otherwise
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Upper bounds of the stream lag histogram buckets, in seconds
+LAG_BUCKETS = (1, 2, 5, 10, 30, 60, 120, 300, 600, 1800)
+# Seconds between stack samples of the profiler
+PROFILE_INTERVAL = 0.01
+# Longest profile that can be asked for, in seconds
+MAX_PROFILE_SECONDS = 120
+
+_lock = threading.Lock()
+# Counter values keyed by metric name and sorted label pairs
+_counters = {}
+# Histograms keyed by metric name and sorted label pairs, holding the bucket bounds, bucket counts, sum and count
+_histograms = {}
+# Functions read when the metrics are scraped, keyed by metric name with the name of the label of their dict values
+_gauges = {}
+_profile_lock = threading.Lock()
+_server = None
+
+
+def inc(name, value=1, **labels):
+    """
+    Adds to a counter.
+
+    :param name: Name of the metric.
+    :param value: Amount added.
+    :param labels: Labels of the series.
+    """
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    """
+    Adds a value to a histogram.
+
+    :param name: Name of the metric.
+    :param value: Observed value.
+    :param buckets: Upper bounds of the buckets, used when the series is first seen.
+    :param labels: Labels of the series.
+    """
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [buckets, [0] * len(buckets), 0.0, 0]
+        index = bisect_left(histogram[0], value)
+        if index < len(histogram[1]):
+            histogram[1][index] += 1
+        histogram[2] += value
+        histogram[3] += 1
+
+
+@contextmanager
+def timed(name, **labels):
+    """
+    Context manager that adds the time spent in the block to a latency histogram, also when the block raises.
+
+    :param name: Name of the metric.
+    :param labels: Labels of the series.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def register_gauge(name, function, label=None):
+    """
+    Registers a gauge whose value is read when the metrics are scraped.
+
+    :param name: Name of the metric.
+    :param function: Function returning a number, or a dictionary of numbers if label is set.
+    :param label: Name of the label holding the dictionary keys.
+    """
+    with _lock:
+        _gauges[name] = (function, label)
+
+
+def _format_labels(labels) -> str:
+    """
+    Formats the label pairs in the Prometheus text format.
+
+    :param labels: Sequence of label name and value pairs.
+    :return: the labels in braces, or an empty string if there are none.
+    """
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def render() -> str:
+    """
+    Renders every metric in the Prometheus text exposition format.
+
+    :return: text of the metrics.
+    """
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((key, (buckets, list(counts), total, count))
+                            for key, (buckets, counts, total, count) in _histograms.items())
+        gauges = sorted(_gauges.items())
+
+    typed = set()
+    for (name, labels), value in counters:
+        if name not in typed:
+            lines.append(f"# TYPE {name} counter")
+            typed.add(name)
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), (buckets, counts, total, count) in histograms:
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        cumulative = 0
+        for bound, bucket_count in zip(buckets, counts):
+            cumulative += bucket_count
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    for name, (function, label) in gauges:
+        try:
+            value = function()
+        except Exception:
+            print(f"Could not read gauge {name}\n{traceback.format_exc()}")
+            continue
+        lines.append(f"# TYPE {name} gauge")
+        if label is None:
+            lines.append(f"{name} {value}")
+        else:
+            lines.extend(f"{name}{_format_labels(((label, key),))} {item}" for key, item in sorted(value.items()))
+    return '\n'.join(lines) + '\n'
+
+
+def profile(seconds, interval=PROFILE_INTERVAL) -> str:
+    """
+    Samples the stacks of every other thread for a while. The result is in the collapsed stack format read by
+    flamegraph.pl and speedscope. Only one profile runs at a time.
+
+    :param seconds: How long to sample for, capped at MAX_PROFILE_SECONDS.
+    :param interval: Seconds between samples.
+    :return: one line per distinct stack with the number of samples it was seen in.
+    """
+    with _profile_lock:
+        samples = Counter()
+        this_thread = threading.get_ident()
+        thread_names = {}
+        deadline = time.monotonic() + min(seconds, MAX_PROFILE_SECONDS)
+        while time.monotonic() < deadline:
+            if len(thread_names) != threading.active_count():
+                thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == this_thread:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(thread_names.get(thread_id, str(thread_id)))
+                samples[';'.join(reversed(stack))] += 1
+            time.sleep(interval)
+    return ''.join(f"{stack} {count}\n" for stack, count in samples.most_common())
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    Serves /metrics for scraping and /profile?seconds=N for a flamegraph of the running bot.
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/metrics':
+            body = render()
+        elif url.path == '/profile':
+            body = profile(float(parse_qs(url.query).get('seconds', ['30'])[0]))
+        else:
+            self.send_error(404)
+            return
+        encoded = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format, *args):
+        # Scrapes are too frequent to print
+        pass
+
+
+def start(port=METRICS_PORT, host=METRICS_HOST):
+    """
+    Starts the metrics endpoint on its own thread. Nothing is started if the port is 0.
+
+    :param port: Port to listen on.
+    :param host: Address to listen on.
+    """
+    global _server
+    if not port:
+        return
+    _server = ThreadingHTTPServer((host, port), _Handler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Metrics served on http://{host}:{port}/metrics")
+
+
+def stop():
+    """
+    Stops the metrics endpoint.
+    """
+    global _server
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
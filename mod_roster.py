@@ -0,0 +1,103 @@
+import os
+from threading import Lock
+
+import subreddits
+
+# Modlog actions that change the moderator list
+ROSTER_ACTIONS = {'acceptmoderatorinvite', 'addmoderator', 'removemoderator'}
+# Minutes between full roster refreshes by the scheduler
+MOD_ROSTER_REFRESH_MINUTES = int(os.getenv('MOD_ROSTER_REFRESH_MINUTES', 60))
+
+_lock = Lock()
+# Moderator names in reddit order and as a lowercase set, by lowercase subreddit name
+_moderators = {}
+_moderator_names = {}
+_last_modlog_utc = 0
+
+
+def refresh(reddit, subreddit_name=None):
+    """
+    Downloads the moderator list and replaces the cached roster.
+
+    :param reddit: The reddit instance used to fetch the moderators.
+    :param subreddit_name: Display name of the subreddit whose roster is refreshed. Every served subreddit if None.
+    """
+    for name in [subreddit_name] if subreddit_name else subreddits.SUBREDDITS:
+        moderators = [moderator.name for moderator in reddit.subreddit(name).moderator()]
+        with _lock:
+            _moderators[name.lower()] = moderators
+            _moderator_names[name.lower()] = {moderator.lower() for moderator in moderators}
+
+
+def check_modlog(reddit):
+    """
+    Refreshes the roster of every served subreddit whose modlog has a moderator change since the last check.
+
+    :param reddit: The reddit instance used to read the modlog.
+    """
+    global _last_modlog_utc
+    newest_utc = _last_modlog_utc
+    changed_subreddits = set()
+    for log_entry in subreddits.multireddit(reddit).mod.log(limit=50):
+        if log_entry.created_utc <= _last_modlog_utc:
+            break
+        newest_utc = max(newest_utc, log_entry.created_utc)
+        if log_entry.action in ROSTER_ACTIONS:
+            changed_subreddits.add(str(log_entry.subreddit))
+    # First check only records the position in the modlog
+    if _last_modlog_utc:
+        for subreddit_name in changed_subreddits:
+            refresh(reddit, subreddit_name)
+    _last_modlog_utc = newest_utc
+
+
+def snapshot() -> dict:
+    """
+    Gets the rosters for the warm snapshot.
+
+    :return: dictionary with the moderator names by lowercase subreddit name and the time of the last modlog entry seen.
+    """
+    with _lock:
+        return {'moderators': dict(_moderators), 'last_modlog_utc': _last_modlog_utc}
+
+
+def restore(state):
+    """
+    Loads the rosters of the warm snapshot. The modlog position is restored too, so the first check refreshes the
+    subreddits whose moderators changed while the bot was down.
+
+    :param state: dictionary returned by snapshot.
+    """
+    global _last_modlog_utc
+    with _lock:
+        for name, moderators in state['moderators'].items():
+            _moderators.setdefault(name, moderators)
+            _moderator_names.setdefault(name, {moderator.lower() for moderator in moderators})
+        _last_modlog_utc = _last_modlog_utc or state['last_modlog_utc']
+
+
+def get_moderators(reddit, subreddit_name) -> list:
+    """
+    Gets the names of the moderators, loading the roster on first use.
+
+    :param reddit: The reddit instance used to fetch the moderators.
+    :param subreddit_name: Display name of the subreddit.
+    :return: list of moderator names in the order reddit returns them.
+    """
+    if subreddit_name.lower() not in _moderators:
+        refresh(reddit, subreddit_name)
+    return _moderators[subreddit_name.lower()]
+
+
+def is_moderator(reddit, subreddit_name, name) -> bool:
+    """
+    Checks if the username is in the cached moderator roster of the subreddit.
+
+    :param reddit: The reddit instance used to fetch the moderators.
+    :param subreddit_name: Display name of the subreddit.
+    :param name: Username of the redditor.
+    :return: True if the user is moderator otherwise False.
+    """
+    if subreddit_name.lower() not in _moderator_names:
+        refresh(reddit, subreddit_name)
+    return name.lower() in _moderator_names[subreddit_name.lower()]
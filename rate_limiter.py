@@ -0,0 +1,169 @@
+import itertools
+import sys
+import time
+from collections import deque
+from contextlib import closing
+from datetime import datetime
+from threading import Lock
+
+import db_pool
+import subreddits
+from CONSTANTS import StatusCodes
+
+# Longest cooldown that is kept in memory, in minutes. Pairs older than this are purged.
+MAX_COOLDOWN_MINUTES = 24 * 60
+# Entries measured by stats to estimate the memory of all of them
+STATS_SAMPLE_SIZE = 100
+
+_lock = Lock()
+# Timestamps of the awards given by each awarder since the last midnight, by lowercase subreddit name and awarder
+_awards_since_midnight = {}
+# Time of the last award given by the awarder to the awardee, by lowercase subreddit name, awarder and awardee
+_last_pair_award = {}
+_day_start = 0
+
+
+def previous_midnight(unix_time) -> float:
+    """
+    Gets the unix time of the local midnight before the given time.
+
+    :param unix_time: Unix time.
+    :return: unix time of the previous midnight.
+    """
+    return datetime.fromtimestamp(unix_time).replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+
+
+def _roll_day(now):
+    """
+    Forgets the daily counts once the day changes. Must be called with the lock held.
+
+    :param now: Current unix time.
+    """
+    global _day_start
+    day_start = previous_midnight(now)
+    if day_start != _day_start:
+        _day_start = day_start
+        for awarder in list(_awards_since_midnight):
+            awards = _awards_since_midnight[awarder]
+            while awards and awards[0] < day_start:
+                awards.popleft()
+            if not awards:
+                del _awards_since_midnight[awarder]
+
+
+def record(subreddit_name, awarder, awardee, created_utc):
+    """
+    Adds an award that has been stored in the database to the windows.
+
+    :param subreddit_name: Display name of the subreddit the rep was given in.
+    :param awarder: Name of the user giving the rep.
+    :param awardee: Name of the user receiving the rep.
+    :param created_utc: Unix time of the comment that gave the rep.
+    """
+    with _lock:
+        _roll_day(time.time())
+        if created_utc >= _day_start:
+            _awards_since_midnight.setdefault((subreddit_name.lower(), awarder), deque()).append(created_utc)
+        pair = (subreddit_name.lower(), awarder, awardee)
+        _last_pair_award[pair] = max(_last_pair_award.get(pair, 0), created_utc)
+
+
+def check(subreddit_name, awarder, awardee, rep_limit_per_day, rep_cooldown):
+    """
+    Checks the daily limit and the cooldown without going to the database.
+
+    :param subreddit_name: Display name of the subreddit the rep is given in.
+    :param awarder: Name of the user giving the rep.
+    :param awardee: Name of the user receiving the rep.
+    :param rep_limit_per_day: Number of rep a user can give in a day.
+    :param rep_cooldown: Minutes before a user can give rep to the same user again.
+    :return: StatusCodes of the failed check or CHECKS_PASSED.
+    """
+    now = time.time()
+    with _lock:
+        _roll_day(now)
+        if len(_awards_since_midnight.get((subreddit_name.lower(), awarder), ())) >= rep_limit_per_day:
+            return StatusCodes.REP_AWARDING_LIMIT_REACHED
+        if _last_pair_award.get((subreddit_name.lower(), awarder, awardee), 0) >= now - rep_cooldown * 60:
+            return StatusCodes.COOL_DOWN_TIMER
+    return StatusCodes.CHECKS_PASSED
+
+
+def purge():
+    """
+    Removes the pairs whose cooldown has expired so that the memory use stays bounded.
+    """
+    now = time.time()
+    oldest = now - MAX_COOLDOWN_MINUTES * 60
+    with _lock:
+        _roll_day(now)
+        for pair in [pair for pair, created_utc in _last_pair_award.items() if created_utc < oldest]:
+            del _last_pair_award[pair]
+
+
+def warm_up():
+    """
+    Loads the awards of the current windows from the rep_transactions of every served subreddit. Called once at
+    startup.
+    """
+    now = time.time()
+    with db_pool.get_connection() as db_conn:
+        with closing(db_conn.cursor()) as cursor:
+            for subreddit_name in subreddits.SUBREDDITS:
+                cursor.execute(f"SELECT awarder, awardee, comment_created_utc "
+                               f"FROM {subreddits.table(subreddit_name, 'rep_transactions')} "
+                               "WHERE comment_created_utc >= %s ORDER BY comment_created_utc",
+                               (min(previous_midnight(now), now - MAX_COOLDOWN_MINUTES * 60),))
+                for awarder, awardee, created_utc in cursor:
+                    record(subreddit_name, awarder, awardee, created_utc)
+
+
+def snapshot() -> dict:
+    """
+    Gets the windows for the warm snapshot.
+
+    :return: dictionary with the award times of every awarder and the last award of every pair.
+    """
+    with _lock:
+        return {'awards_since_midnight': [[*key, list(awards)] for key, awards in _awards_since_midnight.items()],
+                'last_pair_award': [[*pair, created_utc] for pair, created_utc in _last_pair_award.items()]}
+
+
+def restore(state):
+    """
+    Loads the windows of the warm snapshot instead of warm_up. Awards from before the current day are dropped by the
+    next check.
+
+    :param state: dictionary returned by snapshot.
+    """
+    with _lock:
+        for subreddit_name, awarder, awards in state['awards_since_midnight']:
+            _awards_since_midnight.setdefault((subreddit_name, awarder), deque()).extend(awards)
+        for subreddit_name, awarder, awardee, created_utc in state['last_pair_award']:
+            pair = (subreddit_name, awarder, awardee)
+            _last_pair_award[pair] = max(_last_pair_award.get(pair, 0), created_utc)
+
+
+def stats() -> dict:
+    """
+    Gets the size of the windows. Called on every metrics scrape, so only a sample of the entries is copied under the
+    lock and the memory of the rest is estimated from it outside the lock.
+
+    :return: dictionary with the number of tracked awarders and pairs and the approximate memory used in bytes.
+    """
+    with _lock:
+        awarders, pairs = len(_awards_since_midnight), len(_last_pair_award)
+        memory = sys.getsizeof(_awards_since_midnight) + sys.getsizeof(_last_pair_award)
+        awarder_sample = [(key, len(awards), sys.getsizeof(awards))
+                          for key, awards in itertools.islice(_awards_since_midnight.items(), STATS_SAMPLE_SIZE)]
+        pair_sample = list(itertools.islice(_last_pair_award, STATS_SAMPLE_SIZE))
+    if awarder_sample:
+        sampled = sum(sys.getsizeof(key) + sum(map(sys.getsizeof, key)) + deque_size + length * sys.getsizeof(0.0)
+                      for key, length, deque_size in awarder_sample)
+        memory += sampled * awarders // len(awarder_sample)
+    if pair_sample:
+        sampled = sum(sys.getsizeof(pair) + sum(map(sys.getsizeof, pair)) + sys.getsizeof(0.0) for pair in pair_sample)
+        memory += sampled * pairs // len(pair_sample)
+    return {'awarders': awarders,
+            'pairs': pairs,
+            'memory_bytes': memory}
@@ -0,0 +1,194 @@
+from contextlib import closing
+from threading import Lock
+
+import psycopg2.extras
+
+import command_journal
+import db_pool
+import rep_reports
+import subreddits
+
+_cache_lock = Lock()
+# Current rep total of every user seen since start up, by subreddit name and username
+_rep_cache = {}
+
+
+def parse_flair_rep(flair_text) -> int:
+    """
+    Reads the rep from the flair text. The rep is the last word of the flair, e.g. Trade Rep: 5.
+
+    :param flair_text: Flair text of the user, can be None.
+    :return: rep in the flair or 0 if the flair has no rep in it.
+    """
+    if not flair_text:
+        return 0
+    try:
+        return int(flair_text.split()[-1])
+    except (ValueError, IndexError):
+        return 0
+
+
+def is_rep_flair(flair_text) -> bool:
+    """
+    Checks if the flair shows a rep total, i.e. its last word is a number.
+
+    :param flair_text: Flair text of the user.
+    :return: True if the flair is a rep flair otherwise False.
+    """
+    try:
+        int(flair_text.split()[-1])
+        return True
+    except (ValueError, IndexError, AttributeError):
+        return False
+
+
+def _seed_from_flair(subreddit, username):
+    """
+    Gets the starting rep of a user who has no row in the ledger yet from their current flair.
+
+    :param subreddit: The subreddit where the rep flair lives.
+    :param username: Name of the redditor.
+    :return: tuple of the rep and whether user already had a flair.
+    """
+    for flair in subreddit.flair(redditor=username):
+        return parse_flair_rep(flair['flair_text']), bool(flair['flair_text'])
+    return 0, False
+
+
+def get_rep(subreddit, username):
+    """
+    Gets the rep of the user from the cache, the ledger table or, the first time user is seen, from their flair.
+
+    :param subreddit: The subreddit where the rep flair lives.
+    :param username: Name of the redditor.
+    :return: tuple of the rep and whether the user was just added to the ledger without having a flair.
+    """
+    cache_key = (subreddit.display_name.lower(), username)
+    with _cache_lock:
+        if cache_key in _rep_cache:
+            return _rep_cache[cache_key], False
+
+    user_rep = subreddits.table(subreddit.display_name, 'user_rep')
+    with db_pool.get_connection() as db_conn:
+        with closing(db_conn.cursor()) as cursor:
+            cursor.execute(f"SELECT rep FROM {user_rep} WHERE username=%s", (username,))
+            row = cursor.fetchone()
+
+    needs_flair = False
+    if row is None:
+        rep, has_flair = _seed_from_flair(subreddit, username)
+        needs_flair = not has_flair
+        with db_pool.get_connection() as db_conn:
+            with closing(db_conn.cursor()) as cursor:
+                # needs_flair lets the flair reconciliation add the flair if setting it after the award fails
+                cursor.execute(f"INSERT INTO {user_rep} (username, rep, needs_flair) VALUES (%s, %s, %s) "
+                               "ON CONFLICT (username) DO NOTHING", (username, rep, needs_flair))
+                cursor.execute(f"SELECT rep FROM {user_rep} WHERE username=%s", (username,))
+                row = cursor.fetchone()
+
+    with _cache_lock:
+        _rep_cache[cache_key] = row[0]
+    return row[0], needs_flair
+
+
+def record_transaction(comment, awarder, awardee, delta, submission):
+    """
+    Inserts the rep transaction, updates the awardee total and marks the command as recorded in the journal, all in
+    one database transaction. A comment that has already been recorded changes nothing.
+
+    :param comment: The comment that triggered the command.
+    :param awarder: Name of the user giving the rep.
+    :param awardee: Name of the user receiving the rep.
+    :param delta: Change in the awardee rep.
+    :param submission: The submission the comment was made on.
+    :return: the new rep of the awardee or None if the transaction was already recorded.
+    """
+    subreddit = submission.subreddit
+    awarder_rep, _ = get_rep(subreddit, awarder)
+    get_rep(subreddit, awardee)
+    awardee_rep = None
+    user_rep = subreddits.table(subreddit.display_name, 'user_rep')
+    rep_transactions = subreddits.table(subreddit.display_name, 'rep_transactions')
+    with db_pool.get_connection() as db_conn:
+        with closing(db_conn.cursor()) as cursor:
+            cursor.execute(f"SELECT rep FROM {user_rep} WHERE username=%s FOR UPDATE", (awardee,))
+            previous_awardee_rep = cursor.fetchone()[0]
+            cursor.execute(f"INSERT INTO {rep_transactions} VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s) "
+                           "ON CONFLICT DO NOTHING",
+                           (comment.id,
+                            comment.created_utc,
+                            awarder,
+                            awarder_rep,
+                            awardee,
+                            previous_awardee_rep,
+                            delta,
+                            submission.id,
+                            submission.created_utc,
+                            comment.permalink)
+                           )
+            if cursor.rowcount:
+                cursor.execute(f"UPDATE {user_rep} SET rep = rep + %s WHERE username=%s RETURNING rep",
+                               (delta, awardee))
+                awardee_rep = cursor.fetchone()[0]
+                rep_reports.record(cursor, subreddit.display_name, awarder, awardee, delta, comment.created_utc)
+            command_journal.advance(comment.id, command_journal.RECORDED, cursor)
+
+    if awardee_rep is not None:
+        with _cache_lock:
+            _rep_cache[(subreddit.display_name.lower(), awardee)] = awardee_rep
+    return awardee_rep
+
+
+def record_transactions(submission, awarder, awards, delta=1) -> dict:
+    """
+    Records several rep transactions of the same awarder on the submission in one database transaction, with one
+    multi row insert for the transactions and one update for the totals. Comments that have already been recorded
+    change nothing.
+
+    :param submission: The submission the comments were made on.
+    :param awarder: Name of the user giving the rep.
+    :param awards: list of tuples of the comment that gave the rep and the name of the awardee.
+    :param delta: Change in the rep of each awardee.
+    :return: dictionary of the new rep of the awardees whose transactions were inserted.
+    """
+    subreddit = submission.subreddit
+    awarder_rep, _ = get_rep(subreddit, awarder)
+    for _, awardee in awards:
+        get_rep(subreddit, awardee)
+    awardee_reps = {}
+    user_rep = subreddits.table(subreddit.display_name, 'user_rep')
+    rep_transactions = subreddits.table(subreddit.display_name, 'rep_transactions')
+    with db_pool.get_connection() as db_conn:
+        with closing(db_conn.cursor()) as cursor:
+            cursor.execute(f"SELECT username, rep FROM {user_rep} WHERE username = ANY(%s) ORDER BY username "
+                           "FOR UPDATE", (sorted({awardee for _, awardee in awards}),))
+            running_reps = dict(cursor.fetchall())
+            cursor.execute(f"SELECT comment_id FROM {rep_transactions} WHERE comment_id = ANY(%s)",
+                           ([comment.id for comment, _ in awards],))
+            recorded = {row[0] for row in cursor.fetchall()}
+            rows = []
+            deltas = {}
+            for comment, awardee in awards:
+                if comment.id in recorded:
+                    continue
+                recorded.add(comment.id)
+                rows.append((comment.id, comment.created_utc, awarder, awarder_rep, awardee, running_reps[awardee],
+                             delta, submission.id, submission.created_utc, comment.permalink))
+                running_reps[awardee] += delta
+                deltas[awardee] = deltas.get(awardee, 0) + delta
+            if rows:
+                psycopg2.extras.execute_values(cursor, f"INSERT INTO {rep_transactions} VALUES %s", rows)
+                awardee_reps = dict(psycopg2.extras.execute_values(
+                    cursor,
+                    f"UPDATE {user_rep} AS user_rep SET rep = user_rep.rep + awarded.delta "
+                    "FROM (VALUES %s) AS awarded (username, delta) WHERE user_rep.username = awarded.username "
+                    "RETURNING user_rep.username, user_rep.rep",
+                    list(deltas.items()), fetch=True))
+                rep_reports.record_many(cursor, subreddit.display_name,
+                                        [(awarder, row[4], delta, row[1]) for row in rows])
+            command_journal.advance_many([comment.id for comment, _ in awards], command_journal.RECORDED, cursor)
+
+    with _cache_lock:
+        for awardee, rep in awardee_reps.items():
+            _rep_cache[(subreddit.display_name.lower(), awardee)] = rep
+    return awardee_reps
@@ -0,0 +1,85 @@
+import csv
+import io
+import os
+import time
+from datetime import datetime
+
+import db_pool
+import subreddits
+
+# Reddit rejects selftext longer than 40000 characters
+SELFTEXT_LIMIT = 40000
+# Rows fetched from the server side cursor per round trip
+EXPORT_FETCH_SIZE = 2000
+CSV_HEADER = ['comment_id',
+              'comment_created_utc',
+              'awarder',
+              'awarder_rep',
+              'awardee',
+              'awardee_rep',
+              'delta_awardee_rep',
+              'submission_id',
+              'submission_created_utc',
+              'permalink']
+
+
+def _csv_line(row) -> str:
+    """
+    Formats a single row as a csv line.
+
+    :param row: Sequence of column values.
+    :return: csv line ending with a new line.
+    """
+    with io.StringIO() as str_buffer:
+        csv.writer(str_buffer).writerow(row)
+        return str_buffer.getvalue()
+
+
+def iter_csv_chunks(rows, limit=SELFTEXT_LIMIT):
+    """
+    Groups the rows into csv documents that each fit in the limit. Every document starts with the header and there is
+    always at least one document, even if there are no rows.
+
+    :param rows: Iterable of rep transaction rows.
+    :param limit: Maximum number of characters in a document.
+    :return: generator of csv documents.
+    """
+    header = _csv_line(CSV_HEADER)
+    lines = [header]
+    length = len(header)
+    for row in rows:
+        line = _csv_line(row)
+        if length + len(line) > limit and len(lines) > 1:
+            yield ''.join(lines)
+            lines = [header]
+            length = len(header)
+        lines.append(line)
+        length += len(line)
+    yield ''.join(lines)
+
+
+def export_daily_rep_logs(reddit, subreddit_name) -> list:
+    """
+    Streams the rep transactions of the last day from a server side cursor and posts them on the bot profile, split
+    into as many posts as needed to stay under the selftext limit. Only one post worth of rows is held in memory.
+
+    :param reddit: The reddit instance used to submit the posts.
+    :param subreddit_name: Display name of the subreddit whose rep transactions are exported.
+    :return: list of permalinks of the posts.
+    """
+    profile_subreddit = reddit.subreddit(f"u_{os.getenv('reddit_username')}")
+    title = f"Rep Logs {datetime.now().isoformat()}"
+    if subreddits.SUBREDDITS != ['MarketMM2']:
+        title = f"r/{subreddit_name} {title}"
+    permalinks = []
+    with db_pool.get_connection() as db_conn:
+        with db_conn.cursor(name='rep_logs_export') as cursor:
+            cursor.itersize = EXPORT_FETCH_SIZE
+            cursor.execute(f"SELECT * FROM {subreddits.table(subreddit_name, 'rep_transactions')} "
+                           "WHERE comment_created_utc >= %s ORDER BY comment_created_utc",
+                           (int(time.time() - 86400),))
+            for part, selftext in enumerate(iter_csv_chunks(cursor), start=1):
+                part_title = title if part == 1 else f"{title} (part {part})"
+                submission = profile_subreddit.submit(title=part_title, selftext=selftext)
+                permalinks.append(f"https://www.reddit.com{submission.permalink}")
+    return permalinks
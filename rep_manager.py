@@ -1,29 +1,63 @@
 import os
-import re
 import time
 from contextlib import closing
 
-import psycopg2
-import yaml
-
 import CONSTANTS
+import api_counter
 import bot_responses
+import command_journal
+import config_manager
+import db_pool
 import flair_functions
+import giveaway_burst
+import metrics
+import mod_roster
+import rate_limiter
+import rep_ledger
+import rep_reports
+import subreddits
 from CONSTANTS import StatusCodes
-
-
-def is_mod(redditor) -> bool:
+from comment_context import CommentContext
+
+# Counts needed for the rep limits in one round trip. Each sub query is served by one of the composite indexes.
+# The table of the subreddit is filled in with str.format.
+REP_ELIGIBILITY_QUERY = """
+SELECT (SELECT COUNT(*) FROM {rep_transactions}
+        WHERE awarder=%(awarder)s AND comment_created_utc>=%(day_start)s),
+       (SELECT COUNT(*) FROM {rep_transactions}
+        WHERE awarder=%(awarder)s AND awardee=%(awardee)s AND comment_created_utc>=%(cooldown_start)s),
+       (SELECT COUNT(*) FROM {rep_transactions}
+        WHERE awardee=%(awardee)s AND submission_id=%(submission_id)s)
+"""
+# Counts needed for the limits of a group of +REP of the same awarder on a giveaway in one round trip. The first row
+# holds the awards of the awarder since midnight, the others the cooldown and giveaway counts of each awardee.
+GROUP_ELIGIBILITY_QUERY = """
+SELECT NULL, COUNT(*), 0 FROM {rep_transactions}
+WHERE awarder=%(awarder)s AND comment_created_utc>=%(day_start)s
+UNION ALL
+SELECT awardee,
+       COUNT(*) FILTER (WHERE awarder=%(awarder)s AND comment_created_utc>=%(cooldown_start)s),
+       COUNT(*) FILTER (WHERE submission_id=%(submission_id)s)
+FROM {rep_transactions}
+WHERE awardee = ANY(%(awardees)s)
+  AND (submission_id=%(submission_id)s OR (awarder=%(awarder)s AND comment_created_utc>=%(cooldown_start)s))
+GROUP BY awardee
+"""
+# Latency histogram of each stage of checks_for_rep_command
+CHECK_STAGE_METRIC = 'rep_check_stage_seconds'
+
+
+def is_mod(redditor, subreddit_name) -> bool:
     """
-    Checks if the author is moderator or not.
+    Checks if the author is moderator of the subreddit or not.
 
     :param redditor: The reddit account instance.
+    :param subreddit_name: Display name of the subreddit.
     :return: True if author is moderator otherwise False.
     """
-    moderators_list = redditor._reddit.subreddit("MarketMM2").moderator()
-    if redditor in moderators_list:
-        return True
-    else:
+    if redditor is None:
         return False
+    return mod_roster.is_moderator(redditor._reddit, subreddit_name, redditor.name)
 
 
 def is_removed_or_deleted(content) -> bool:
@@ -36,124 +70,321 @@ def is_removed_or_deleted(content) -> bool:
     return content.author is None or content.mod_note or content.removed
 
 
-def get_limits_from_config(limit_type, comment):
-    config = comment._reddit.subreddit("MarketMM2").wiki['marketmm2botsconfig/rep_bot_config'].content_md
-    for config in yaml.safe_load_all(config):
-        if config['type'] == 'limits':
-            return config[limit_type]
-    raise KeyError(f"{limit_type} Config not found")
+def get_limits_from_config(limit_type, context):
+    limits = config_manager.get_config_document(context.reddit, context.subreddit_name, 'limits')
+    if limits is None or limit_type not in limits:
+        raise KeyError(f"{limit_type} Config not found")
+    return limits[limit_type]
 
 
-def close_command(comment):
+def close_command(context):
     """
     Performs checks if the submission can be closed.
 
-    :param comment: The comment object praw.
+    :param context: CommentContext of the comment that triggered the command.
     """
     # Only OP can close the trade
-    if comment.author == comment.submission.author or is_mod(comment.submission.author):
+    if context.author == context.submission.author or is_mod(context.submission.author, context.subreddit_name):
         # You can close trading posts only
-        if re.match(r"Trade\sOffer|Giveaway\sEntry", comment.submission.link_flair_text):
-            flair_functions.mark_submission_as_closed(comment.submission)
-            bot_responses.close_submission_comment(comment)
+        if context.is_trading_post:
+            flair_functions.mark_submission_as_closed(context.submission)
+            bot_responses.close_submission_comment(context)
         else:
             # If post isn't trading post
-            bot_responses.close_submission_failed(comment, True)
+            bot_responses.close_submission_failed(context, True)
     else:
         # If the close submission is requested by someone other than op and mod
-        bot_responses.close_submission_failed(comment, False)
+        bot_responses.close_submission_failed(context, False)
 
 
-def increase_rep(comment):
-    flair_functions.increment_rep(comment)
-    with closing(psycopg2.connect(os.getenv('DATABASE_URL'), sslmode='require')) as db_conn:
-        with closing(db_conn.cursor()) as cursor:
-            marketmm2 = comment._reddit.subreddit("MarketMM2")
-            # If the user has no flair, assigns them flair. However since the flair takes time to apply
-            # .author_flair_text.split() will still throw an exception, hence it is manually set to zero
-            if not comment.author_flair_css_class:
-                marketmm2.flair.set(comment.author.name, text='Trade Rep: 0', flair_template_id=CONSTANTS.REP_FLAIR_ID)
-                awarder_rep = 0
-            else:
-                awarder_rep = comment.author_flair_text.split()[-1]
-
-            if not comment.parent().author_flair_css_class:
-                marketmm2.flair.set(comment.parent().author.name, text='Trade Rep: 0',
-                                    flair_template_id=CONSTANTS.REP_FLAIR_ID)
-                awardee_rep = 0
-            else:
-                awardee_rep = comment.parent().author_flair_text.split()[-1]
-
-            comment.refresh()
-            cursor.execute("INSERT INTO rep_transactions VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
-                           (comment.id,
-                            comment.created_utc,
-                            comment.author.name,
-                            awarder_rep,
-                            comment.parent().author.name,
-                            awardee_rep,
-                            1,
-                            comment.submission.id,
-                            comment.submission.created_utc,
-                            comment.permalink)
-                           )
-        db_conn.commit()
-        bot_responses.rep_rewarded_comment(comment)
-
-
-def checks_for_rep_command(comment):
-    if not re.match(r"Trade\sOffer|Giveaway\sEntry", comment.submission.link_flair_text):
-        bot_responses.incorrect_submission_type_comment(comment)
+def record_rep_transaction(context, delta):
+    """
+    Records the rep change in the ledger and projects the new totals onto the user flairs.
+
+    :param context: CommentContext of the comment that triggered the command. Author of the parent is the awardee.
+    :param delta: Change in the awardee rep.
+    """
+    awarder = context.author_name
+    awardee = context.parent_author_name
+    subreddit = context.subreddit
+    awarder_rep, awarder_needs_flair = rep_ledger.get_rep(subreddit, awarder)
+    awardee_rep = rep_ledger.record_transaction(context.comment, awarder, awardee, delta, context.submission)
+    if awardee_rep is None:
+        # Already recorded by an earlier attempt, the flair is projected again from the ledger
+        awardee_rep, _ = rep_ledger.get_rep(subreddit, awardee)
+    else:
+        rate_limiter.record(context.subreddit_name, awarder, awardee, context.comment.created_utc)
+    # Users who never had a flair get one so that their rep is visible
+    if awarder_needs_flair:
+        flair_functions.set_rep_flair(subreddit, awarder, awarder_rep)
+    project_awardee_flair(context, awardee_rep)
+
+
+def project_awardee_flair(context, awardee_rep):
+    """
+    Queues the awardee flair update and moves the command to flaired in the journal once it has been set. The prefix
+    and template of the flair the awardee shows on the parent are kept.
+
+    :param context: CommentContext of the comment that triggered the command.
+    :param awardee_rep: The rep total of the awardee.
+    """
+    comment_id = context.comment.id
+    flair_functions.set_rep_flair(context.subreddit, context.parent_author_name, awardee_rep,
+                                  context.parent.author_flair_text, context.parent.author_flair_template_id,
+                                  on_done=lambda: command_journal.advance(comment_id, command_journal.FLAIRED))
+
+
+def increase_rep(context):
+    record_rep_transaction(context, 1)
+    bot_responses.rep_rewarded_comment(context)
+
+
+def checks_for_rep_command(context):
+    # Fetches the parent and the submission the first time
+    with metrics.timed(CHECK_STAGE_METRIC, stage='submission_type'):
+        is_trading_post = context.is_trading_post
+    if not is_trading_post:
+        bot_responses.incorrect_submission_type_comment(context)
         return StatusCodes.INCORRECT_SUBMISSION_TYPE
 
     # Make sure author isn't rewarding themselves
-    if comment.author == comment.parent().author:
-        bot_responses.cannot_reward_yourself_comment(comment)
+    with metrics.timed(CHECK_STAGE_METRIC, stage='self_reward'):
+        rewarding_self = context.author == context.parent_author
+    if rewarding_self:
+        bot_responses.cannot_reward_yourself_comment(context)
         return StatusCodes.CANNOT_REWARD_YOURSELF
 
     # If comment itself or the submission has been removed/deleted
-    removed_or_deleted = [comment, comment.parent(), comment.submission]
-    if any(map(is_removed_or_deleted, removed_or_deleted)):
-        bot_responses.deleted_or_removed_comment(comment)
+    with metrics.timed(CHECK_STAGE_METRIC, stage='removed_or_deleted'):
+        removed_or_deleted = any(map(is_removed_or_deleted, [context.comment, context.parent, context.submission]))
+    if removed_or_deleted:
+        bot_responses.deleted_or_removed_comment(context)
         return StatusCodes.DELETED_OR_REMOVED
 
-    with closing(psycopg2.connect(os.getenv('DATABASE_URL'), sslmode='require')) as db_conn:
-        with closing(db_conn.cursor()) as cursor:
-            # Checking if user has not cross the general rep limit for the day
-            seconds_from_previous_midnight = time.localtime().tm_hour * 3600 + time.localtime().tm_min * 60 + time.localtime().tm_sec
-            unix_time_at_previous_midnight = time.time() - seconds_from_previous_midnight
-            cursor.execute("SELECT COUNT(*) FROM rep_transactions WHERE awarder=%s AND comment_created_utc>=%s",
-                           (comment.author.name, unix_time_at_previous_midnight))
-            count = cursor.fetchone()[0]
-            if count >= get_limits_from_config('rep_limit_per_day', comment):
-                bot_responses.reward_limit_reached_comment(comment)
-                return StatusCodes.REP_AWARDING_LIMIT_REACHED
-
-            # checking if user is trying to give rep to same user before rep cooldown expires
-            unix_time_30_min_ago = time.time() - get_limits_from_config('rep_cooldown', comment) * 60
-            cursor.execute("SELECT COUNT(*) FROM rep_transactions WHERE awarder=%s AND awardee=%s AND comment_created_utc>=%s",
-                           (comment.author.name, comment.parent().author.name, unix_time_30_min_ago))
-            count = cursor.fetchone()[0]
-            if count >= 1:
-                bot_responses.cooldown_timer_reached_comment(comment)
-                return StatusCodes.COOL_DOWN_TIMER
-
-            if 'giveaway' in comment.submission.link_flair_text.lower():
-                # Checking how many rep has been awarded to the parent comment author on this giveaway submission.
-                cursor.execute("SELECT COUNT(*) FROM rep_transactions WHERE awardee=%s AND submission_id=%s",
-                               (comment.parent().author.name, comment.submission.id))
-                count = cursor.fetchone()[0]
-                # If limit is exceeded the rep is not rewarded.
-                if count >= get_limits_from_config('giveaway_rep_limit_per_post', comment):
-                    bot_responses.giveway_limit_reached(comment)
-                    return StatusCodes.GIVEAWAY_LIMIT
+    awarder = context.author_name
+    awardee = context.parent_author_name
+    with metrics.timed(CHECK_STAGE_METRIC, stage='config'):
+        rep_limit_per_day = get_limits_from_config('rep_limit_per_day', context)
+        rep_cooldown = get_limits_from_config('rep_cooldown', context)
+
+    # Rejects are answered from the in memory windows, the database is only asked to confirm accepted awards
+    with metrics.timed(CHECK_STAGE_METRIC, stage='rate_limiter'):
+        status = rate_limiter.check(context.subreddit_name, awarder, awardee, rep_limit_per_day, rep_cooldown)
+    if status == StatusCodes.CHECKS_PASSED:
+        now = time.time()
+        with metrics.timed(CHECK_STAGE_METRIC, stage='eligibility_query'), db_pool.get_connection() as db_conn:
+            with closing(db_conn.cursor()) as cursor:
+                rep_transactions = subreddits.table(context.subreddit_name, 'rep_transactions')
+                cursor.execute(REP_ELIGIBILITY_QUERY.format(rep_transactions=rep_transactions),
+                               {'awarder': awarder,
+                                'awardee': awardee,
+                                'submission_id': context.submission.id,
+                                'day_start': rate_limiter.previous_midnight(now),
+                                'cooldown_start': now - rep_cooldown * 60})
+                awarded_today, awarded_in_cooldown, received_on_submission = cursor.fetchone()
+        # Checking if user has not cross the general rep limit for the day
+        if awarded_today >= rep_limit_per_day:
+            status = StatusCodes.REP_AWARDING_LIMIT_REACHED
+        # checking if user is trying to give rep to same user before rep cooldown expires
+        elif awarded_in_cooldown >= 1:
+            status = StatusCodes.COOL_DOWN_TIMER
+
+    if status == StatusCodes.REP_AWARDING_LIMIT_REACHED:
+        bot_responses.reward_limit_reached_comment(context)
+        return status
+    if status == StatusCodes.COOL_DOWN_TIMER:
+        bot_responses.cooldown_timer_reached_comment(context)
+        return status
+
+    # Checking how many rep has been awarded to the parent comment author on this giveaway submission.
+    if 'giveaway' in context.submission_flair.lower():
+        with metrics.timed(CHECK_STAGE_METRIC, stage='giveaway_limit'):
+            giveaway_limit = get_limits_from_config('giveaway_rep_limit_per_post', context)
+        # If limit is exceeded the rep is not rewarded.
+        if received_on_submission >= giveaway_limit:
+            bot_responses.giveway_limit_reached(context)
+            return StatusCodes.GIVEAWAY_LIMIT
 
     return StatusCodes.CHECKS_PASSED
 
 
-def process_rep_command(comment):
-    if checks_for_rep_command(comment) == StatusCodes.CHECKS_PASSED:
-        increase_rep(comment)
+def process_rep_command(context):
+    # Shards process different submissions, so the same awarder can be checked by two processes at once
+    with subreddits.advisory_lock(f'rep:{context.subreddit_name.lower()}:{context.author_name}'):
+        status = checks_for_rep_command(context)
+        metrics.inc('rep_check_outcomes_total', status=status.name)
+        if status == StatusCodes.CHECKS_PASSED:
+            command_journal.advance(context.comment.id, command_journal.VALIDATED)
+            increase_rep(context)
+
+
+def checks_for_rep_group(contexts):
+    """
+    Runs the rep checks of a group of +REP of the same awarder on the same giveaway with one eligibility query. The
+    counts are updated while the group is walked so that the +REP of the group count against each other in comment
+    order.
+
+    :param contexts: CommentContexts of the group, in comment order.
+    :return: list of the StatusCodes of the contexts.
+    """
+    submission = contexts[0].submission
+    statuses = []
+    for context in contexts:
+        if context.author == context.parent_author:
+            statuses.append(StatusCodes.CANNOT_REWARD_YOURSELF)
+        elif any(map(is_removed_or_deleted, [context.comment, context.parent, submission])):
+            statuses.append(StatusCodes.DELETED_OR_REMOVED)
+        else:
+            statuses.append(StatusCodes.CHECKS_PASSED)
+    awardees = {context.parent_author_name for context, status in zip(contexts, statuses)
+                if status == StatusCodes.CHECKS_PASSED}
+    if not awardees:
+        return statuses
+
+    rep_limit_per_day = get_limits_from_config('rep_limit_per_day', contexts[0])
+    rep_cooldown = get_limits_from_config('rep_cooldown', contexts[0])
+    giveaway_limit = get_limits_from_config('giveaway_rep_limit_per_post', contexts[0])
+    now = time.time()
+    with metrics.timed(CHECK_STAGE_METRIC, stage='group_eligibility_query'), db_pool.get_connection() as db_conn:
+        with closing(db_conn.cursor()) as cursor:
+            rep_transactions = subreddits.table(contexts[0].subreddit_name, 'rep_transactions')
+            cursor.execute(GROUP_ELIGIBILITY_QUERY.format(rep_transactions=rep_transactions),
+                           {'awarder': contexts[0].author_name,
+                            'awardees': sorted(awardees),
+                            'submission_id': submission.id,
+                            'day_start': rate_limiter.previous_midnight(now),
+                            'cooldown_start': now - rep_cooldown * 60})
+            rows = cursor.fetchall()
+    awarded_today = next(count for awardee, count, _ in rows if awardee is None)
+    awarded_in_cooldown = {awardee: count for awardee, count, _ in rows if awardee is not None}
+    received_on_submission = {awardee: count for awardee, _, count in rows if awardee is not None}
+
+    for index, context in enumerate(contexts):
+        if statuses[index] != StatusCodes.CHECKS_PASSED:
+            continue
+        awardee = context.parent_author_name
+        if awarded_today >= rep_limit_per_day:
+            statuses[index] = StatusCodes.REP_AWARDING_LIMIT_REACHED
+        elif awarded_in_cooldown.get(awardee, 0) >= 1:
+            statuses[index] = StatusCodes.COOL_DOWN_TIMER
+        elif received_on_submission.get(awardee, 0) >= giveaway_limit:
+            statuses[index] = StatusCodes.GIVEAWAY_LIMIT
+        else:
+            awarded_today += 1
+            awarded_in_cooldown[awardee] = awarded_in_cooldown.get(awardee, 0) + 1
+            received_on_submission[awardee] = received_on_submission.get(awardee, 0) + 1
+    return statuses
+
+
+def process_giveaway_burst(contexts):
+    """
+    Checks, records and answers a group of +REP that giveaway_burst collected from one awarder on one giveaway. The
+    awards are inserted with one statement, the flairs go through the flair batch and every outcome is added to the
+    summary comment of the giveaway instead of a reply per command.
+
+    :param contexts: CommentContexts of the group, in comment order.
+    """
+    awarder = contexts[0].author_name
+    subreddit = contexts[0].subreddit
+    with subreddits.advisory_lock(f'rep:{contexts[0].subreddit_name.lower()}:{awarder}'):
+        CommentContext.prefetch(contexts)
+        submission = contexts[0].submission
+        statuses = checks_for_rep_group(contexts)
+        for status in statuses:
+            metrics.inc('rep_check_outcomes_total', status=status.name)
+        accepted = [context for context, status in zip(contexts, statuses) if status == StatusCodes.CHECKS_PASSED]
+        if accepted:
+            command_journal.advance_many([context.comment.id for context in accepted], command_journal.VALIDATED)
+            awarder_rep, awarder_needs_flair = rep_ledger.get_rep(subreddit, awarder)
+            # The parent of the first +REP to each awardee shows their current flair
+            awardee_parents = {}
+            for context in accepted:
+                awardee_parents.setdefault(context.parent_author_name, context.parent)
+            awardee_reps = rep_ledger.record_transactions(
+                submission, awarder, [(context.comment, context.parent_author_name) for context in accepted])
+            for context in accepted:
+                if context.parent_author_name in awardee_reps:
+                    rate_limiter.record(context.subreddit_name, awarder, context.parent_author_name,
+                                        context.comment.created_utc)
+            if awarder_needs_flair:
+                flair_functions.set_rep_flair(subreddit, awarder, awarder_rep)
+            for awardee, parent in awardee_parents.items():
+                if awardee in awardee_reps:
+                    awardee_rep = awardee_reps[awardee]
+                else:
+                    # Already recorded by an earlier attempt, the flair is projected again from the ledger
+                    awardee_rep, _ = rep_ledger.get_rep(subreddit, awardee)
+                comment_ids = [context.comment.id for context in accepted if context.parent_author_name == awardee]
+                flair_functions.set_rep_flair(
+                    subreddit, awardee, awardee_rep, parent.author_flair_text, parent.author_flair_template_id,
+                    on_done=lambda comment_ids=comment_ids: command_journal.advance_many(comment_ids,
+                                                                                         command_journal.FLAIRED))
+    results = [(context.parent_author_name, status) for context, status in zip(contexts, statuses)]
+    bot_responses.giveaway_summary(submission, results, [context.comment.id for context in contexts])
+
+
+def rep_plus_command(context, command_match):
+    if is_mod(context.author, context.subreddit_name):
+        increase_rep(context)
+    # Bursts of +REP on a giveaway are handled together by process_giveaway_burst
+    elif not giveaway_burst.defer(context):
+        process_rep_command(context)
+
+
+def rep_minus_command(context, command_match):
+    if is_mod(context.author, context.subreddit_name):
+        record_rep_transaction(context, -1)
+        bot_responses.rep_subtract_comment(context)
+
+
+def close_submission_command(context, command_match):
+    close_command(context)
+
+
+def mod_command(context, command_match):
+    if context.is_trading_post:
+        # The bot account is a moderator too and is not pinged
+        bot_name = os.getenv('reddit_username', '').lower()
+        mod_list = []
+        for moderator_name in mod_roster.get_moderators(context.reddit, context.subreddit_name):
+            if moderator_name.lower() != bot_name:
+                mod_list.append(f"u/{moderator_name}")
+        bot_responses.mods_request_comment(context, mod_list)
+
+
+def rep_logs_command(context, command_match):
+    if is_mod(context.author, context.subreddit_name):
+        author_name = command_match.group('replogs_user')
+        days = int(command_match.group('replogs_days'))
+        # The report is built by the report worker and messaged to the mod when ready
+        if not rep_reports.submit(context.reddit, context.subreddit_name, context.author, author_name, days):
+            context.author.message(f"Replogs {author_name}",
+                                   "Too many rep logs are being prepared, please try again in a few minutes.")
+
+
+# Handlers of the named groups in CONSTANTS.COMMAND_PATTERN
+COMMAND_HANDLERS = {'rep_plus': rep_plus_command,
+                    'close': close_submission_command,
+                    'rep_minus': rep_minus_command,
+                    'mod': mod_command,
+                    'rep_logs': rep_logs_command}
+
+
+def classify_comment(comment_body):
+    """
+    Finds the command at the start of the comment body in one pass.
+
+    :param comment_body: Body of the comment.
+    :return: tuple of the command name and the match object, or None if the comment has no command.
+    """
+    # Every command starts with one of these characters, the rest of the comments are dropped without running the regex
+    if comment_body[:1] not in CONSTANTS.COMMAND_FIRST_CHARACTERS:
+        return None
+    # De-Escaping for fancy pants editor
+    command_match = CONSTANTS.COMMAND_PATTERN.match(comment_body.replace('\\', ''))
+    if command_match is None:
+        return None
+    return command_match.lastgroup, command_match
 
 
 def load_comment(comment):
@@ -162,74 +393,48 @@ def load_comment(comment):
 
     :param comment: comment that is going to be checked.
     """
-    if comment.author.name == "AutoModerator":
+    command = classify_comment(comment.body)
+    if command is None:
         return None
 
-    # De-Escaping for fancy pants editor
-    comment_body = comment.body.replace('\\', '')
-    if re.match(CONSTANTS.REP_PLUS, comment_body, re.I):
-        if is_mod(comment.author):
-            increase_rep(comment)
+    context = CommentContext(comment)
+    if context.author_name == "AutoModerator":
+        return None
+
+    command_name, command_match = command
+    api_counter.start_command(command_name)
+    metrics.inc('commands_total', command=command_name)
+    started = time.perf_counter()
+    try:
+        state = command_journal.receive(comment.id, command_name)
+        if state == command_journal.REPLIED:
+            return None
+        if state in (command_journal.RECORDED, command_journal.FLAIRED):
+            finish_recorded_command(context, command_name, state)
         else:
-            process_rep_command(comment)
-
-    elif re.match(CONSTANTS.CLOSE, comment_body, re.I):
-        close_command(comment)
-    elif re.match(CONSTANTS.REP_MINUS, comment_body, re.I):
-        if is_mod(comment.author):
-            with closing(psycopg2.connect(os.getenv('DATABASE_URL'), sslmode='require')) as db_conn:
-                with closing(db_conn.cursor()) as cursor:
-                    comment.refresh()
-                    cursor.execute("INSERT INTO rep_transactions VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
-                                   (comment.id,
-                                    comment.created_utc,
-                                    comment.author.name,
-                                    comment.author_flair_text.split()[-1],
-                                    comment.parent().author.name,
-                                    comment.parent().author_flair_text.split()[-1],
-                                    -1,
-                                    comment.submission.id,
-                                    comment.submission.created_utc,
-                                    comment.permalink)
-                                   )
-                db_conn.commit()
-            flair_functions.decrement_rep(comment)
-            bot_responses.rep_subtract_comment(comment)
-    elif re.match(CONSTANTS.MOD, comment_body, re.I):
-        if re.match(r"Trade\sOffer|Giveaway\sEntry", comment.submission.link_flair_text):
-            mod_list = []
-            for moderator in comment._reddit.subreddit("MarketMM2").moderator():
-                if moderator.name != 'mm2repbot':
-                    mod_list.append(f"u/{moderator.name}")
-            bot_responses.mods_request_comment(comment, mod_list)
-    elif regex_match := re.match(CONSTANTS.REP_LOGS, comment_body, re.I):
-        if is_mod(comment.author):
-            author_name = regex_match.group(1)
-            days = int(regex_match.group(2))
-            unix_time_days_ago = time.time() - (min(days, 180) * 24 * 60 * 60)
-            try:
-                redditor = comment._reddit.redditor(author_name).name
-                with closing(psycopg2.connect(os.getenv('DATABASE_URL'), sslmode='require')) as db_conn:
-                    with closing(db_conn.cursor()) as cursor:
-                        cursor.execute(f"SELECT * FROM rep_transactions WHERE awarder='{redditor}' AND comment_created_utc >= '{int(unix_time_days_ago)}'")
-                        results = cursor.fetchall()
-                        table = "# Awarder Rep\n\n"
-                        table += "|comment_id|comment_created_utc|awarder|awarder_rep|awardee|awardee_rep|delta_awardee_rep|submission_id" \
-                                 "|submission_created_utc|permalink|\n|:-|:-|:-|:-|:-|:-|:-|:-|:-|:-|\n"
-                        for row in results:
-                            table += f"|{'|'.join(str(col) for col in row)}|\n"
-
-                        cursor.execute(f"SELECT * FROM rep_transactions WHERE awardee='{redditor}' AND comment_created_utc >= '{int(unix_time_days_ago)}'")
-                        results = cursor.fetchall()
-                        table += "\n# Awardee Karma\n\n"
-                        table += "|comment_id|comment_created_utc|awarder|awarder_rep|awardee|awardee_rep|delta_awardee_rep|submission_id" \
-                                 "|submission_created_utc|permalink|\n|:-|:-|:-|:-|:-|:-|:-|:-|:-|:-|\n"
-                        for row in results:
-                            table += f"|{'|'.join(str(col) for col in row)}|\n"
-
-                        title = f"{author_name} {time.strftime('%I:%M %p %Z')} {days} days rep logs"
-                        profile_subreddit = comment._reddit.subreddit(f"u_{os.getenv('reddit_username')}")
-                        submission = profile_subreddit.submit(title=title, selftext=table)
-                        comment.author.message(title, "https://www.reddit.com{}".format(submission.permalink))
-            except AttributeError:
-                comment.author.message(f"Replogs {author_name}", f"No Redditor exists with username {author_name}.")
+            COMMAND_HANDLERS[command_name](context, command_match)
+        # Commands that do not reply are complete once handled
+        if not context.replied:
+            command_journal.advance(comment.id, command_journal.REPLIED)
+    finally:
+        metrics.observe('command_seconds', time.perf_counter() - started, command=command_name)
+        api_counter.finish_command()
+
+
+def finish_recorded_command(context, command_name, state):
+    """
+    Resumes a rep command whose transaction was recorded before the bot stopped. The recorded transaction is not
+    inserted again, only the flair and the reply that did not happen yet are sent.
+
+    :param context: CommentContext of the comment that triggered the command.
+    :param command_name: Name of the command, rep_plus or rep_minus.
+    :param state: The state the command reached in the journal.
+    """
+    if state == command_journal.RECORDED:
+        awardee_rep, _ = rep_ledger.get_rep(context.subreddit, context.parent_author_name)
+        project_awardee_flair(context, awardee_rep)
+    if command_name == 'rep_plus':
+        bot_responses.rep_rewarded_comment(context)
+    else:
+        bot_responses.rep_subtract_comment(context)
+
@@ -0,0 +1,328 @@
+import os
+import time
+import traceback
+from contextlib import closing
+from queue import Full, Queue
+from threading import Thread
+
+import psycopg2.extras
+
+import api_counter
+import db_pool
+import subreddits
+from rep_log_export import CSV_HEADER, SELFTEXT_LIMIT
+
+SECONDS_PER_DAY = 24 * 60 * 60
+# Longest range a report covers, in days
+MAX_REPORT_DAYS = 180
+# Reports waiting for the worker before new requests are turned down
+REPORT_QUEUE_SIZE = int(os.getenv('REPORT_QUEUE_SIZE', 20))
+# Counterparts listed in the summary
+TOP_COUNTERPARTS = 10
+
+_queue = Queue(maxsize=REPORT_QUEUE_SIZE)
+_worker = None
+stats = {'reports': 0, 'pages': 0, 'rejected': 0, 'failures': 0}
+
+
+def day_of(unix_time) -> int:
+    """
+    Gets the start of the UTC day the time falls in, which is the key of the daily aggregates.
+
+    :param unix_time: Unix time.
+    :return: unix time of the start of the day.
+    """
+    return int(unix_time) - int(unix_time) % SECONDS_PER_DAY
+
+
+def create_table(cursor, subreddit_name):
+    """
+    Creates the daily aggregates table of the subreddit. The first time, it is filled from the existing rep
+    transactions so reports cover the history from the start.
+
+    Every user has one row per day and counterpart with the rep they gave to and received from that counterpart.
+
+    :param cursor: Database cursor.
+    :param subreddit_name: Display name of the subreddit.
+    """
+    rep_daily = subreddits.table(subreddit_name, 'rep_daily')
+    rep_transactions = subreddits.table(subreddit_name, 'rep_transactions')
+    cursor.execute("SELECT to_regclass(%s)", (rep_daily,))
+    if cursor.fetchone()[0] is not None:
+        return
+    cursor.execute(f"""CREATE TABLE {rep_daily} (username TEXT,
+                                                 day BIGINT,
+                                                 counterpart TEXT,
+                                                 given INT NOT NULL DEFAULT 0,
+                                                 received INT NOT NULL DEFAULT 0,
+                                                 net INT NOT NULL DEFAULT 0,
+                                                 PRIMARY KEY (username, day, counterpart))""")
+    cursor.execute(f"""INSERT INTO {rep_daily} (username, day, counterpart, given, received, net)
+                       SELECT username, day, counterpart, SUM(given), SUM(received), SUM(net)
+                       FROM (SELECT awarder AS username, comment_created_utc - comment_created_utc % {SECONDS_PER_DAY}
+                                    AS day, awardee AS counterpart, 1 AS given, 0 AS received, 0 AS net
+                             FROM {rep_transactions}
+                             UNION ALL
+                             SELECT awardee, comment_created_utc - comment_created_utc % {SECONDS_PER_DAY},
+                                    awarder, 0, 1, delta_awardee_rep
+                             FROM {rep_transactions}) AS sides
+                       GROUP BY username, day, counterpart""")
+    print(f"Built {rep_daily} from {cursor.rowcount} rows")
+
+
+def record(cursor, subreddit_name, awarder, awardee, delta, created_utc):
+    """
+    Adds a rep transaction to the daily aggregates. Called in the same database transaction that inserts the rep
+    transaction so the two never disagree. A mod giving rep to themselves updates a single row, see record_many.
+
+    :param cursor: Cursor of the open transaction.
+    :param subreddit_name: Display name of the subreddit.
+    :param awarder: Name of the user giving the rep.
+    :param awardee: Name of the user receiving the rep.
+    :param delta: Change in the awardee rep.
+    :param created_utc: Unix time of the comment that gave the rep.
+    """
+    record_many(cursor, subreddit_name, [(awarder, awardee, delta, created_utc)])
+
+
+def record_many(cursor, subreddit_name, awards):
+    """
+    Adds several rep transactions to the daily aggregates with one statement. Awards to the same rows are summed first
+    because a single insert cannot update a row twice, which also covers the given and received sides of a self award
+    landing on the same row.
+
+    :param cursor: Cursor of the open transaction.
+    :param subreddit_name: Display name of the subreddit.
+    :param awards: list of tuples of the awarder, awardee, delta and comment time.
+    """
+    totals = {}
+    for awarder, awardee, delta, created_utc in awards:
+        day = day_of(created_utc)
+        totals.setdefault((awarder, day, awardee), [0, 0, 0])[0] += 1
+        # Same key as the given side when awarder == awardee
+        received = totals.setdefault((awardee, day, awarder), [0, 0, 0])
+        received[1] += 1
+        received[2] += delta
+    psycopg2.extras.execute_values(
+        cursor,
+        f"INSERT INTO {subreddits.table(subreddit_name, 'rep_daily')} AS daily "
+        "(username, day, counterpart, given, received, net) VALUES %s "
+        "ON CONFLICT (username, day, counterpart) DO UPDATE SET "
+        "given = daily.given + EXCLUDED.given, "
+        "received = daily.received + EXCLUDED.received, "
+        "net = daily.net + EXCLUDED.net",
+        [key + tuple(values) for key, values in totals.items()])
+
+
+def purge(subreddit_name, cutoff) -> int:
+    """
+    Deletes the aggregates of the days before the cutoff.
+
+    :param subreddit_name: Display name of the subreddit.
+    :param cutoff: Unix time before which rep transactions are purged.
+    :return: the number of rows deleted.
+    """
+    with db_pool.get_connection() as db_conn:
+        with closing(db_conn.cursor()) as cursor:
+            cursor.execute(f"DELETE FROM {subreddits.table(subreddit_name, 'rep_daily')} WHERE day < %s",
+                           (day_of(cutoff),))
+            return cursor.rowcount
+
+
+def summarize(cursor, subreddit_name, username, days) -> dict:
+    """
+    Gets the totals of the user over the last days from the daily aggregates. Ranges cover whole UTC days.
+
+    :param cursor: Database cursor.
+    :param subreddit_name: Display name of the subreddit.
+    :param username: Name of the redditor.
+    :param days: Number of days covered.
+    :return: dictionary with the totals and the top counterparts.
+    """
+    rep_daily = subreddits.table(subreddit_name, 'rep_daily')
+    since = day_of(time.time() - days * SECONDS_PER_DAY)
+    cursor.execute(f"SELECT COALESCE(SUM(given), 0), COALESCE(SUM(received), 0), COALESCE(SUM(net), 0), "
+                   "COUNT(DISTINCT counterpart) FILTER (WHERE given > 0), "
+                   "COUNT(DISTINCT counterpart) FILTER (WHERE received > 0) "
+                   f"FROM {rep_daily} WHERE username=%s AND day >= %s", (username, since))
+    given, received, net, given_to, received_from = cursor.fetchone()
+    cursor.execute(f"SELECT counterpart, SUM(given), SUM(received), SUM(net) FROM {rep_daily} "
+                   "WHERE username=%s AND day >= %s GROUP BY counterpart "
+                   "ORDER BY SUM(given) + SUM(received) DESC, counterpart LIMIT %s",
+                   (username, since, TOP_COUNTERPARTS))
+    return {'given': given,
+            'received': received,
+            'net': net,
+            'given_to': given_to,
+            'received_from': received_from,
+            'top_counterparts': cursor.fetchall()}
+
+
+def render_summary(username, days, summary) -> str:
+    """
+    Formats the summary as a short markdown message.
+
+    :param username: Name of the redditor.
+    :param days: Number of days covered.
+    :param summary: dictionary returned by summarize.
+    :return: markdown text.
+    """
+    lines = [f"# u/{username} over the last {days} days\n",
+             "|given|received|net received|gave to|received from|",
+             "|:-|:-|:-|:-|:-|",
+             f"|{summary['given']}|{summary['received']}|{summary['net']}|"
+             f"{summary['given_to']} users|{summary['received_from']} users|"]
+    if summary['top_counterparts']:
+        lines += ["\n## Top counterparts\n", "|user|given|received|net received|", "|:-|:-|:-|:-|"]
+        lines += [f"|u/{counterpart}|{given}|{received}|{net}|"
+                  for counterpart, given, received, net in summary['top_counterparts']]
+    return '\n'.join(lines) + '\n'
+
+
+def paginate(sections, limit=SELFTEXT_LIMIT) -> list:
+    """
+    Joins the markdown tables into pages that each fit in the limit. A table split over pages has its heading and
+    header repeated at the top of the next page.
+
+    :param sections: list of tuples of the section heading and an iterable of table rows.
+    :param limit: Maximum number of characters in a page.
+    :return: list of pages, at least one.
+    """
+    table_header = f"|{'|'.join(CSV_HEADER)}|\n|{':-|' * len(CSV_HEADER)}\n"
+    pages = []
+    lines = []
+    length = 0
+    for heading, rows in sections:
+        section_header = f"# {heading}\n\n{table_header}"
+        if lines and length + len(section_header) > limit:
+            pages.append(''.join(lines))
+            lines, length = [], 0
+        lines.append(section_header if not lines else f"\n{section_header}")
+        length += len(lines[-1])
+        for row in rows:
+            line = f"|{'|'.join(str(col) for col in row)}|\n"
+            if length + len(line) > limit:
+                pages.append(''.join(lines))
+                lines = [section_header]
+                length = len(section_header)
+            lines.append(line)
+            length += len(line)
+    pages.append(''.join(lines))
+    return pages
+
+
+def build_report(reddit, subreddit_name, mod, author_name, days):
+    """
+    Messages the summary of the user to the moderator, then posts the full rep logs on the bot profile and messages
+    their links in a follow up. The summary only needs the daily rollup, so the mod gets it before the slower pages.
+
+    :param reddit: The reddit instance.
+    :param subreddit_name: Display name of the subreddit.
+    :param mod: The moderator who asked for the report.
+    :param author_name: Name of the redditor the report is about.
+    :param days: Number of days covered.
+    """
+    days = min(days, MAX_REPORT_DAYS)
+    try:
+        redditor = reddit.redditor(author_name).name
+    except AttributeError:
+        mod.message(f"Replogs {author_name}", f"No Redditor exists with username {author_name}.")
+        return
+    with db_pool.get_connection() as db_conn:
+        with closing(db_conn.cursor()) as cursor:
+            summary = summarize(cursor, subreddit_name, redditor, days)
+    title = f"{author_name} {time.strftime('%I:%M %p %Z')} {days} days rep logs"
+    mod.message(title, render_summary(redditor, days, summary) + "\nThe full rep logs will follow in another message.")
+
+    rep_transactions = subreddits.table(subreddit_name, 'rep_transactions')
+    since = int(time.time() - days * SECONDS_PER_DAY)
+    with db_pool.get_connection() as db_conn:
+        with closing(db_conn.cursor()) as cursor:
+            cursor.execute(f"SELECT * FROM {rep_transactions} WHERE awarder=%s AND comment_created_utc >= %s "
+                           "ORDER BY comment_created_utc", (redditor, since))
+            given_rows = cursor.fetchall()
+            cursor.execute(f"SELECT * FROM {rep_transactions} WHERE awardee=%s AND comment_created_utc >= %s "
+                           "ORDER BY comment_created_utc", (redditor, since))
+            received_rows = cursor.fetchall()
+
+    profile_subreddit = reddit.subreddit(f"u_{os.getenv('reddit_username')}")
+    permalinks = []
+    pages = paginate([("Awarder Rep", given_rows), ("Awardee Karma", received_rows)])
+    for page_number, page in enumerate(pages, start=1):
+        page_title = title if page_number == 1 else f"{title} (part {page_number})"
+        submission = profile_subreddit.submit(title=page_title, selftext=page)
+        permalinks.append(f"https://www.reddit.com{submission.permalink}")
+    stats['reports'] += 1
+    stats['pages'] += len(pages)
+    mod.message(f"{title} (full)", "\n\n".join(permalinks))
+
+
+def submit(reddit, subreddit_name, mod, author_name, days) -> bool:
+    """
+    Queues a report for the worker so the comment stream is not held up by it.
+
+    :param reddit: The reddit instance.
+    :param subreddit_name: Display name of the subreddit.
+    :param mod: The moderator who asked for the report.
+    :param author_name: Name of the redditor the report is about.
+    :param days: Number of days covered.
+    :return: True if the report was queued, False if the queue is full.
+    """
+    # The API calls of the report count for the !REPLOGS command
+    command = api_counter.current_command()
+    try:
+        _queue.put_nowait((command, (reddit, subreddit_name, mod, author_name, days)))
+        return True
+    except Full:
+        stats['rejected'] += 1
+        if command is not None:
+            api_counter.release(command)
+        return False
+
+
+def _work(on_error):
+    """
+    Builds the queued reports until the stop sentinel is received.
+
+    :param on_error: Function called with the traceback of a failed report.
+    """
+    while True:
+        request = _queue.get()
+        if request is None:
+            break
+        command, report = request
+        try:
+            with api_counter.counting_for(command, [command] if command is not None else []):
+                build_report(*report)
+        except Exception:
+            stats['failures'] += 1
+            on_error(traceback.format_exc())
+
+
+def start(on_error):
+    """
+    Starts the report worker thread.
+
+    :param on_error: Function called with the traceback of a failed report.
+    """
+    global _worker
+    _worker = Thread(target=_work, args=(on_error,), name="rep-reports", daemon=True)
+    _worker.start()
+
+
+def stop():
+    """
+    Stops the worker once the queued reports have been built.
+    """
+    if _worker is not None:
+        _queue.put(None)
+        _worker.join()
+
+
+def queue_depth() -> int:
+    """
+    Gets the number of reports waiting for the worker.
+
+    :return: number of queued reports.
+    """
+    return _queue.qsize()
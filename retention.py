@@ -0,0 +1,139 @@
+import os
+import time
+from contextlib import closing
+from datetime import datetime, timezone
+
+import db_pool
+
+# Days the rep transactions are kept for
+REP_RETENTION_DAYS = int(os.getenv('REP_RETENTION_DAYS', 180))
+# Rows deleted per transaction by the chunked purge
+PURGE_CHUNK_SIZE = int(os.getenv('PURGE_CHUNK_SIZE', 5000))
+# New deployments can create rep_transactions partitioned by month of submission_created_utc
+REP_PARTITIONED = os.getenv('REP_PARTITIONED', '0') == '1'
+# Months of partitions created ahead of time
+PARTITION_MONTHS_AHEAD = 2
+
+
+def _month_start(year, month) -> datetime:
+    """
+    Gets the first moment of the month in UTC, normalising months past December.
+
+    :param year: Year of the month.
+    :param month: Month number, may be larger than 12.
+    :return: datetime of the start of the month.
+    """
+    year += (month - 1) // 12
+    month = (month - 1) % 12 + 1
+    return datetime(year, month, 1, tzinfo=timezone.utc)
+
+
+def retention_cutoff() -> int:
+    """
+    Gets the unix time before which submissions are purged.
+
+    :return: unix time of the retention cutoff.
+    """
+    return int(time.time() - REP_RETENTION_DAYS * 24 * 60 * 60)
+
+
+def is_partitioned(cursor, rep_transactions='rep_transactions') -> bool:
+    """
+    Checks if the rep transactions table is partitioned.
+
+    :param cursor: Database cursor.
+    :param rep_transactions: Name of the rep transactions table of the subreddit.
+    :return: True if the table is partitioned otherwise False.
+    """
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass)",
+                   (rep_transactions,))
+    return cursor.fetchone()[0]
+
+
+def ensure_partitions(cursor, rep_transactions='rep_transactions'):
+    """
+    Creates the monthly partitions from the retention cutoff up to a few months ahead, plus a default partition.
+
+    :param cursor: Database cursor.
+    :param rep_transactions: Name of the rep transactions table of the subreddit.
+    """
+    cutoff = datetime.fromtimestamp(retention_cutoff(), tz=timezone.utc)
+    now = datetime.now(tz=timezone.utc)
+    months = (now.year - cutoff.year) * 12 + now.month - cutoff.month + PARTITION_MONTHS_AHEAD
+    for offset in range(months + 1):
+        start = _month_start(cutoff.year, cutoff.month + offset)
+        end = _month_start(start.year, start.month + 1)
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {rep_transactions}_{start:%Y_%m} PARTITION OF {rep_transactions} "
+                       f"FOR VALUES FROM ({int(start.timestamp())}) TO ({int(end.timestamp())})")
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {rep_transactions}_default PARTITION OF {rep_transactions} DEFAULT")
+
+
+def drop_expired_partitions(cursor, cutoff, rep_transactions='rep_transactions') -> int:
+    """
+    Drops the monthly partitions that end before the cutoff.
+
+    :param cursor: Database cursor.
+    :param cutoff: Unix time before which submissions are purged.
+    :param rep_transactions: Name of the rep transactions table of the subreddit.
+    :return: the number of partitions dropped.
+    """
+    cursor.execute("SELECT child.relname FROM pg_inherits "
+                   "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                   "WHERE pg_inherits.inhparent = %s::regclass", (rep_transactions,))
+    dropped = 0
+    for (partition_name,) in cursor.fetchall():
+        try:
+            partition_month = datetime.strptime(partition_name, f'{rep_transactions}_%Y_%m').replace(tzinfo=timezone.utc)
+        except ValueError:
+            continue
+        if _month_start(partition_month.year, partition_month.month + 1).timestamp() <= cutoff:
+            cursor.execute(f"DROP TABLE {partition_name}")
+            print(f"Dropped partition {partition_name}")
+            dropped += 1
+    return dropped
+
+
+def delete_in_chunks(cutoff, rep_transactions='rep_transactions') -> int:
+    """
+    Deletes the expired rows a chunk at a time, each in its own transaction, so rows are never locked for long.
+
+    :param cutoff: Unix time before which submissions are purged.
+    :param rep_transactions: Name of the rep transactions table of the subreddit.
+    :return: the number of rows deleted.
+    """
+    total_deleted = 0
+    while True:
+        with db_pool.get_connection() as db_conn:
+            with closing(db_conn.cursor()) as cursor:
+                cursor.execute(f"DELETE FROM {rep_transactions} WHERE comment_id IN "
+                               f"(SELECT comment_id FROM {rep_transactions} "
+                               "WHERE submission_created_utc <= %s LIMIT %s)",
+                               (cutoff, PURGE_CHUNK_SIZE))
+                deleted = cursor.rowcount
+        total_deleted += deleted
+        if deleted < PURGE_CHUNK_SIZE:
+            break
+        print(f"Deleted {total_deleted} old rep transactions so far...")
+    return total_deleted
+
+
+def purge_old_rep_transactions(rep_transactions='rep_transactions') -> str:
+    """
+    Removes the rep transactions older than the retention window, by dropping partitions when the table is partitioned
+    and by deleting in chunks otherwise.
+
+    :param rep_transactions: Name of the rep transactions table of the subreddit.
+    :return: summary of what was purged.
+    """
+    cutoff = retention_cutoff()
+    with db_pool.get_connection() as db_conn:
+        with closing(db_conn.cursor()) as cursor:
+            partitioned = is_partitioned(cursor, rep_transactions)
+            if partitioned:
+                dropped = drop_expired_partitions(cursor, cutoff, rep_transactions)
+                ensure_partitions(cursor, rep_transactions)
+    if partitioned:
+        # Rows of partially expired months and the default partition are still deleted row by row
+        deleted = delete_in_chunks(cutoff, rep_transactions)
+        return f"Dropped {dropped} partitions and deleted {deleted} rows from {rep_transactions}"
+    return f"Deleted {delete_in_chunks(cutoff, rep_transactions)} rows from {rep_transactions}"
@@ -0,0 +1,215 @@
+import time
+from collections import deque
+from contextlib import closing
+from threading import Lock
+
+import db_pool
+import subreddits
+
+# Comment ids remembered to skip the comments a new stream or a backfill returns again
+RECENT_IDS_SIZE = 2000
+
+_lock = Lock()
+_recent_ids = set()
+_recent_order = deque()
+# Comments created before this are not processed
+_resume_utc = 0
+# Newest comment that has been processed
+_last_comment_id = None
+_last_comment_utc = 0
+# Creation time of the comments handed to the workers and not processed yet, by comment id
+_in_flight = {}
+_saved_mark = (None, 0)
+# Every process keeps its own resume point
+LAST_COMMENT_ID_KEY = 'last_comment_id' + subreddits.process_key()
+LAST_COMMENT_UTC_KEY = 'last_comment_utc' + subreddits.process_key()
+
+
+def load():
+    """
+    Loads the resume point saved by the previous run. Without one, only comments from now on are processed.
+    """
+    global _resume_utc, _last_comment_id, _last_comment_utc, _saved_mark
+    with db_pool.get_connection() as db_conn:
+        with closing(db_conn.cursor()) as cursor:
+            cursor.execute("SELECT key, value FROM bot_state WHERE key IN (%s, %s)",
+                           (LAST_COMMENT_ID_KEY, LAST_COMMENT_UTC_KEY))
+            state = dict(cursor.fetchall())
+    with _lock:
+        if LAST_COMMENT_UTC_KEY in state:
+            _last_comment_id = state.get(LAST_COMMENT_ID_KEY)
+            _last_comment_utc = _resume_utc = float(state[LAST_COMMENT_UTC_KEY])
+            _saved_mark = (_last_comment_id, _last_comment_utc)
+        else:
+            _resume_utc = time.time()
+        if _last_comment_id:
+            _remember(_last_comment_id)
+
+
+def _resume_point():
+    """
+    Gets the point a restart has to resume from. Workers finish comments out of order, so while an older comment is
+    still queued or being processed the resume point is that comment and not the newest processed one. Must be called
+    with the lock held.
+
+    :return: tuple of the id and creation time of the comment, the id is empty when the comment itself must be read
+             again.
+    """
+    if _in_flight:
+        oldest_utc = min(_in_flight.values())
+        if oldest_utc <= _last_comment_utc:
+            return '', oldest_utc
+    return _last_comment_id, _last_comment_utc
+
+
+def unsaved_mark():
+    """
+    Gets the resume point if it moved since the last save.
+
+    :return: tuple of the comment id and creation time to save, or None if there is nothing new to save.
+    """
+    with _lock:
+        mark = _resume_point()
+    return mark if mark != _saved_mark else None
+
+
+def mark_saved(mark):
+    """
+    Records that the resume point has been saved.
+
+    :param mark: tuple returned by unsaved_mark.
+    """
+    global _saved_mark
+    _saved_mark = mark
+
+
+def save():
+    """
+    Saves the resume point if it moved since the last save.
+    """
+    mark = unsaved_mark()
+    if mark is None:
+        return
+    with db_pool.get_connection() as db_conn:
+        with closing(db_conn.cursor()) as cursor:
+            cursor.executemany("INSERT INTO bot_state (key, value) VALUES (%s, %s) "
+                               "ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value",
+                               [(LAST_COMMENT_ID_KEY, mark[0]), (LAST_COMMENT_UTC_KEY, repr(mark[1]))])
+    mark_saved(mark)
+
+
+def snapshot() -> dict:
+    """
+    Gets the resume point and the recent ids for the warm snapshot. Comments still in flight are left out of the recent
+    ids so that a restart picks them up again.
+
+    :return: dictionary with the resume point and the recently seen comment ids, oldest first.
+    """
+    with _lock:
+        last_comment_id, last_comment_utc = _resume_point()
+        return {'last_comment_id': last_comment_id,
+                'last_comment_utc': last_comment_utc,
+                'recent_ids': [comment_id for comment_id in _recent_order if comment_id not in _in_flight]}
+
+
+def restore(state):
+    """
+    Adds the state of the warm snapshot to the one loaded from the database. The recent ids let the first stream skip
+    the comments processed before the restart, and the resume point moves forward if the snapshot is newer than the
+    last save. Must be called after load.
+
+    :param state: dictionary returned by snapshot.
+    """
+    global _resume_utc, _last_comment_id, _last_comment_utc
+    with _lock:
+        for comment_id in state['recent_ids']:
+            if comment_id not in _recent_ids:
+                _remember(comment_id)
+        if state['last_comment_utc'] > _last_comment_utc:
+            _last_comment_id = state['last_comment_id']
+            _last_comment_utc = _resume_utc = state['last_comment_utc']
+
+
+def remember(comment_id):
+    """
+    Marks the comment as seen so that the stream and the backfill skip it.
+
+    :param comment_id: Id of the comment.
+    """
+    with _lock:
+        _remember(comment_id)
+
+
+def _remember(comment_id):
+    """
+    Adds the id to the recent ids, forgetting the oldest one when full. Must be called with the lock held.
+
+    :param comment_id: Id of the comment.
+    """
+    _recent_ids.add(comment_id)
+    _recent_order.append(comment_id)
+    if len(_recent_order) > RECENT_IDS_SIZE:
+        _recent_ids.discard(_recent_order.popleft())
+
+
+def is_new(comment) -> bool:
+    """
+    Checks if the comment has not been seen yet and is not older than the resume point. The comment is remembered so
+    it will not be processed again, and holds the resume point back until mark_processed is called for it.
+
+    :param comment: Comment from the stream or the backfill.
+    :return: True if the comment should be processed otherwise False.
+    """
+    with _lock:
+        if comment.id in _recent_ids or comment.created_utc < _resume_utc:
+            return False
+        _remember(comment.id)
+        _in_flight[comment.id] = comment.created_utc
+        return True
+
+
+def mark_processed(comment):
+    """
+    Releases the comment from the in-flight comments and moves the newest processed comment to it if it is newer.
+
+    :param comment: Comment that has been processed.
+    """
+    global _last_comment_id, _last_comment_utc
+    with _lock:
+        _in_flight.pop(comment.id, None)
+        if comment.created_utc >= _last_comment_utc:
+            _last_comment_id = comment.id
+            _last_comment_utc = comment.created_utc
+
+
+def reached_resume_point(comment) -> bool:
+    """
+    Checks if a backfill going back from the newest comments has reached the comments processed before.
+
+    :param comment: Comment of the listing, newest first.
+    :return: True if the backfill should stop at this comment otherwise False.
+    """
+    return comment.created_utc < _resume_utc or comment.id == _last_comment_id
+
+
+def backfill(subreddit, submit):
+    """
+    Pages through the newest comments of the subreddit back to the resume point and submits the missed ones,
+    oldest first. Reddit listings go back at most 1000 comments.
+
+    :param subreddit: The subreddit whose comments are read.
+    :param submit: Function called with each missed comment.
+    :return: the number of comments submitted.
+    """
+    missed = []
+    for comment in subreddit.comments(limit=None):
+        if reached_resume_point(comment):
+            break
+        if subreddits.owns(comment):
+            missed.append(comment)
+    submitted = 0
+    for comment in reversed(missed):
+        if is_new(comment):
+            submit(comment)
+            submitted += 1
+    return submitted
@@ -0,0 +1,73 @@
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+
+# Submissions kept, the least recently used one is evicted first
+SUBMISSION_CACHE_SIZE = int(os.getenv('SUBMISSION_CACHE_SIZE', 1000))
+# Seconds a submission is served from the cache before it is fetched again
+SUBMISSION_CACHE_TTL = int(os.getenv('SUBMISSION_CACHE_TTL', 60))
+
+_lock = Lock()
+# Submissions by fullname with the time they expire, in least recently used order
+_submissions = OrderedDict()
+_stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0, 'invalidated': 0}
+
+
+def get(fullname):
+    """
+    Gets the submission if it was fetched less than the TTL ago.
+
+    :param fullname: Fullname of the submission, e.g. the link_id of a comment.
+    :return: praw Submission or None if it is not cached.
+    """
+    with _lock:
+        entry = _submissions.get(fullname)
+        if entry is None:
+            _stats['misses'] += 1
+            return None
+        submission, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del _submissions[fullname]
+            _stats['expired'] += 1
+            _stats['misses'] += 1
+            return None
+        _submissions.move_to_end(fullname)
+        _stats['hits'] += 1
+        return submission
+
+
+def put(submission):
+    """
+    Caches a freshly fetched submission, evicting the least recently used one when full.
+
+    :param submission: praw Submission.
+    """
+    with _lock:
+        _submissions[submission.fullname] = (submission, time.monotonic() + SUBMISSION_CACHE_TTL)
+        _submissions.move_to_end(submission.fullname)
+        while len(_submissions) > SUBMISSION_CACHE_SIZE:
+            _submissions.popitem(last=False)
+            _stats['evicted'] += 1
+
+
+def invalidate(fullname):
+    """
+    Forgets the submission so that the next command fetches its new state, e.g. after the bot closed it.
+
+    :param fullname: Fullname of the submission.
+    """
+    with _lock:
+        if _submissions.pop(fullname, None) is not None:
+            _stats['invalidated'] += 1
+
+
+def stats() -> dict:
+    """
+    Gets the cache counters and the hit rate.
+
+    :return: dictionary with the counters, the number of cached submissions and the fraction of lookups that hit.
+    """
+    with _lock:
+        lookups = _stats['hits'] + _stats['misses']
+        return {**_stats, 'size': len(_submissions), 'hit_rate': _stats['hits'] / lookups if lookups else 0.0}
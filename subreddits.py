@@ -0,0 +1,124 @@
+import json
+import os
+import re
+import time
+import zlib
+from contextlib import closing, contextmanager
+
+import CONSTANTS
+import db_pool
+
+# Settings of every subreddit the bot can serve. Other subreddits are added with the SUBREDDIT_SETTINGS environment
+# variable holding a JSON object with the same keys, e.g. {"OtherSub": {"table_prefix": "othersub_", ...}}
+SUBREDDIT_SETTINGS = {'MarketMM2': {'config_wiki_page': CONSTANTS.CONFIG_WIKI_PAGE,
+                                    'rep_flair_id': CONSTANTS.REP_FLAIR_ID,
+                                    'trade_ended_flair_id': CONSTANTS.TRADE_ENDED_FLAIR_ID,
+                                    # Prefix of the rep_transactions and user_rep tables of the subreddit
+                                    'table_prefix': ''}}
+SUBREDDIT_SETTINGS.update(json.loads(os.getenv('SUBREDDIT_SETTINGS', '{}')))
+_settings_by_name = {name.lower(): settings for name, settings in SUBREDDIT_SETTINGS.items()}
+for _settings in SUBREDDIT_SETTINGS.values():
+    if not re.fullmatch(r"[a-z0-9_]*", _settings['table_prefix']):
+        raise ValueError(f"Invalid table prefix {_settings['table_prefix']}")
+
+# Subreddits served by this process, joined with + like a multireddit
+SUBREDDITS = os.getenv('SUBREDDITS', 'MarketMM2').split('+')
+# Processes sharing the same subreddits split the submissions between them
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', 1))
+SHARD_INDEX = int(os.getenv('SHARD_INDEX', 0))
+
+
+def settings(subreddit_name) -> dict:
+    """
+    Gets the settings of the subreddit.
+
+    :param subreddit_name: Display name of the subreddit, case insensitive.
+    :return: dictionary of the subreddit settings.
+    """
+    return _settings_by_name[subreddit_name.lower()]
+
+
+def table(subreddit_name, table_name) -> str:
+    """
+    Gets the name of the table holding the data of the subreddit.
+
+    :param subreddit_name: Display name of the subreddit.
+    :param table_name: rep_transactions or user_rep.
+    :return: name of the table with the subreddit prefix.
+    """
+    return settings(subreddit_name)['table_prefix'] + table_name
+
+
+def multireddit(reddit):
+    """
+    Gets the subreddits served by this process as one multireddit, so a single stream covers all of them.
+
+    :param reddit: The reddit instance.
+    :return: praw Subreddit instance.
+    """
+    return reddit.subreddit('+'.join(SUBREDDITS))
+
+
+def owns(comment) -> bool:
+    """
+    Checks if the comment belongs to the shard of this process. Comments of a submission always go to the same shard.
+
+    :param comment: Comment from the stream.
+    :return: True if this process should process the comment otherwise False.
+    """
+    return SHARD_COUNT == 1 or zlib.crc32(comment.link_id.encode()) % SHARD_COUNT == SHARD_INDEX
+
+
+def process_key() -> str:
+    """
+    Gets a key identifying the subreddits and shard of this process, used to keep the state of every process apart.
+
+    :return: empty string for the default single process deployment, otherwise the subreddits and shard.
+    """
+    if SUBREDDITS == ['MarketMM2'] and SHARD_COUNT == 1:
+        return ''
+    return f":{'+'.join(SUBREDDITS).lower()}:{SHARD_INDEX}"
+
+
+@contextmanager
+def advisory_lock(name, wait=True, force=False):
+    """
+    Holds a Postgres advisory lock so that only one shard works on the named resource at a time. The lock is bound to
+    a connection of the lock pool that is kept for the duration of the block, the block itself takes its connections
+    from the query pool.
+
+    :param name: Name of the locked resource.
+    :param wait: Waits for the lock if True, otherwise gives up straight away if another shard has it.
+    :param force: Takes the lock even with a single shard, for resources also shared by separate bot processes.
+    :return: True if the lock was acquired otherwise False.
+    """
+    if SHARD_COUNT == 1 and not force:
+        # A single process always owns every resource
+        yield True
+        return
+    with db_pool.get_lock_connection() as db_conn:
+        with closing(db_conn.cursor()) as cursor:
+            if wait:
+                cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (name,))
+                acquired = True
+            else:
+                cursor.execute("SELECT pg_try_advisory_xact_lock(hashtext(%s))", (name,))
+                acquired = cursor.fetchone()[0]
+            yield acquired
+
+
+def claim(job_name) -> bool:
+    """
+    Claims the daily job for this process. Only the first process to claim the job on a given day gets to run it, the
+    claim is kept in bot_state.
+
+    :param job_name: Name of the job.
+    :return: True if this process should run the job otherwise False.
+    """
+    today = time.strftime('%Y-%m-%d')
+    with db_pool.get_connection() as db_conn:
+        with closing(db_conn.cursor()) as cursor:
+            cursor.execute("INSERT INTO bot_state (key, value) VALUES (%s, %s) "
+                           "ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value WHERE bot_state.value <> EXCLUDED.value",
+                           (f'job:{job_name}', today))
+            return cursor.rowcount == 1
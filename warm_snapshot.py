@@ -0,0 +1,70 @@
+import json
+import os
+import time
+import traceback
+
+import config_manager
+import mod_roster
+import rate_limiter
+import stream_state
+import subreddits
+
+# Local file the warm state is kept in between restarts, one per process
+SNAPSHOT_FILE = os.getenv('SNAPSHOT_FILE', f"warm_state{subreddits.process_key().replace(':', '_')}.json")
+# Snapshots older than this are ignored and the state is loaded cold, in seconds
+MAX_SNAPSHOT_AGE = int(os.getenv('MAX_SNAPSHOT_AGE', 60 * 60))
+# Bumped whenever the layout of the snapshot changes, snapshots of another version are ignored
+SNAPSHOT_VERSION = 1
+
+
+def save(path=SNAPSHOT_FILE):
+    """
+    Writes the config, the moderator rosters, the rate limit windows and the stream state to the snapshot file. The
+    file is replaced in one step so a crash while saving never leaves half a snapshot.
+
+    :param path: Path of the snapshot file.
+    """
+    state = {'version': SNAPSHOT_VERSION,
+             'saved_utc': time.time(),
+             'subreddits': subreddits.SUBREDDITS,
+             'config': config_manager.snapshot(),
+             'mod_roster': mod_roster.snapshot(),
+             'rate_limiter': rate_limiter.snapshot(),
+             'stream_state': stream_state.snapshot()}
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'w') as snapshot_file:
+        json.dump(state, snapshot_file)
+    os.replace(temporary_path, path)
+
+
+def read(path=SNAPSHOT_FILE):
+    """
+    Reads the snapshot file if it was saved recently by a process serving the same subreddits.
+
+    :param path: Path of the snapshot file.
+    :return: dictionary written by save or None if there is no usable snapshot.
+    """
+    try:
+        with open(path) as snapshot_file:
+            state = json.load(snapshot_file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        print(f"Could not read the warm snapshot {path}\n{traceback.format_exc()}")
+        return None
+    if (state.get('version') != SNAPSHOT_VERSION or state['subreddits'] != subreddits.SUBREDDITS
+            or time.time() - state['saved_utc'] > MAX_SNAPSHOT_AGE):
+        return None
+    return state
+
+
+def restore_caches(state):
+    """
+    Loads the config, the moderator rosters and the rate limit windows of the snapshot. The stream state is restored
+    separately with stream_state.restore once it has been loaded from the database.
+
+    :param state: dictionary returned by read.
+    """
+    config_manager.restore(state['config'])
+    mod_roster.restore(state['mod_roster'])
+    rate_limiter.restore(state['rate_limiter'])